@@ -3,19 +3,28 @@ from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from app.cache import TTLCache
 from app.config import settings
-from app.database import get_db, TIMEZONE
-from app.models.teacher import Teacher
-from app.models.student import Student
+from app.database import get_async_db, TIMEZONE
+from app.loaders import load_user_with_roles
 from app.models.user import User
-from app.models.admin import Admin
-from app.schemas.token import TokenData
+from app.models.refresh_token import RefreshToken
+from app.schemas.token import TokenData, Principal, PrincipalRole
 
 ALGORITHM = settings.ALGORITHM
 SECRET_KEY = settings.SECRET_KEY
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
+REFRESH_TOKEN_EXPIRE_DAYS = settings.REFRESH_TOKEN_EXPIRE_DAYS
+TOKEN_VERSION_CACHE_TTL_SECONDS = settings.TOKEN_VERSION_CACHE_TTL_SECONDS
+TOKEN_VERSION_CACHE_MAX_SIZE = settings.TOKEN_VERSION_CACHE_MAX_SIZE
+
+ACCESS_TOKEN = 'access'
+REFRESH_TOKEN = 'refresh'
+EMAIL_CONFIRMATION_TOKEN = 'email_confirmation'
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='auth/token')
 
@@ -30,83 +39,179 @@ def create_token(data: dict, expires_delta: timedelta) -> str:
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def verify_token(token: str, credentials_exception: HTTPException) -> TokenData:
+def verify_token(token: str, credentials_exception: HTTPException, token_type: str) -> TokenData:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
         user_id: str = payload.get('user_id')
-        if user_id is None:
+        if user_id is None or payload.get('token_type') != token_type:
             raise credentials_exception
 
-        return TokenData(id=user_id)
+        return TokenData(
+            id=user_id,
+            token_type=token_type,
+            version=payload.get('version'),
+            jti=payload.get('jti'),
+            admin_id=payload.get('admin_id'),
+            teacher_id=payload.get('teacher_id'),
+            student_id=payload.get('student_id')
+        )
 
     except JWTError:
         raise credentials_exception
 
 
-async def get_current_user(
-        token: str = Depends(oauth2_scheme),
-        db: Session = Depends(get_db)
-):
-    credentials_exception = HTTPException(
+def create_access_token(user: User) -> str:
+    # Роли и версия токенов пользователя в самом токене: права проверяются без загрузки пользователя и ролей
+    return create_token(
+        data={
+            'user_id': str(user.id),
+            'token_type': ACCESS_TOKEN,
+            'version': user.token_version,
+            'admin_id': str(user.admin.id) if user.admin else None,
+            'teacher_id': str(user.teacher.id) if user.teacher else None,
+            'student_id': str(user.student.id) if user.student else None
+        },
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
+
+async def create_tokens(user: User, db: AsyncSession) -> dict:
+    # Токен обновления одноразовый: при обновлении он помечается использованным и выдаётся новый
+    refresh_token = RefreshToken(user_id=user.id)
+    db.add(refresh_token)
+    await db.flush()
+
+    return {
+        'access_token': create_access_token(user),
+        'refresh_token': create_token(
+            data={
+                'user_id': str(user.id),
+                'token_type': REFRESH_TOKEN,
+                'version': user.token_version,
+                'jti': str(refresh_token.id)
+            },
+            expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        ),
+        'token_type': 'bearer'
+    }
+
+
+# Кеш действует в пределах процесса: после отзыва токенов запись сбрасывается только здесь,
+# остальные процессы перестанут принимать отозванные токены не позже чем через TOKEN_VERSION_CACHE_TTL_SECONDS
+token_version_cache = TTLCache(TOKEN_VERSION_CACHE_TTL_SECONDS, TOKEN_VERSION_CACHE_MAX_SIZE)
+
+
+def revoke_tokens(db, user):
+    user.token_version += 1
+    # Запись сбрасывается после commit, иначе параллельный запрос может успеть закешировать старую версию
+    db.info.setdefault('revoked_token_versions', set()).add(str(user.id))
+
+
+@event.listens_for(Session, 'after_commit')
+def drop_revoked_token_versions(session):
+    for user_id in session.info.pop('revoked_token_versions', ()):
+        token_version_cache.pop(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_revoked_token_versions(session):
+    session.info.pop('revoked_token_versions', None)
+
+
+def get_credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Невалидные учётные данные',
         headers={'WWW-Authenticate': 'Bearer'},
     )
 
-    token_data = verify_token(token, credentials_exception)
 
-    user = db.query(User).where(User.id == token_data.id).first()
-    if user is None:
-        raise credentials_exception
-    if user.terminated:
+def check_principal(principal):
+    if principal.terminated:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Ваш аккаунт был деактивирован'
         )
-    if not user.email_confirmed:
+    if not principal.email_confirmed:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Пожалуйста, подтвердите адрес электронной почты'
         )
 
+
+def get_token_principal(token_data: TokenData) -> Principal:
+    # Токены доступа выдаются только действующим пользователям с подтверждённым адресом
+    return Principal(
+        id=token_data.id,
+        terminated=False,
+        email_confirmed=True,
+        admin=PrincipalRole(id=token_data.admin_id, user_id=token_data.id) if token_data.admin_id else None,
+        teacher=PrincipalRole(id=token_data.teacher_id, user_id=token_data.id) if token_data.teacher_id else None,
+        student=PrincipalRole(id=token_data.student_id, user_id=token_data.id) if token_data.student_id else None
+    )
+
+
+async def get_current_user(
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    token_data = verify_token(token, get_credentials_exception(), ACCESS_TOKEN)
+
+    if token_version_cache.get(token_data.id) != token_data.version:
+        # Версия не в кеше или устарела: сверяется с базой, отзыв по причине блокировки
+        # или смены адреса сообщается так же, как при входе
+        user = await db.scalar(select(User).where(User.id == token_data.id))
+        if user is None:
+            raise get_credentials_exception()
+        token_version_cache.set(str(user.id), user.token_version)
+        check_principal(user)
+        if user.token_version != token_data.version:
+            raise get_credentials_exception()
+
+    return get_token_principal(token_data)
+
+
+async def get_current_user_with_roles(
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_async_db)
+) -> User:
+    # Пользователь с полной информацией о ролях, заодно обновляет версию токенов в кеше
+    token_data = verify_token(token, get_credentials_exception(), ACCESS_TOKEN)
+
+    user = await load_user_with_roles(db, token_data.id, full_info=True)
+    if user is None:
+        raise get_credentials_exception()
+    token_version_cache.set(str(user.id), user.token_version)
+    check_principal(user)
+    if user.token_version != token_data.version:
+        raise get_credentials_exception()
+
     return user
 
 
-async def get_current_admin(
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-):
-    admin = db.query(Admin).where(Admin.user_id == current_user.id).first()
-    if admin is None:
+async def get_current_admin(current_user: Principal = Depends(get_current_user)) -> PrincipalRole:
+    if current_user.admin is None:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Недостаточно прав',
         )
-    return admin
+    return current_user.admin
 
 
-async def get_current_teacher(
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-):
-    teacher = db.query(Teacher).where(Teacher.user_id == current_user.id).first()
-    if teacher is None:
+async def get_current_teacher(current_user: Principal = Depends(get_current_user)) -> PrincipalRole:
+    if current_user.teacher is None:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Недостаточно прав',
         )
-    return teacher
+    return current_user.teacher
 
 
-async def get_current_student(
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-):
-    student = db.query(Student).where(Student.user_id == current_user.id).first()
-    if student is None:
+async def get_current_student(current_user: Principal = Depends(get_current_user)) -> PrincipalRole:
+    if current_user.student is None:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Недостаточно прав',
         )
-    return student
+    return current_user.student
@@ -1,6 +1,35 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+from app.config import settings
+from app.metrics import Histogram, Counter, Gauge
+
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=settings.PASSWORD_HASH_ROUNDS)
+
+# bcrypt занимает процессор на сотни миллисекунд, поэтому в обработчиках запросов он выполняется
+# в отдельном ограниченном пуле потоков, а не в цикле событий
+password_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix='password-hash'
+)
+password_hash_tasks_lock = threading.Lock()
+password_hash_tasks = 0
+
+PASSWORD_HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+password_hash_seconds = Histogram(
+    'password_hash_seconds', 'Время хеширования и проверки пароля', 'operation', PASSWORD_HASH_BUCKETS
+)
+password_hash_rejections = Counter(
+    'password_hash_rejections_total', 'Отклонённые из-за переполнения очереди операции с паролями'
+)
+Gauge('password_hash_tasks', 'Операции с паролями в работе и в очереди', None,
+      lambda: {None: password_hash_tasks})
 
 
 def verify_password(plain_password, hashed_password):
@@ -9,3 +38,41 @@ def verify_password(plain_password, hashed_password):
 
 def get_password_hash(password):
     return pwd_context.hash(password)
+
+
+def measure_password_operation(operation, function, *args):
+    started_at = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        password_hash_seconds.observe(operation, time.perf_counter() - started_at)
+
+
+async def run_password_operation(operation, function, *args):
+    global password_hash_tasks
+
+    with password_hash_tasks_lock:
+        if password_hash_tasks >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_LIMIT:
+            password_hash_rejections.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Сервер перегружен, повторите попытку позже',
+                headers={'Retry-After': '1'}
+            )
+        password_hash_tasks += 1
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            password_hash_executor, measure_password_operation, operation, function, *args
+        )
+    finally:
+        with password_hash_tasks_lock:
+            password_hash_tasks -= 1
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await run_password_operation('verify', verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    return await run_password_operation('hash', get_password_hash, password)
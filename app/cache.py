@@ -0,0 +1,30 @@
+import time
+
+
+class TTLCache:
+    # Кеш в памяти процесса: запись живёт ttl секунд, при переполнении вытесняется самая старая,
+    # ttl = 0 отключает кеш
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = {}
+
+    def get(self, key):
+        cached = self.entries.get(key)
+        if cached is None:
+            return None
+        expiration_time, value = cached
+        if expiration_time <= time.monotonic():
+            self.entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value):
+        if not self.ttl:
+            return
+        if key not in self.entries and len(self.entries) >= self.max_size:
+            self.entries.pop(next(iter(self.entries)), None)
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
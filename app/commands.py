@@ -0,0 +1,49 @@
+import asyncio
+import sys
+
+from app.database import AsyncSessionLocal, async_engine
+from app.rollups import rebuild_daily_subscription_sales
+from app.slot_occurrences import extend_slot_occurrences
+from app.subscription_lessons import repair_lessons_used
+
+
+async def rebuild_rollups():
+    async with AsyncSessionLocal() as db:
+        await rebuild_daily_subscription_sales(db)
+        await db.commit()
+    print('Сводные таблицы статистики пересчитаны')
+
+
+async def extend_slot_occurrences_command():
+    async with AsyncSessionLocal() as db:
+        await extend_slot_occurrences(db)
+        await db.commit()
+    print('Повторения слотов продлены')
+
+
+async def repair_lessons_used_command():
+    async with AsyncSessionLocal() as db:
+        repaired_count = await repair_lessons_used(db)
+        await db.commit()
+    print(f'Счётчики занятий абонементов пересчитаны, исправлено: {repaired_count}')
+
+
+COMMANDS = {
+    'rebuild-rollups': rebuild_rollups,
+    'extend-slot-occurrences': extend_slot_occurrences_command,
+    'repair-lessons-used': repair_lessons_used_command
+}
+
+
+async def run_command(command):
+    try:
+        await COMMANDS[command]()
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in COMMANDS:
+        print(f'Использование: python -m app.commands {{{"|".join(COMMANDS)}}}')
+        sys.exit(1)
+    asyncio.run(run_command(sys.argv[1]))
@@ -14,6 +14,17 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     DATABASE_NAME: str
 
+    # Настройки пула подключений к базе данных (отдельный пул у каждого процесса и у каждого из движков)
+    DATABASE_POOL_SIZE: Optional[int] = 5
+    DATABASE_MAX_OVERFLOW: Optional[int] = 10
+    DATABASE_POOL_TIMEOUT_SECONDS: Optional[float] = 30
+    DATABASE_POOL_RECYCLE_SECONDS: Optional[int] = 1800
+    DATABASE_POOL_PRE_PING: Optional[bool] = True
+    DATABASE_STATEMENT_TIMEOUT_MS: Optional[int] = None
+    # Работа через пулер в режиме транзакций (PgBouncer и аналоги): без именованных подготовленных запросов
+    # и без параметров сессии при подключении, таймаут запросов в этом случае задаётся на стороне базы
+    DATABASE_POOLER_MODE: Optional[bool] = False
+
     # Настройки приложения
     APP_NAME: str
     APP_VERSION: str
@@ -26,7 +37,16 @@ class Settings(BaseSettings):
     # Настройки JWT авторизации
     SECRET_KEY: str
     ALGORITHM: Optional[str] = 'HS256'
-    ACCESS_TOKEN_EXPIRE_MINUTES: Optional[int] = 60
+    ACCESS_TOKEN_EXPIRE_MINUTES: Optional[int] = 15
+    REFRESH_TOKEN_EXPIRE_DAYS: Optional[int] = 30
+    # Кеш версий токенов пользователей в памяти процесса, 0 - без кеша
+    TOKEN_VERSION_CACHE_TTL_SECONDS: Optional[float] = 30
+    TOKEN_VERSION_CACHE_MAX_SIZE: Optional[int] = 10000
+
+    # Настройки хеширования паролей: стоимость bcrypt, потоки пула и ожидающие операции сверх них
+    PASSWORD_HASH_ROUNDS: Optional[int] = 12
+    PASSWORD_HASH_WORKERS: Optional[int] = 2
+    PASSWORD_HASH_QUEUE_LIMIT: Optional[int] = 32
 
     # Настройки электронных писем
     SENDER_EMAIL: str
@@ -34,8 +54,33 @@ class Settings(BaseSettings):
     SMTP_HOST: str
     SMTP_PORT: int
     SSL_CONTEXT: Optional[ssl.SSLContext] = ssl.create_default_context()
+    # false - подключение без шифрования и авторизации, только для локального SMTP-сервера (см. benchmarks)
+    SMTP_USE_SSL: Optional[bool] = True
     EMAIL_CONFIRMATION_TOKEN_EXPIRE_MINUTES: Optional[int] = 60
 
+    # Настройки очереди электронных писем
+    EMAIL_OUTBOX_WORKER_ENABLED: Optional[bool] = True
+    EMAIL_OUTBOX_BATCH_SIZE: Optional[int] = 100
+    EMAIL_OUTBOX_POLL_INTERVAL_SECONDS: Optional[float] = 5
+    EMAIL_OUTBOX_MAX_ATTEMPTS: Optional[int] = 5
+    EMAIL_OUTBOX_RETRY_DELAY_SECONDS: Optional[int] = 30
+
+    # Повторения слотов преподавателей хранятся на столько недель вперёд и продлеваются фоновой задачей,
+    # на существующей базе их нужно заполнить командой python -m app.commands extend-slot-occurrences
+    SLOT_OCCURRENCES_WORKER_ENABLED: Optional[bool] = True
+    SLOT_OCCURRENCES_WEEKS_AHEAD: Optional[int] = 12
+    SLOT_OCCURRENCES_REFRESH_INTERVAL_SECONDS: Optional[float] = 3600
+
+    # Настройки поиска
+    SEARCH_TOTAL_LIMIT: Optional[int] = None
+
+    # Настройки статистики: покупки абонементов читаются из сводной таблицы по дням,
+    # после включения на существующей базе её нужно заполнить командой python -m app.commands rebuild-rollups
+    STATISTICS_USE_ROLLUPS: Optional[bool] = True
+    # Кеш посещаемости и загрузки залов в памяти процесса, 0 - без кеша
+    STATISTICS_CACHE_TTL_SECONDS: Optional[float] = 60
+    STATISTICS_CACHE_MAX_SIZE: Optional[int] = 1000
+
     @field_validator('DATABASE_URL')
     def validate_database_url(cls, v):
         if not v.startswith('postgresql://'):
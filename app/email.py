@@ -1,388 +1,353 @@
+import asyncio
 import smtplib
-from datetime import timedelta
+from datetime import datetime, timedelta
 from email.message import EmailMessage
 
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, select, insert, func, literal, String
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.auth.jwt import create_token
+from app.auth.jwt import create_token, EMAIL_CONFIRMATION_TOKEN
 from app.config import settings
-from app.models import User, TeacherGroup, StudentGroup, Teacher, Student
+from app.database import SessionLocal, TIMEZONE
+from app.models import User, TeacherGroup, StudentGroup, Teacher, Student, LessonType, Subscription, \
+    SubscriptionTemplate
+from app.models import EmailOutbox, EMAIL_PENDING, EMAIL_SENT, EMAIL_FAILED
 
 SENDER_EMAIL = settings.SENDER_EMAIL
 SENDER_PASSWORD = settings.SENDER_PASSWORD
 SMTP_HOST = settings.SMTP_HOST
 SMTP_PORT = settings.SMTP_PORT
 SSL_CONTEXT = settings.SSL_CONTEXT
+SMTP_USE_SSL = settings.SMTP_USE_SSL
 EMAIL_CONFIRMATION_TOKEN_EXPIRE_MINUTES = settings.EMAIL_CONFIRMATION_TOKEN_EXPIRE_MINUTES
 
+EMAIL_OUTBOX_BATCH_SIZE = settings.EMAIL_OUTBOX_BATCH_SIZE
+EMAIL_OUTBOX_POLL_INTERVAL_SECONDS = settings.EMAIL_OUTBOX_POLL_INTERVAL_SECONDS
+EMAIL_OUTBOX_MAX_ATTEMPTS = settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+EMAIL_OUTBOX_RETRY_DELAY_SECONDS = settings.EMAIL_OUTBOX_RETRY_DELAY_SECONDS
 
-async def send_email(message: EmailMessage):
+
+def queue_email(db: AsyncSession, recipient, subject, content):
+    # Письмо сохраняется в той же транзакции, что и изменения обработчика,
+    # и отправляется фоновым обработчиком очереди (см. run_email_outbox_worker)
+    db.add(EmailOutbox(
+        recipient=recipient,
+        subject=subject,
+        content=content
+    ))
+
+
+def select_email_audience(*criteria, students_only=False, level_ids=None, dance_style_ids=None):
+    # Получатели рассылок: действующие ученики и преподаватели с подтверждённым адресом, согласные
+    # на рассылку. Выбираются только нужные для писем столбцы, без объектов пользователей
+    audience = select(User.id, User.email, User.first_name).where(
+        User.terminated == False,
+        User.email_confirmed == True,
+        User.receive_email == True,
+        User.student.has() if students_only else or_(User.teacher.has(), User.student.has()),
+        *criteria
+    )
+
+    if level_ids:
+        audience = audience.where(User.student.has(Student.level_id.in_(level_ids)))
+
+    if dance_style_ids:
+        # Преподаватели этих стилей и ученики с абонементами на занятия этих стилей
+        dance_style_lesson_types = LessonType.dance_style_id.in_(dance_style_ids)
+        audience = audience.where(or_(
+            User.teacher.has(Teacher.lesson_types.any(dance_style_lesson_types)),
+            User.student.has(Student.subscriptions.any(Subscription.subscription_template.has(
+                SubscriptionTemplate.lesson_types.any(dance_style_lesson_types)
+            )))
+        ))
+
+    return audience
+
+
+async def queue_audience_email(db: AsyncSession, audience, subject, content):
+    # Письма всем получателям сохраняются одним INSERT ... SELECT, без загрузки получателей в приложение.
+    # content - текст письма после приветствия по имени
+    await db.flush()
+    recipients = audience.subquery()
+    await db.execute(insert(EmailOutbox).from_select(
+        ['id', 'recipient', 'subject', 'content', 'status', 'attempts', 'next_attempt_at', 'created_at'],
+        select(
+            func.gen_random_uuid(),
+            recipients.c.email,
+            literal(subject, String),
+            func.concat('Здравствуйте, ', recipients.c.first_name, '!\n\n', content),
+            literal(EMAIL_PENDING, String),
+            0,
+            func.now(),
+            func.now()
+        )
+    ))
+
+
+def open_smtp_connection():
+    if not SMTP_USE_SSL:
+        return smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+    server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT)
+    server.login(SENDER_EMAIL, SENDER_PASSWORD)
+    return server
+
+
+def create_email_message(email: EmailOutbox):
+    message = EmailMessage()
     message['From'] = SENDER_EMAIL
+    message['To'] = email.recipient
+    message['Subject'] = email.subject
+    message.set_content(email.content)
+    return message
+
+
+def schedule_email_retry(email: EmailOutbox, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = EMAIL_FAILED
+    else:
+        email.next_attempt_at = datetime.now(TIMEZONE) + timedelta(
+            seconds=EMAIL_OUTBOX_RETRY_DELAY_SECONDS * 2 ** (email.attempts - 1)
+        )
+
+
+def send_email_outbox_batch(db: Session):
+    emails = db.query(EmailOutbox).where(
+        EmailOutbox.status == EMAIL_PENDING,
+        EmailOutbox.next_attempt_at <= datetime.now(TIMEZONE)
+    ).order_by(
+        EmailOutbox.next_attempt_at
+    ).limit(EMAIL_OUTBOX_BATCH_SIZE).with_for_update(skip_locked=True).all()
+    if not emails:
+        return 0
+
+    try:
+        server = open_smtp_connection()
+    except (smtplib.SMTPException, OSError) as e:
+        for email in emails:
+            schedule_email_retry(email, e)
+        db.commit()
+        return len(emails)
+
+    with server:
+        for email in emails:
+            try:
+                server.send_message(create_email_message(email))
+            except (smtplib.SMTPException, OSError) as e:
+                schedule_email_retry(email, e)
+            else:
+                email.attempts += 1
+                email.status = EMAIL_SENT
+                email.sent_at = datetime.now(TIMEZONE)
+                email.last_error = None
+
+    db.commit()
 
-    with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as server:
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        server.send_message(message)
+    return len(emails)
 
 
-async def send_email_confirmation_token(user_id, email, name):
+def send_email_outbox():
+    with SessionLocal() as db:
+        return send_email_outbox_batch(db)
+
+
+async def run_email_outbox_worker():
+    while True:
+        try:
+            sent_count = await asyncio.to_thread(send_email_outbox)
+        except Exception as e:
+            print(f'Ошибка при отправке писем из очереди: {e}')
+            sent_count = 0
+        if sent_count < EMAIL_OUTBOX_BATCH_SIZE:
+            await asyncio.sleep(EMAIL_OUTBOX_POLL_INTERVAL_SECONDS)
+
+
+async def send_email_confirmation_token(user_id, email, name, db: AsyncSession):
     expires_delta = timedelta(minutes=EMAIL_CONFIRMATION_TOKEN_EXPIRE_MINUTES)
 
     email_confirmation_token = create_token(
-        data={'user_id': str(user_id)},
+        data={'user_id': str(user_id), 'token_type': EMAIL_CONFIRMATION_TOKEN},
         expires_delta=expires_delta
     )
 
-    message = EmailMessage()
-    message['To'] = email
-    message['Subject'] = f'Школа танцев. Подтверждение адреса электронной почты'
-    message.set_content(f'Здравствуйте, {name}!\n\n'
-                        f'Пожалуйста, подтвердите адрес электронной почты, перейдя по следующей ссылке:\n'
-                        f'http://localhost:8000/auth/confirm-email/{email_confirmation_token}')
-
-    await send_email(message)
+    content = (
+        f'Здравствуйте, {name}!\n\n'
+        f'Пожалуйста, подтвердите адрес электронной почты, перейдя по следующей ссылке:\n'
+        f'http://localhost:8000/auth/confirm-email/{email_confirmation_token}'
+    )
+    queue_email(db, email, f'Школа танцев. Подтверждение адреса электронной почты', content)
 
 
-async def send_new_event_email(event, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        or_(User.teacher, User.student)
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. {event.name}'
-        content = (
-            f'Здравствуйте, {user.first_name}!\n\n'
-            f'Рады сообщить вам о новом предстоящем мероприятии: {event.name}\n'
-            f'Мероприятие начнётся {event.start_time.date()} в {event.start_time.time()} по Москве'
-        )
-        content += f'\nОписание мероприятия:\n{event.description}' if event.description else ''
-        message.set_content(content)
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_new_event_email(event, db: AsyncSession):
+    content = (
+        f'Рады сообщить вам о новом предстоящем мероприятии: {event.name}\n'
+        f'Мероприятие начнётся {event.start_time.date()} в {event.start_time.time()} по Москве'
+    )
+    content += f'\nОписание мероприятия:\n{event.description}' if event.description else ''
+    await queue_audience_email(db, select_email_audience(), f'Школа танцев. {event.name}', content)
 
 
-async def send_event_rescheduled_email(event, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        or_(User.teacher, User.student)
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. {event.name}'
-        message.set_content(f'Здравствуйте, {user.first_name}!\n\n'
-                            f'Уведомляем вас о том, что мероприятие "{event.name}" было перенесено\n'
-                            f'Мероприятие начнётся {event.start_time.date()} в {event.start_time.time()} по Москве')
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_event_rescheduled_email(event, db: AsyncSession):
+    content = (
+        f'Уведомляем вас о том, что мероприятие "{event.name}" было перенесено\n'
+        f'Мероприятие начнётся {event.start_time.date()} в {event.start_time.time()} по Москве'
+    )
+    await queue_audience_email(db, select_email_audience(), f'Школа танцев. {event.name}', content)
 
 
-async def send_event_cancelled_email(event, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        or_(User.teacher, User.student)
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. {event.name}'
-        message.set_content(f'Здравствуйте, {user.first_name}!\n\n'
-                            f'С сожалением сообщаем вам, что мероприятие "{event.name}" было отменено')
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_event_cancelled_email(event, db: AsyncSession):
+    content = (
+        f'С сожалением сообщаем вам, что мероприятие "{event.name}" было отменено'
+    )
+    await queue_audience_email(db, select_email_audience(), f'Школа танцев. {event.name}', content)
 
 
-async def send_new_teacher_email(teacher, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        or_(User.teacher, User.student),
-        User.id != teacher.user.id
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. Новый преподаватель!'
-        content = (
-            f'Здравствуйте, {user.first_name}!\n\n'
-            f'Рады сообщить вам, что у нас появился новый преподаватель: '
-            f'{teacher.user.last_name} {teacher.user.first_name}'
-        )
-        content += f' {teacher.user.middle_name}' if teacher.user.middle_name else ''
-        content += (
-            f'\nВот что преподаватель пишет о себе:\n{teacher.user.description}'
-        ) if teacher.user.description else ''
-        message.set_content(content)
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_new_teacher_email(teacher, db: AsyncSession):
+    content = (
+        f'Рады сообщить вам, что у нас появился новый преподаватель: '
+        f'{teacher.user.last_name} {teacher.user.first_name}'
+    )
+    content += f' {teacher.user.middle_name}' if teacher.user.middle_name else ''
+    content += (
+        f'\nВот что преподаватель пишет о себе:\n{teacher.user.description}'
+    ) if teacher.user.description else ''
+    await queue_audience_email(
+        db, select_email_audience(User.id != teacher.user.id), f'Школа танцев. Новый преподаватель!', content
+    )
 
 
-async def send_teacher_terminated_email(teacher, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        or_(User.teacher, User.student)
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. Изменение преподавательского состава'
-        content = (
-            f'Здравствуйте, {user.first_name}!\n\n'
-            f'С сожалением сообщаем, что {teacher.user.last_name} {teacher.user.first_name}'
-        )
-        content += f' {teacher.user.middle_name}' if teacher.user.middle_name else ''
-        content += f' больше не преподаёт в нашей школе'
-        message.set_content(content)
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_teacher_terminated_email(teacher, db: AsyncSession):
+    content = (
+        f'С сожалением сообщаем, что {teacher.user.last_name} {teacher.user.first_name}'
+    )
+    content += f' {teacher.user.middle_name}' if teacher.user.middle_name else ''
+    content += f' больше не преподаёт в нашей школе'
+    await queue_audience_email(
+        db, select_email_audience(), f'Школа танцев. Изменение преподавательского состава', content
+    )
 
 
-async def send_new_classroom_email(classroom, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        or_(User.teacher, User.student)
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. Новый зал!'
-        content = (
-            f'Здравствуйте, {user.first_name}!\n\n'
-            f'Рады сообщить вам, что у нас появился новый зал: {classroom.name}'
-        )
-        content += (
-            f'\nОписание зала:\n{classroom.description}'
-        ) if classroom.description else ''
-        message.set_content(content)
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_new_classroom_email(classroom, db: AsyncSession):
+    content = (
+        f'Рады сообщить вам, что у нас появился новый зал: {classroom.name}'
+    )
+    content += (
+        f'\nОписание зала:\n{classroom.description}'
+    ) if classroom.description else ''
+    await queue_audience_email(db, select_email_audience(), f'Школа танцев. Новый зал!', content)
 
 
-async def send_classroom_terminated_email(classroom, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        or_(User.teacher, User.student)
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. {classroom.name}'
-        message.set_content(f'Здравствуйте, {user.first_name}!\n\n'
-                            f'Сообщаем вам о том, что зал "{classroom.name}" не доступен для занятий')
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_classroom_terminated_email(classroom, db: AsyncSession):
+    content = (
+        f'Сообщаем вам о том, что зал "{classroom.name}" не доступен для занятий'
+    )
+    await queue_audience_email(db, select_email_audience(), f'Школа танцев. {classroom.name}', content)
 
 
-async def send_new_group_lesson_email(lesson, db: Session):
+async def send_new_group_lesson_email(lesson, db: AsyncSession):
     group_teacher_ids = [teacher.id for teacher in lesson.group.teachers]
     group_student_ids = [student.id for student in lesson.group.students]
-    users = db.query(User).join(Teacher, isouter=True).join(Student, isouter=True).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        or_(
-            and_(
-                Teacher.id != None,
-                Teacher.id.in_(group_teacher_ids)
-            ),
-            and_(
-                Student.id != None,
-                Student.id.in_(group_student_ids)
-            )
-        )
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. {lesson.group.name}'
-        content = (
-            f'Здравствуйте, {user.first_name}!\n\n'
-            f'В расписании появилось новое занятие группы "{lesson.group.name}"\n'
-            f'Занятие начнётся {lesson.start_time.date()} в {lesson.start_time.time()} по Москве\n'
-            f'Название занятия: {lesson.name}'
-        )
-        content += f'\nОписание занятия:\n{lesson.description}' if lesson.description else ''
-        message.set_content(content)
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+    audience = select_email_audience(or_(
+        User.teacher.has(Teacher.id.in_(group_teacher_ids)),
+        User.student.has(Student.id.in_(group_student_ids))
+    ))
+    content = (
+        f'В расписании появилось новое занятие группы "{lesson.group.name}"\n'
+        f'Занятие начнётся {lesson.start_time.date()} в {lesson.start_time.time()} по Москве\n'
+        f'Название занятия: {lesson.name}'
+    )
+    content += f'\nОписание занятия:\n{lesson.description}' if lesson.description else ''
+    await queue_audience_email(db, audience, f'Школа танцев. {lesson.group.name}', content)
+
+
+async def send_new_group_lesson_series_email(group, lessons, db: AsyncSession):
+    group_teacher_ids = [teacher.id for teacher in group.teachers]
+    group_student_ids = [student.id for student in group.students]
+    audience = select_email_audience(or_(
+        User.teacher.has(Teacher.id.in_(group_teacher_ids)),
+        User.student.has(Student.id.in_(group_student_ids))
+    ))
+    schedule = '\n'.join(
+        f'{lesson.start_time.date()} в {lesson.start_time.time()} по Москве' for lesson in lessons
+    )
+    content = (
+        f'В расписании появились новые занятия группы "{group.name}"\n'
+        f'Название занятий: {lessons[0].name}\n'
+        f'Даты занятий:\n{schedule}'
+    )
+    content += f'\nОписание занятий:\n{lessons[0].description}' if lessons[0].description else ''
+    await queue_audience_email(db, audience, f'Школа танцев. {group.name}', content)
 
 
-def get_lesson_users(lesson, db: Session):
+def select_lesson_audience(lesson):
     lesson_teacher_ids = [teacher.id for teacher in lesson.actual_teachers]
     lesson_student_ids = [student.id for student in lesson.actual_students]
-    users = db.query(User).join(Teacher, isouter=True).join(Student, isouter=True).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        or_(
-            and_(
-                Teacher.id != None,
-                Teacher.id.in_(lesson_teacher_ids)
-            ),
-            and_(
-                Student.id != None,
-                Student.id.in_(lesson_student_ids)
-            )
-        )
-    ).all()
-    return users
-
-
-async def send_lesson_rescheduled_email(lesson, db: Session):
-    users = get_lesson_users(lesson, db)
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. Перенос занятия'
-        message.set_content(f'Здравствуйте, {user.first_name}!\n\n'
-                            f'Уведомляем вас о том, что занятие "{lesson.name}" было перенесено\n'
-                            f'Занятие начнётся {lesson.start_time.date()} в {lesson.start_time.time()} по Москве')
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+    return select_email_audience(or_(
+        User.teacher.has(Teacher.id.in_(lesson_teacher_ids)),
+        User.student.has(Student.id.in_(lesson_student_ids))
+    ))
 
 
-async def send_lesson_cancelled_email(lesson, db: Session):
-    users = get_lesson_users(lesson, db)
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. Отмена занятия'
-        message.set_content(f'Здравствуйте, {user.first_name}!\n\n'
-                            f'С сожалением сообщаем вам, что занятие "{lesson.name}" было отменено')
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_lesson_rescheduled_email(lesson, db: AsyncSession):
+    content = (
+        f'Уведомляем вас о том, что занятие "{lesson.name}" было перенесено\n'
+        f'Занятие начнётся {lesson.start_time.date()} в {lesson.start_time.time()} по Москве'
+    )
+    await queue_audience_email(db, select_lesson_audience(lesson), f'Школа танцев. Перенос занятия', content)
 
 
-async def send_new_group_email(group, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        User.student
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. Новая группа!'
-        content = (
-            f'Здравствуйте, {user.first_name}!\n\n'
-            f'Рады сообщить вам, что у нас появилась новая группа: {group.name}'
-        )
-        content += (
-            f'\nОписание группы:\n{group.description}'
-        ) if group.description else ''
-        message.set_content(content)
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_lesson_cancelled_email(lesson, db: AsyncSession):
+    content = (
+        f'С сожалением сообщаем вам, что занятие "{lesson.name}" было отменено'
+    )
+    await queue_audience_email(db, select_lesson_audience(lesson), f'Школа танцев. Отмена занятия', content)
 
 
-async def send_new_subscription_template_email(subscription_template, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        User.student
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. Новый шаблон абонемента!'
-        content = (
-            f'Здравствуйте, {user.first_name}!\n\n'
-            f'Рады сообщить вам, что у нас появился новый шаблон абонемента: {subscription_template.name}'
-        )
-        content += (
-            f'\nОписание шаблона:\n{subscription_template.description}'
-        ) if subscription_template.description else ''
-        message.set_content(content)
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_new_group_email(group, db: AsyncSession):
+    content = (
+        f'Рады сообщить вам, что у нас появилась новая группа: {group.name}'
+    )
+    content += (
+        f'\nОписание группы:\n{group.description}'
+    ) if group.description else ''
+    await queue_audience_email(
+        db, select_email_audience(students_only=True), f'Школа танцев. Новая группа!', content
+    )
 
 
-async def send_new_payment_type_email(payment_type, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        User.student
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. Новый способ оплаты!'
-        content = (
-            f'Здравствуйте, {user.first_name}!\n\n'
-            f'Рады сообщить вам, что у нас появился новый способ оплаты: {payment_type.name}'
-        )
-        message.set_content(content)
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_new_subscription_template_email(subscription_template, db: AsyncSession):
+    content = (
+        f'Рады сообщить вам, что у нас появился новый шаблон абонемента: {subscription_template.name}'
+    )
+    content += (
+        f'\nОписание шаблона:\n{subscription_template.description}'
+    ) if subscription_template.description else ''
+    await queue_audience_email(
+        db, select_email_audience(students_only=True), f'Школа танцев. Новый шаблон абонемента!', content
+    )
 
 
-async def send_payment_type_terminated_email(payment_type, db: Session):
-    users = db.query(User).where(
-        User.terminated == False,
-        User.email_confirmed == True,
-        User.receive_email == True,
-        User.student
-    ).all()
-    for user in users:
-        message = EmailMessage()
-        message['To'] = user.email
-        message['Subject'] = f'Школа танцев. Способ оплаты "{payment_type.name}"'
-        message.set_content(f'Здравствуйте, {user.first_name}!\n\n'
-                            f'Сообщаем вам о том, что способ оплаты "{payment_type.name}" не доступен')
-        try:
-            await send_email(message)
-        except Exception as e:
-            print(e)
+async def send_new_payment_type_email(payment_type, db: AsyncSession):
+    content = (
+        f'Рады сообщить вам, что у нас появился новый способ оплаты: {payment_type.name}'
+    )
+    await queue_audience_email(
+        db, select_email_audience(students_only=True), f'Школа танцев. Новый способ оплаты!', content
+    )
 
 
-async def send_new_payment_email(payment, user):
-    message = EmailMessage()
-    message['To'] = user.email
-    message['Subject'] = f'Школа танцев. Оплата произведена'
+async def send_payment_type_terminated_email(payment_type, db: AsyncSession):
+    content = (
+        f'Сообщаем вам о том, что способ оплаты "{payment_type.name}" не доступен'
+    )
+    await queue_audience_email(
+        db, select_email_audience(students_only=True), f'Школа танцев. Способ оплаты "{payment_type.name}"', content
+    )
+
+
+async def send_new_payment_email(payment, user, db: AsyncSession):
     content = (
         f'Здравствуйте, {user.first_name}!\n\n'
         f'Оплата произведена успешно!'
@@ -390,17 +355,10 @@ async def send_new_payment_email(payment, user):
     content += (
         f'\nДетали операции:\n{payment.details}'
     ) if payment.details else ''
-    message.set_content(content)
-    try:
-        await send_email(message)
-    except Exception as e:
-        print(e)
+    queue_email(db, user.email, f'Школа танцев. Оплата произведена', content)
 
 
-async def send_payment_terminated_email(payment, user):
-    message = EmailMessage()
-    message['To'] = user.email
-    message['Subject'] = f'Школа танцев. Оплата отменена'
+async def send_payment_terminated_email(payment, user, db: AsyncSession):
     content = (
         f'Здравствуйте, {user.first_name}!\n\n'
         f'Оплата была отменена'
@@ -408,19 +366,12 @@ async def send_payment_terminated_email(payment, user):
     content += (
         f'\nДетали операции:\n{payment.details}'
     ) if payment.details else ''
-    message.set_content(content)
-    try:
-        await send_email(message)
-    except Exception as e:
-        print(e)
+    queue_email(db, user.email, f'Школа танцев. Оплата отменена', content)
 
 
-async def send_new_individual_lesson_email(lesson):
+async def send_new_individual_lesson_email(lesson, db: AsyncSession):
     student_user = lesson.actual_students[0].user
     teacher_user = lesson.actual_teachers[0].user
-    message = EmailMessage()
-    message['To'] = student_user.email
-    message['Subject'] = f'Школа танцев. {lesson.name}'
     content = (
         f'Здравствуйте, {student_user.first_name}!\n\n'
         f'Преподаватель {teacher_user.last_name} {teacher_user.first_name}'
@@ -433,19 +384,12 @@ async def send_new_individual_lesson_email(lesson):
     content += (
         f'\nОписание занятия:\n{lesson.description}'
     ) if lesson.description else ''
-    message.set_content(content)
-    try:
-        await send_email(message)
-    except Exception as e:
-        print(e)
+    queue_email(db, student_user.email, f'Школа танцев. {lesson.name}', content)
 
 
-async def send_new_lesson_request_email(lesson_request):
+async def send_new_lesson_request_email(lesson_request, db: AsyncSession):
     student_user = lesson_request.actual_students[0].user
     teacher_user = lesson_request.actual_teachers[0].user
-    message = EmailMessage()
-    message['To'] = teacher_user.email
-    message['Subject'] = f'Школа танцев. Новая заявка на индивидуальное занятие'
     content = (
         f'Здравствуйте, {teacher_user.first_name}!\n\n'
         f'Ученик {student_user.last_name} {student_user.first_name}'
@@ -458,46 +402,28 @@ async def send_new_lesson_request_email(lesson_request):
     content += (
         f'\nОписание заявки:\n{lesson_request.description}'
     ) if lesson_request.description else ''
-    message.set_content(content)
-    try:
-        await send_email(message)
-    except Exception as e:
-        print(e)
+    queue_email(db, teacher_user.email, f'Школа танцев. Новая заявка на индивидуальное занятие', content)
 
 
-async def send_lesson_request_accepted_email(lesson):
+async def send_lesson_request_accepted_email(lesson, db: AsyncSession):
     student_user = lesson.actual_students[0].user
     teacher_user = lesson.actual_teachers[0].user
-    message = EmailMessage()
-    message['To'] = student_user.email
-    message['Subject'] = f'Школа танцев. Заявка на индивидуальное занятие принята'
     content = (
         f'Здравствуйте, {student_user.first_name}!\n\n'
         f'Преподаватель {teacher_user.last_name} {teacher_user.first_name}'
     )
     content += f' {teacher_user.middle_name}' if teacher_user.middle_name else ''
     content += f' принял вашу заявку на индивидуальное занятие'
-    message.set_content(content)
-    try:
-        await send_email(message)
-    except Exception as e:
-        print(e)
+    queue_email(db, student_user.email, f'Школа танцев. Заявка на индивидуальное занятие принята', content)
 
 
-async def send_lesson_request_declined_email(lesson):
+async def send_lesson_request_declined_email(lesson, db: AsyncSession):
     student_user = lesson.actual_students[0].user
     teacher_user = lesson.actual_teachers[0].user
-    message = EmailMessage()
-    message['To'] = student_user.email
-    message['Subject'] = f'Школа танцев. Заявка на индивидуальное занятие отклонена'
     content = (
         f'Здравствуйте, {student_user.first_name}!\n\n'
         f'Преподаватель {teacher_user.last_name} {teacher_user.first_name}'
     )
     content += f' {teacher_user.middle_name}' if teacher_user.middle_name else ''
     content += f' отклонил вашу заявку на индивидуальное занятие'
-    message.set_content(content)
-    try:
-        await send_email(message)
-    except Exception as e:
-        print(e)
+    queue_email(db, student_user.email, f'Школа танцев. Заявка на индивидуальное занятие отклонена', content)
@@ -0,0 +1,10 @@
+def merge_intervals(intervals):
+    merged = []
+    for start, finish in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if finish > merged[-1][1]:
+                merged[-1] = (merged[-1][0], finish)
+        else:
+            merged.append((start, finish))
+    return merged
+
@@ -0,0 +1,140 @@
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.models import User, Admin, Teacher, Student, Group, Lesson, LessonType, Subscription, SubscriptionTemplate, \
+    Event, Payment, Slot, SlotOccurrence
+
+
+# Наборы опций загрузки под схемы ответов: всё, что сериализует схема, подгружается
+# фиксированным числом запросов вместо ленивой загрузки для каждой строки
+
+def lesson_type_full_info_options():
+    return [
+        joinedload(LessonType.dance_style)
+    ]
+
+
+def subscription_template_full_info_options():
+    return [
+        selectinload(SubscriptionTemplate.lesson_types).options(*lesson_type_full_info_options())
+    ]
+
+
+def admin_full_info_options():
+    return [
+        joinedload(Admin.user)
+    ]
+
+
+def event_full_info_options():
+    return [
+        joinedload(Event.event_type)
+    ]
+
+
+def teacher_more_info_options():
+    return [
+        joinedload(Teacher.user),
+        selectinload(Teacher.lesson_types).options(*lesson_type_full_info_options())
+    ]
+
+
+def teacher_full_info_options():
+    return teacher_more_info_options() + [
+        selectinload(Teacher.groups).options(*group_more_info_options())
+    ]
+
+
+def slot_full_info_options():
+    return [
+        joinedload(Slot.teacher).options(*teacher_more_info_options())
+    ]
+
+
+def slot_occurrence_full_info_options():
+    return [
+        joinedload(SlotOccurrence.teacher).options(*teacher_more_info_options())
+    ]
+
+
+def student_more_info_options():
+    return [
+        joinedload(Student.user),
+        joinedload(Student.level)
+    ]
+
+
+def group_more_info_options():
+    return [
+        joinedload(Group.level)
+    ]
+
+
+def group_full_info_options():
+    return group_more_info_options() + [
+        selectinload(Group.students).options(*student_more_info_options()),
+        selectinload(Group.teachers).options(*teacher_more_info_options())
+    ]
+
+
+def subscription_more_info_options():
+    return [
+        joinedload(Subscription.subscription_template).options(*subscription_template_full_info_options())
+    ]
+
+
+def subscription_full_info_options():
+    return subscription_more_info_options() + [
+        joinedload(Subscription.payment)
+    ]
+
+
+def student_full_info_options():
+    return student_more_info_options() + [
+        selectinload(Student.groups).options(*group_more_info_options()),
+        selectinload(Student.subscriptions).options(*subscription_full_info_options())
+    ]
+
+
+def payment_full_info_options():
+    return [
+        joinedload(Payment.payment_type),
+        joinedload(Payment.subscription).options(*subscription_more_info_options())
+    ]
+
+
+def lesson_full_info_options():
+    return [
+        joinedload(Lesson.lesson_type).options(*lesson_type_full_info_options()),
+        joinedload(Lesson.classroom),
+        joinedload(Lesson.group).options(*group_full_info_options()),
+        selectinload(Lesson.subscription_templates).options(*subscription_template_full_info_options()),
+        selectinload(Lesson.actual_students).options(*student_more_info_options()),
+        selectinload(Lesson.actual_teachers).options(*teacher_more_info_options())
+    ]
+
+
+def user_with_roles_options(full_info=False):
+    if not full_info:
+        return [
+            joinedload(User.admin),
+            joinedload(User.teacher),
+            joinedload(User.student)
+        ]
+    return [
+        joinedload(User.admin).options(*admin_full_info_options()),
+        joinedload(User.teacher).options(*teacher_full_info_options()),
+        joinedload(User.student).options(*student_full_info_options())
+    ]
+
+
+async def load_user_with_roles(db, user_id, full_info=False):
+    # Пользователь и все его роли одним запросом, коллекции ролей для полной информации догружаются пакетно
+    return await db.scalar(select(User).where(User.id == user_id).options(*user_with_roles_options(full_info)))
+
+
+async def load_with_options(db, model, id, options):
+    # Перечитывает объект вместе со связями схемы ответа, в том числе после изменений в обработчике
+    return await db.scalar(
+        select(model).where(model.id == id).options(*options).execution_options(populate_existing=True)
+    )
@@ -1,11 +1,17 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from app.database import engine, Base, init_db
+from app.config import settings
+from app.database import engine, async_engine, Base, init_db
+from app.email import run_email_outbox_worker
+from app.slot_occurrences import run_slot_occurrences_worker
+from app.auth.password import password_hash_executor
 from app.routers import auth, events, eventTypes, classrooms, subscriptionTemplates, paymentTypes, payments, \
     subscriptions, slots, students, levels, teachers, lessonTypes, groups, admins, lessons, test, danceStyles, \
-    statistics
+    statistics, metrics
 import os
 
 print('Запуск приложения...')
@@ -20,7 +26,24 @@ async def lifespan(app: FastAPI):
         Base.metadata.create_all(bind=engine)
     except Exception as e:
         print(f'Ошибка при инициализации: {e}')
+
+    email_outbox_worker = None
+    if settings.EMAIL_OUTBOX_WORKER_ENABLED:
+        email_outbox_worker = asyncio.create_task(run_email_outbox_worker())
+
+    slot_occurrences_worker = None
+    if settings.SLOT_OCCURRENCES_WORKER_ENABLED:
+        slot_occurrences_worker = asyncio.create_task(run_slot_occurrences_worker())
+
     yield
+
+    if email_outbox_worker:
+        email_outbox_worker.cancel()
+    if slot_occurrences_worker:
+        slot_occurrences_worker.cancel()
+    await async_engine.dispose()
+    engine.dispose()
+    password_hash_executor.shutdown()
     print('Завершение работы приложения')
 
 
@@ -49,6 +72,7 @@ app.include_router(groups.router)
 app.include_router(lessons.router)
 app.include_router(lessonTypes.router)
 app.include_router(levels.router)
+app.include_router(metrics.router)
 app.include_router(payments.router)
 app.include_router(paymentTypes.router)
 app.include_router(slots.router)
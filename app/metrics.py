@@ -0,0 +1,144 @@
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+metrics_lock = threading.Lock()
+registered_metrics = []
+
+
+def format_labels(label, label_value, **extra_labels):
+    labels = {label: label_value} if label else {}
+    labels.update(extra_labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+class Histogram:
+    def __init__(self, name, description, label, buckets):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self.values = {}
+        registered_metrics.append(self)
+
+    def observe(self, label_value, value):
+        with metrics_lock:
+            histogram = self.values.setdefault(label_value, {
+                'buckets': [0] * len(self.buckets),
+                'count': 0,
+                'sum': 0.0
+            })
+            bucket_index = bisect_left(self.buckets, value)
+            if bucket_index < len(self.buckets):
+                histogram['buckets'][bucket_index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with metrics_lock:
+            for label_value, histogram in self.values.items():
+                cumulative_count = 0
+                for bound, bucket_count in zip(self.buckets, histogram['buckets']):
+                    cumulative_count += bucket_count
+                    lines.append(f'{self.name}_bucket{format_labels(self.label, label_value, le=bound)} '
+                                 f'{cumulative_count}')
+                lines.append(f'{self.name}_bucket{format_labels(self.label, label_value, le="+Inf")} '
+                             f'{histogram["count"]}')
+                lines.append(f'{self.name}_sum{format_labels(self.label, label_value)} {histogram["sum"]}')
+                lines.append(f'{self.name}_count{format_labels(self.label, label_value)} {histogram["count"]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, label=None):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.values = {}
+        registered_metrics.append(self)
+
+    def inc(self, label_value=None):
+        with metrics_lock:
+            self.values[label_value] = self.values.get(label_value, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with metrics_lock:
+            for label_value, value in self.values.items():
+                lines.append(f'{self.name}{format_labels(self.label, label_value)} {value}')
+        return lines
+
+
+class Gauge:
+    # collect возвращает словарь {значение метки: значение}, вызывается при каждом чтении метрик
+    def __init__(self, name, description, label, collect):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.collect = collect
+        registered_metrics.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} gauge']
+        for label_value, value in self.collect().items():
+            lines.append(f'{self.name}{format_labels(self.label, label_value)} {value}')
+        return lines
+
+
+def render_metrics():
+    # Текстовый формат Prometheus
+    return '\n'.join(line for metric in registered_metrics for line in metric.render()) + '\n'
+
+
+# Границы корзин гистограммы ожидания подключения из пула, в секундах
+POOL_CHECKOUT_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+pool_checkout_wait = Histogram(
+    'db_pool_checkout_wait_seconds', 'Время ожидания подключения из пула', 'pool', POOL_CHECKOUT_WAIT_BUCKETS
+)
+pool_checkout_timeouts = Counter(
+    'db_pool_checkout_timeouts_total', 'Количество превышений ожидания подключения из пула', 'pool'
+)
+
+# Последний созданный пул каждого движка, пул пересоздаётся при dispose
+timed_pools = {}
+
+
+class CheckoutTimedPool:
+    pool_name = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        timed_pools[self.pool_name] = self
+
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            pool_checkout_timeouts.inc(self.pool_name)
+            raise
+        finally:
+            pool_checkout_wait.observe(self.pool_name, time.perf_counter() - started_at)
+
+
+class CheckoutTimedQueuePool(CheckoutTimedPool, QueuePool):
+    pool_name = 'sync'
+
+
+class CheckoutTimedAsyncQueuePool(CheckoutTimedPool, AsyncAdaptedQueuePool):
+    pool_name = 'async'
+
+
+Gauge('db_pool_size', 'Размер пула', 'pool',
+      lambda: {name: pool.size() for name, pool in timed_pools.items()})
+Gauge('db_pool_checked_out', 'Выданные из пула подключения', 'pool',
+      lambda: {name: pool.checkedout() for name, pool in timed_pools.items()})
+Gauge('db_pool_overflow', 'Подключения сверх размера пула', 'pool',
+      lambda: {name: max(pool.overflow(), 0) for name, pool in timed_pools.items()})
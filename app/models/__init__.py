@@ -1,7 +1,9 @@
 from app.models.admin import *
 from app.models.association import *
 from app.models.classroom import *
+from app.models.daily_subscription_sales import *
 from app.models.dance_style import *
+from app.models.email_outbox import *
 from app.models.event import *
 from app.models.event_type import *
 from app.models.group import *
@@ -10,7 +12,9 @@ from app.models.lesson_type import *
 from app.models.level import *
 from app.models.payment import *
 from app.models.payment_type import *
+from app.models.refresh_token import *
 from app.models.slot import *
+from app.models.slot_occurrence import *
 from app.models.student import *
 from app.models.subscription import *
 from app.models.subscription_template import *
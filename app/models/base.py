@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime
+from sqlalchemy import Column, DateTime, func
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from app.database import Base
@@ -8,4 +8,4 @@ class BaseModel(Base):
     __abstract__ = True
     
     id = Column(UUID(as_uuid=True), primary_key=True, nullable=False, default=uuid.uuid4)
-    created_at = Column(DateTime(timezone=True), nullable=False, default='now()')
+    created_at = Column(DateTime(timezone=True), nullable=False, default=func.now())
@@ -0,0 +1,14 @@
+from sqlalchemy import ForeignKey, Date, Integer, Numeric
+
+from app.models.base import *
+
+
+class DailySubscriptionSales(Base):
+    __tablename__ = 'daily_subscription_sales'
+
+    day = Column(Date, primary_key=True, nullable=False)
+    subscription_template_id = Column(
+        UUID(as_uuid=True), ForeignKey('subscription_templates.id'), primary_key=True, nullable=False
+    )
+    count = Column(Integer, nullable=False, default=0)
+    sum = Column(Numeric(12, 2), nullable=False, default=0)
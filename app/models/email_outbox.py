@@ -0,0 +1,28 @@
+from sqlalchemy import Column, DateTime, Integer, String, Index, func
+
+from app.models.base import BaseModel
+
+EMAIL_PENDING = 'pending'
+EMAIL_SENT = 'sent'
+EMAIL_FAILED = 'failed'
+
+
+class EmailOutbox(BaseModel):
+    __tablename__ = 'email_outbox'
+
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String, nullable=False)
+    content = Column(String, nullable=False)
+    status = Column(String, nullable=False, default=EMAIL_PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index(
+            'ix_email_outbox_pending',
+            next_attempt_at,
+            postgresql_where=(status == EMAIL_PENDING)
+        ),
+    )
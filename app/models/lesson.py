@@ -1,8 +1,8 @@
 from datetime import datetime
 
-from sqlalchemy import Column, ForeignKey, Boolean, DateTime, String, select, exists, or_
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import Column, ForeignKey, Boolean, DateTime, String, Index, select, exists, or_, func
+from sqlalchemy.dialects.postgresql import UUID, TSTZRANGE
+from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 from sqlalchemy.orm import relationship
 
 from app.database import TIMEZONE
@@ -25,6 +25,15 @@ class Lesson(BaseModel):
     are_neighbours_allowed = Column(Boolean, nullable=False)
     terminated = Column(Boolean, nullable=False, default=False)
 
+    __table_args__ = (
+        Index(
+            'ix_lessons_time_range',
+            func.tstzrange(start_time, finish_time),
+            postgresql_using='gist',
+            postgresql_where=(terminated == False)
+        ),
+    )
+
     classroom = relationship('Classroom', uselist=False, back_populates='lessons')
     lesson_type = relationship('LessonType', uselist=False, back_populates='lessons')
     group = relationship('Group', uselist=False, back_populates='lessons')
@@ -92,3 +101,13 @@ class Lesson(BaseModel):
                 SubscriptionLessonType.lesson_type_id == cls.lesson_type_id
             )
         )
+
+    @hybrid_method
+    def overlaps(self, start_time, finish_time):
+        return self.start_time < finish_time and start_time < self.finish_time
+
+    @overlaps.expression
+    def overlaps(cls, start_time, finish_time):
+        return func.tstzrange(cls.start_time, cls.finish_time, type_=TSTZRANGE).op('&&')(
+            func.tstzrange(start_time, finish_time, type_=TSTZRANGE)
+        )
@@ -0,0 +1,10 @@
+from sqlalchemy import Boolean, ForeignKey
+
+from app.models.base import *
+
+
+class RefreshToken(BaseModel):
+    __tablename__ = 'refresh_tokens'
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id'), nullable=False, index=True)
+    used = Column(Boolean, nullable=False, default=False)
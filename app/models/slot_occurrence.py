@@ -0,0 +1,24 @@
+from sqlalchemy import Column, ForeignKey, DateTime, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
+
+from app.models.base import BaseModel
+
+
+class SlotOccurrence(BaseModel):
+    # Повторения еженедельных слотов на несколько недель вперёд (см. app/slot_occurrences.py)
+    __tablename__ = 'slot_occurrences'
+
+    slot_id = Column(UUID(as_uuid=True), ForeignKey('slots.id', ondelete='CASCADE'), nullable=False)
+    teacher_id = Column(UUID(as_uuid=True), ForeignKey('teachers.id'), nullable=False)
+    start_time = Column(DateTime(timezone=True), nullable=False)
+    finish_time = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(slot_id, start_time),
+        Index('ix_slot_occurrences_teacher_id_start_time', teacher_id, start_time),
+        Index('ix_slot_occurrences_start_time', start_time)
+    )
+
+    slot = relationship('Slot', uselist=False)
+    teacher = relationship('Teacher', uselist=False)
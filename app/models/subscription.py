@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, DateTime, func, select, and_
+from sqlalchemy import Column, ForeignKey, DateTime, Integer, and_
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
@@ -15,6 +15,8 @@ class Subscription(BaseModel):
     subscription_template_id = Column(UUID(as_uuid=True), ForeignKey('subscription_templates.id'), nullable=False)
     expiration_date = Column(DateTime(timezone=True), nullable=True)
     payment_id = Column(UUID(as_uuid=True), ForeignKey('payments.id'), nullable=True)
+    # Количество активных записей на занятия, см. app/subscription_lessons.py
+    lessons_used = Column(Integer, nullable=False, default=0)
 
     subscription_template = relationship('SubscriptionTemplate', uselist=False, back_populates='subscriptions')
     student = relationship('Student', uselist=False, back_populates='subscriptions')
@@ -52,13 +54,8 @@ class Subscription(BaseModel):
 
     @hybrid_property
     def lessons_left(self):
-        return self.subscription_template.lesson_count - len(self.active_lesson_subscriptions)
+        return self.subscription_template.lesson_count - self.lessons_used
 
     @lessons_left.expression
     def lessons_left(cls):
-        return SubscriptionTemplate.lesson_count - (select(
-            func.count(LessonSubscription.lesson_id)
-        ).where(
-            LessonSubscription.subscription_id == cls.id,
-            LessonSubscription.cancelled == False
-        ).scalar_subquery())
+        return SubscriptionTemplate.lesson_count - cls.lessons_used
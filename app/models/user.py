@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean
+from sqlalchemy import Column, String, Boolean, Integer
 from sqlalchemy.orm import relationship
 
 from app.models.base import BaseModel
@@ -17,6 +17,8 @@ class User(BaseModel):
     description = Column(String, nullable=True)
     phone_number = Column(String, unique=True, nullable=False)
     terminated = Column(Boolean, nullable=False, default=False)
+    # Увеличивается при смене пароля, адреса и блокировке, выданные ранее токены перестают действовать
+    token_version = Column(Integer, nullable=False, default=0)
 
     admin = relationship('Admin', uselist=False, back_populates='user')
     student = relationship('Student', uselist=False, back_populates='user')
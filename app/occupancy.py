@@ -0,0 +1,36 @@
+from sqlalchemy import select, exists, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Lesson
+
+
+def classroom_occupied_criteria(classroom_id, start_time, finish_time, are_neighbours_allowed, lesson_id=None):
+    # Зал занят, если в нём есть активное пересекающееся занятие и хотя бы одно из занятий не допускает соседей.
+    # Аргументы могут быть как значениями, так и колонками запроса
+    criteria = [
+        Lesson.classroom_id == classroom_id,
+        Lesson.terminated == False,
+        or_(
+            are_neighbours_allowed == False,
+            Lesson.are_neighbours_allowed == False
+        ),
+        Lesson.overlaps(start_time, finish_time)
+    ]
+    if lesson_id is not None:
+        criteria.append(Lesson.id != lesson_id)
+    return criteria
+
+
+def classroom_occupied_condition(classroom_id, start_time, finish_time, are_neighbours_allowed, lesson_id=None):
+    return exists().where(
+        *classroom_occupied_criteria(classroom_id, start_time, finish_time, are_neighbours_allowed, lesson_id)
+    )
+
+
+async def is_classroom_occupied(
+        classroom_id, start_time, finish_time, are_neighbours_allowed, db: AsyncSession, lesson_id=None
+):
+    return await db.scalar(select(
+        classroom_occupied_condition(classroom_id, start_time, finish_time, are_neighbours_allowed, lesson_id)
+    ))
+
@@ -0,0 +1,123 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import and_, or_, literal, select, func
+
+from app.config import settings
+
+
+def encode_cursor(order_by, desc, value, id):
+    payload = json.dumps(jsonable_encoder({
+        'order_by': order_by,
+        'desc': desc,
+        'value': value,
+        'id': id
+    }))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, column, id_column, order_by, desc):
+    invalid_cursor_exception = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail='Невалидный курсор'
+    )
+
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # курсор действителен только для той же сортировки, что и запрос,
+        # а сортировка запроса уже проверена check_order_by роутера
+        if payload['order_by'] != order_by or payload['desc'] != desc:
+            raise invalid_cursor_exception
+        value = payload['value']
+        if value is not None:
+            value = TypeAdapter(column.type.python_type).validate_python(value)
+        id = TypeAdapter(id_column.type.python_type).validate_python(payload['id'])
+    except (ValueError, TypeError, KeyError, binascii.Error, ValidationError):
+        raise invalid_cursor_exception
+
+    return value, id
+
+
+def get_cursor_condition(column, id_column, value, id, desc):
+    # Postgres сортирует NULL как наибольшее значение: в конце при ASC и в начале при DESC
+    if value is not None:
+        value = literal(value, column.type)
+    if desc:
+        if value is None:
+            return or_(
+                and_(column == None, id_column < id),
+                column != None
+            )
+        return or_(
+            column < value,
+            and_(column == value, id_column < id)
+        )
+
+    if value is None:
+        return and_(column == None, id_column > id)
+    return or_(
+        column > value,
+        and_(column == value, id_column > id),
+        column == None
+    )
+
+
+def count_rows(query, model, total_limit=None):
+    rows = query.with_only_columns(model.id).order_by(None)
+    if total_limit:
+        rows = rows.limit(total_limit + 1)
+    return select(func.count()).select_from(rows.subquery())
+
+
+def get_page_info(total, total_limit, next_cursor):
+    return {
+        'total': min(total, total_limit) if total_limit else total,
+        'total_is_capped': bool(total_limit) and total > total_limit,
+        'next_cursor': next_cursor
+    }
+
+
+async def paginate(db, query, model, order_by, desc, offset, limit, cursor=None, options=(), columns=()):
+    column = getattr(model, order_by)
+    total_limit = settings.SEARCH_TOTAL_LIMIT
+
+    page = query.order_by(
+        column.desc() if desc else column,
+        model.id.desc() if desc else model.id
+    )
+    if cursor:
+        value, id = decode_cursor(cursor, column, model.id, order_by, desc)
+        page = page.where(get_cursor_condition(column, model.id, value, id, desc))
+    else:
+        page = page.offset(offset)
+
+    # Общее количество считается в том же запросе, что и страница: оконной функцией по всей выборке,
+    # либо подзапросом, если курсор отсекает часть строк или количество ограничено сверху
+    if cursor or total_limit:
+        total_column = count_rows(query, model, total_limit).scalar_subquery()
+    else:
+        total_column = func.count().over()
+
+    rows = (await db.execute(
+        page.add_columns(*columns, total_column.label('total')).options(*options).limit(limit)
+    )).all()
+
+    if rows:
+        total = rows[0].total
+    elif offset or cursor:
+        total = await db.scalar(count_rows(query, model, total_limit))
+    else:
+        total = 0
+
+    items = [row[0] if not columns else tuple(row[:-1]) for row in rows]
+
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1][0]
+        next_cursor = encode_cursor(order_by, desc, getattr(last, order_by), last.id)
+
+    return items, get_page_info(total, total_limit, next_cursor)
@@ -0,0 +1,77 @@
+from sqlalchemy import select, update, delete, cast, func, text, Date
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import TIMEZONE_NAME
+from app.models import DailySubscriptionSales, Subscription, SubscriptionTemplate, Payment
+
+
+def get_sale_day():
+    # День покупки по местному времени школы, независимо от часового пояса сессии
+    return cast(func.timezone(TIMEZONE_NAME, Payment.created_at), Date)
+
+
+def select_subscription_sales(sign, *criteria):
+    sale_day = get_sale_day()
+
+    return select(
+        sale_day.label('day'),
+        Subscription.subscription_template_id,
+        (sign * func.count(Subscription.id)).label('count'),
+        (sign * func.sum(SubscriptionTemplate.price)).label('sum')
+    ).join(
+        Payment,
+        Payment.id == Subscription.payment_id
+    ).join(
+        SubscriptionTemplate,
+        SubscriptionTemplate.id == Subscription.subscription_template_id
+    ).where(
+        *criteria
+    ).group_by(
+        sale_day,
+        Subscription.subscription_template_id
+    )
+
+
+async def update_daily_subscription_sales(db: AsyncSession, sign, *criteria):
+    # Прибавляет (sign=1) или вычитает (sign=-1) продажи выбранных абонементов в той же транзакции,
+    # что и изменение платежа или абонемента
+    insert_sales = insert(DailySubscriptionSales).from_select(
+        ['day', 'subscription_template_id', 'count', 'sum'],
+        select_subscription_sales(sign, *criteria)
+    )
+    await db.execute(insert_sales.on_conflict_do_update(
+        index_elements=[DailySubscriptionSales.day, DailySubscriptionSales.subscription_template_id],
+        set_={
+            'count': DailySubscriptionSales.count + insert_sales.excluded['count'],
+            'sum': DailySubscriptionSales.sum + insert_sales.excluded['sum']
+        }
+    ))
+
+
+async def update_daily_subscription_sales_price(db: AsyncSession, subscription_template_id, price_delta):
+    # Сводка, живой подсчёт и пересчёт считают выручку по текущей цене шаблона,
+    # поэтому при изменении цены суммы всех дней сдвигаются на разницу цен
+    await db.flush()
+    await db.execute(update(DailySubscriptionSales).where(
+        DailySubscriptionSales.subscription_template_id == subscription_template_id
+    ).values(
+        {DailySubscriptionSales.sum: DailySubscriptionSales.sum + DailySubscriptionSales.count * price_delta}
+    ).execution_options(synchronize_session=False))
+
+
+def get_rebuild_daily_subscription_sales_statements():
+    # Блокировка не даёт параллельным транзакциям изменить сводку, пока она пересчитывается
+    return [
+        text(f'LOCK TABLE {DailySubscriptionSales.__tablename__} IN EXCLUSIVE MODE'),
+        delete(DailySubscriptionSales),
+        insert(DailySubscriptionSales).from_select(
+            ['day', 'subscription_template_id', 'count', 'sum'],
+            select_subscription_sales(1, Payment.terminated == False)
+        )
+    ]
+
+
+async def rebuild_daily_subscription_sales(db: AsyncSession):
+    for statement in get_rebuild_daily_subscription_sales_statements():
+        await db.execute(statement)
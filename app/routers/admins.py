@@ -2,11 +2,14 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import AfterValidator
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.jwt import get_current_admin
-from app.database import get_db
+from app.schemas.token import PrincipalRole
+from app.database import get_async_db
+from app.pagination import paginate
+from app.loaders import load_with_options, admin_full_info_options
 from app.routers.auth import create_user, patch_user
 from app.models import User, Admin
 from app.schemas.admin import *
@@ -20,8 +23,8 @@ router = APIRouter(
 @router.post('/', response_model=AdminInfo, status_code=status.HTTP_201_CREATED)
 async def create_admin(
         admin_data: AdminCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     user = await create_user(admin_data, db)
 
@@ -30,10 +33,9 @@ async def create_admin(
     )
 
     db.add(admin)
-    db.commit()
-    db.refresh(admin)
+    await db.commit()
 
-    return admin
+    return await load_with_options(db, Admin, admin.id, admin_full_info_options())
 
 
 def check_order_by(order_by: str) -> str:
@@ -49,20 +51,17 @@ async def search_admins(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    admins = db.query(Admin)
+    admins = select(Admin)
 
     if filters.terminated is not None:
         admins = admins.join(User).where(User.terminated == filters.terminated)
 
-    return AdminPage(
-        admins=admins.order_by(
-            text('admins.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=admins.count()
-    )
+    admins, page_info = await paginate(db, admins, Admin, order_by, desc, offset, limit, cursor)
+    return AdminPage(admins=admins, **page_info)
 
 
 @router.post('/search/full-info', response_model=AdminFullInfoPage)
@@ -72,29 +71,28 @@ async def search_admins_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    admins = db.query(Admin)
+    admins = select(Admin)
 
     if filters.terminated is not None:
         admins = admins.join(User).where(User.terminated == filters.terminated)
 
-    return AdminFullInfoPage(
-        admins=admins.order_by(
-            text('admins.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=admins.count()
+    admins, page_info = await paginate(
+        db, admins, Admin, order_by, desc, offset, limit, cursor, options=admin_full_info_options()
     )
+    return AdminFullInfoPage(admins=admins, **page_info)
 
 
 @router.get('/{admin_id}', response_model=AdminInfo)
 async def get_admin_by_id(
         admin_id: uuid.UUID,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    admin = db.query(Admin).where(Admin.id == admin_id).first()
+    admin = await db.scalar(select(Admin).where(Admin.id == admin_id))
     if not admin:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -106,10 +104,10 @@ async def get_admin_by_id(
 @router.get('/full-info/{admin_id}', response_model=AdminFullInfo)
 async def get_admin_full_info_by_id(
         admin_id: uuid.UUID,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    admin = db.query(Admin).where(Admin.id == admin_id).first()
+    admin = await db.scalar(select(Admin).where(Admin.id == admin_id).options(*admin_full_info_options()))
     if not admin:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -122,10 +120,10 @@ async def get_admin_full_info_by_id(
 async def patch_admin(
         admin_id: uuid.UUID,
         admin_data: AdminUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    admin = db.query(Admin).where(Admin.id == admin_id).first()
+    admin = await db.scalar(select(Admin).where(Admin.id == admin_id))
     if not admin:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -134,6 +132,6 @@ async def patch_admin(
 
     await patch_user(admin.user_id, admin_data, db)
 
-    db.refresh(admin)
+    await db.commit()
 
-    return admin
+    return await load_with_options(db, Admin, admin.id, admin_full_info_options())
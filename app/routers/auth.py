@@ -2,22 +2,23 @@ from typing import Union
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import timedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.database import get_db
-from app.auth.password import verify_password, get_password_hash
-from app.auth.jwt import create_token, get_current_user, verify_token
+from app.database import get_async_db
+from app.auth.password import verify_password_async, get_password_hash_async
+from app.auth.jwt import create_tokens, get_current_user_with_roles, verify_token, revoke_tokens, check_principal, \
+    get_credentials_exception, REFRESH_TOKEN, EMAIL_CONFIRMATION_TOKEN
 from app.email import send_email_confirmation_token
-from app.models import User, Admin, Teacher, Student, Level
+from app.loaders import load_with_options, student_full_info_options, user_with_roles_options, \
+    load_user_with_roles
+from app.models import User, Student, Level, RefreshToken
 from app.schemas.token import *
 from app.schemas.admin import *
 from app.schemas.teacher import *
 from app.schemas.student import *
 
-ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
-
 EMAIL_CONFIRMATION_TOKEN_EXPIRE_MINUTES = settings.EMAIL_CONFIRMATION_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter(
@@ -26,22 +27,22 @@ router = APIRouter(
 )
 
 
-async def create_user(user_data, db: Session):
-    email_user = db.query(User).where(User.email == user_data.email).first()
+async def create_user(user_data, db: AsyncSession):
+    email_user = await db.scalar(select(User).where(User.email == user_data.email))
     if email_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Email уже используется'
         )
 
-    phone_user = db.query(User).where(User.phone_number == user_data.phone_number).first()
+    phone_user = await db.scalar(select(User).where(User.phone_number == user_data.phone_number))
     if phone_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Номер телефона уже используется'
         )
 
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     user = User(
         email=user_data.email,
         receive_email=user_data.receive_email,
@@ -53,42 +54,42 @@ async def create_user(user_data, db: Session):
         phone_number=user_data.phone_number
     )
     db.add(user)
+    await db.flush()
 
-    db.commit()
+    await send_email_confirmation_token(user.id, user.email, user.first_name, db)
 
-    try:
-        await send_email_confirmation_token(user.id, user.email, user.first_name)
-    except Exception as e:
-        db.query(User).where(User.id == user.id).delete()
-        db.commit()
-        raise e
+    await db.commit()
+    await db.refresh(user)
 
     return user
 
 
-async def patch_user(user_id, user_data: UserUpdate, db: Session):
-    user = db.query(User).where(User.id == user_id).first()
+async def patch_user(user_id, user_data: UserUpdate, db: AsyncSession):
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Пользователь не найден'
         )
 
+    revoke = user_data.terminated and not user.terminated
+
     if user_data.old_password and user_data.new_password:
         if user_data.old_password == user_data.new_password:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='Новый пароль должен отличаться от старого'
             )
-        if not verify_password(user_data.old_password, user.hashed_password):
+        if not await verify_password_async(user_data.old_password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail='Неверный пароль'
             )
-        user.hashed_password = get_password_hash(user_data.new_password)
+        user.hashed_password = await get_password_hash_async(user_data.new_password)
+        revoke = True
 
     if user_data.phone_number:
-        phone_user = db.query(User).where(User.phone_number == user_data.phone_number).first()
+        phone_user = await db.scalar(select(User).where(User.phone_number == user_data.phone_number))
         if phone_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -96,27 +97,31 @@ async def patch_user(user_id, user_data: UserUpdate, db: Session):
             )
 
     if user_data.email:
-        email_user = db.query(User).where(User.email == user_data.email).first()
+        email_user = await db.scalar(select(User).where(User.email == user_data.email))
         if email_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='Email уже используется'
             )
-        await send_email_confirmation_token(user.id, user_data.email, user.first_name)
+        await send_email_confirmation_token(user.id, user_data.email, user.first_name, db)
         user.email_confirmed = False
+        revoke = True
 
     for field, value in user_data.model_dump(exclude_unset=True).items():
         setattr(user, field, value)
 
-    db.commit()
+    if revoke:
+        revoke_tokens(db, user)
+
+    await db.flush()
 
 
 @router.post('/register', response_model=StudentFullInfo, status_code=status.HTTP_201_CREATED)
 async def register_student(
         student_data: StudentCreate,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    level = db.query(Level).where(Level.id == student_data.level_id).first()
+    level = await db.scalar(select(Level).where(Level.id == student_data.level_id))
     if not level:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -137,16 +142,15 @@ async def register_student(
     )
 
     db.add(student)
-    db.commit()
-    db.refresh(student)
+    await db.commit()
 
-    return student
+    return await load_with_options(db, Student, student.id, student_full_info_options())
 
 
 @router.get('/confirm-email/{confirmation_token}')
 async def confirm_email(
         confirmation_token: str,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -154,9 +158,9 @@ async def confirm_email(
         headers={'WWW-Authenticate': 'Bearer'},
     )
 
-    token_data = verify_token(confirmation_token, credentials_exception)
+    token_data = verify_token(confirmation_token, credentials_exception, EMAIL_CONFIRMATION_TOKEN)
 
-    user = db.query(User).where(User.id == token_data.id).first()
+    user = await db.scalar(select(User).where(User.id == token_data.id))
     if user is None:
         raise credentials_exception
     if user.terminated:
@@ -166,7 +170,7 @@ async def confirm_email(
         )
 
     user.email_confirmed = True
-    db.commit()
+    await db.commit()
 
     return 'Адрес электронной почты подтверждён успешно'
 
@@ -174,10 +178,12 @@ async def confirm_email(
 @router.post('/token', response_model=Token)
 async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(User).where(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await db.scalar(
+        select(User).where(User.email == form_data.username).options(*user_with_roles_options())
+    )
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Неверный email или пароль',
@@ -194,35 +200,64 @@ async def login_for_access_token(
             detail='Пожалуйста, подтвердите адрес электронной почты'
         )
 
-    expires_delta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    tokens = await create_tokens(user, db)
+    await db.commit()
+
+    return tokens
+
+
+@router.post('/refresh', response_model=Token)
+async def refresh_tokens(
+        refresh_data: RefreshTokenRequest,
+        db: AsyncSession = Depends(get_async_db)
+):
+    credentials_exception = get_credentials_exception()
+
+    token_data = verify_token(refresh_data.refresh_token, credentials_exception, REFRESH_TOKEN)
 
-    access_token = create_token(
-        data={'user_id': str(user.id)},
-        expires_delta=expires_delta
+    refresh_token = await db.scalar(
+        select(RefreshToken).where(
+            RefreshToken.id == token_data.jti,
+            RefreshToken.user_id == token_data.id
+        ).with_for_update()
     )
+    if refresh_token is None:
+        raise credentials_exception
+
+    user = await load_user_with_roles(db, token_data.id)
+    if refresh_token.used:
+        # Повторное использование означает утечку токена, поэтому отзываются все токены пользователя
+        if user.token_version == token_data.version:
+            revoke_tokens(db, user)
+            await db.commit()
+        raise credentials_exception
+
+    check_principal(user)
+    if user.token_version != token_data.version:
+        raise credentials_exception
+
+    refresh_token.used = True
+    tokens = await create_tokens(user, db)
+    await db.commit()
 
-    return {'access_token': access_token, 'token_type': 'bearer'}
+    return tokens
 
 
 @router.get('/me', response_model=Union[StudentFullInfoWithRole, TeacherFullInfoWithRole, AdminFullInfoWithRole])
 async def get_current_user_full_info(
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: User = Depends(get_current_user_with_roles)
 ):
-    student = db.query(Student).where(Student.user_id == current_user.id).first()
-    if student:
-        student.role = 'student'
-        return student
-
-    teacher = db.query(Teacher).where(Teacher.user_id == current_user.id).first()
-    if teacher:
-        teacher.role = 'teacher'
-        return teacher
-
-    admin = db.query(Admin).where(Admin.user_id == current_user.id).first()
-    if admin:
-        admin.role = 'admin'
-        return admin
+    if current_user.student:
+        current_user.student.role = 'student'
+        return current_user.student
+
+    if current_user.teacher:
+        current_user.teacher.role = 'teacher'
+        return current_user.teacher
+
+    if current_user.admin:
+        current_user.admin.role = 'admin'
+        return current_user.admin
 
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
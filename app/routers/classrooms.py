@@ -1,12 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import hashlib
+import json
+from datetime import timedelta
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import AfterValidator
-from sqlalchemy import and_, or_, text
-from sqlalchemy.orm import Session
+from sqlalchemy import select, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db, TIMEZONE
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db, TIMEZONE
+from app.pagination import paginate
 from app.email import send_new_classroom_email, send_classroom_terminated_email
+from app.intervals import merge_intervals
+from app.occupancy import classroom_occupied_condition, classroom_occupied_criteria
 from app.models import Classroom, User, Admin, Lesson
 from app.schemas.classroom import *
 
@@ -17,12 +26,14 @@ router = APIRouter(
     tags=['classrooms']
 )
 
+SCHEDULE_MAX_PERIOD = timedelta(days=31)
+
 
 @router.post('/', response_model=ClassroomInfo, status_code=status.HTTP_201_CREATED)
 async def create_classroom(
         classroom_data: ClassroomCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     classroom = Classroom(
         name=classroom_data.name,
@@ -30,11 +41,11 @@ async def create_classroom(
     )
 
     db.add(classroom)
-    db.commit()
 
     await send_new_classroom_email(classroom, db)
 
-    db.refresh(classroom)
+    await db.commit()
+    await db.refresh(classroom)
 
     return classroom
 
@@ -52,20 +63,17 @@ async def search_classrooms(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    classrooms = db.query(Classroom)
+    classrooms = select(Classroom)
 
     if filters.terminated is not None:
         classrooms = classrooms.where(Classroom.terminated == filters.terminated)
 
-    return ClassroomPage(
-        classrooms=classrooms.order_by(
-            text('classrooms.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=classrooms.count()
-    )
+    classrooms, page_info = await paginate(db, classrooms, Classroom, order_by, desc, offset, limit, cursor)
+    return ClassroomPage(classrooms=classrooms, **page_info)
 
 
 @router.post('/search/available', response_model=ClassroomPage)
@@ -75,8 +83,9 @@ async def search_available_classrooms(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
     filters.date_from = filters.date_from.astimezone(TIMEZONE)
     filters.date_to = filters.date_to.astimezone(TIMEZONE)
@@ -88,38 +97,113 @@ async def search_available_classrooms(
     if filters.date_from < datetime.now(TIMEZONE):
         return ClassroomPage(classrooms=[], total=0)
 
-    classrooms = db.query(Classroom).where(
+    classrooms = select(Classroom).where(
         Classroom.terminated == False,
-        ~db.query(Lesson).where(
-            Lesson.classroom_id == Classroom.id,
-            Lesson.terminated == False,
-            or_(
-                filters.are_neighbours_allowed == False,
-                Lesson.are_neighbours_allowed == False
-            ),
-            or_(
-                and_(filters.date_from >= Lesson.start_time, filters.date_from < Lesson.finish_time),
-                and_(filters.date_to > Lesson.start_time, filters.date_to <= Lesson.finish_time),
-                and_(filters.date_from <= Lesson.start_time, filters.date_to >= Lesson.finish_time)
-            )
-        ).exists()
+        ~classroom_occupied_condition(
+            Classroom.id, filters.date_from, filters.date_to, filters.are_neighbours_allowed
+        )
     )
 
-    return ClassroomPage(
-        classrooms=classrooms.order_by(
-            text('classrooms.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=classrooms.count()
+    classrooms, page_info = await paginate(db, classrooms, Classroom, order_by, desc, offset, limit, cursor)
+    return ClassroomPage(classrooms=classrooms, **page_info)
+
+
+def snap_to_cells(start_time, finish_time, date_from, date_to, granularity):
+    # Расширяет интервал до границ ячеек сетки, отсчитываемых от начала периода
+    start_time = max(start_time, date_from)
+    finish_time = min(finish_time, date_to)
+    start_cells = (start_time - date_from) // granularity
+    finish_cells = -(-(finish_time - date_from) // granularity)
+    return date_from + start_cells * granularity, min(date_from + finish_cells * granularity, date_to)
+
+
+def get_etag(content):
+    return '"' + hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(etag, if_none_match):
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+@router.get('/schedule', response_model=ClassroomSchedule)
+async def get_classrooms_schedule(
+        request: Request,
+        response: Response,
+        date_from: datetime,
+        date_to: datetime,
+        are_neighbours_allowed: bool = False,
+        granularity_minutes: Annotated[int, Query(ge=5, le=1440)] = 30,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    date_from = date_from.astimezone(TIMEZONE)
+    date_to = date_to.astimezone(TIMEZONE)
+    if date_from > date_to:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Время начала поиска не может быть больше времени конца поиска'
+        )
+    if date_to - date_from > SCHEDULE_MAX_PERIOD:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Период расписания не может превышать 31 день'
+        )
+    granularity = timedelta(minutes=granularity_minutes)
+
+    # Все активные залы и мешающие им занятия за период одним запросом, залы без занятий дают строку с NULL
+    rows = (await db.execute(select(
+        Classroom,
+        Lesson.start_time,
+        Lesson.finish_time
+    ).outerjoin(
+        Lesson,
+        and_(*classroom_occupied_criteria(Classroom.id, date_from, date_to, are_neighbours_allowed))
+    ).where(
+        Classroom.terminated == False
+    ).order_by(
+        Classroom.name
+    ))).all()
+
+    classrooms = {}
+    for classroom, start_time, finish_time in rows:
+        busy_intervals = classrooms.setdefault(classroom, [])
+        if start_time is not None:
+            busy_intervals.append(snap_to_cells(
+                start_time.astimezone(TIMEZONE), finish_time.astimezone(TIMEZONE), date_from, date_to, granularity
+            ))
+
+    schedule = ClassroomSchedule(
+        date_from=date_from,
+        date_to=date_to,
+        granularity_minutes=granularity_minutes,
+        are_neighbours_allowed=are_neighbours_allowed,
+        classrooms=[ClassroomScheduleItem(
+            classroom=ClassroomInfo.model_validate(classroom),
+            busy_intervals=[
+                ClassroomBusyInterval(start_time=start_time, finish_time=finish_time)
+                for start_time, finish_time in merge_intervals(busy_intervals)
+            ]
+        ) for classroom, busy_intervals in classrooms.items()]
     )
 
+    # ETag зависит только от содержимого ответа и меняется вместе с занятиями и залами периода
+    etag = get_etag(jsonable_encoder(schedule))
+    if etag_matches(etag, request.headers.get('If-None-Match')):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return schedule
+
 
 @router.get('/{classroom_id}', response_model=ClassroomInfo)
 async def get_classroom_by_id(
         classroom_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    classroom = db.query(Classroom).where(Classroom.id == classroom_id).first()
+    classroom = await db.scalar(select(Classroom).where(Classroom.id == classroom_id))
     if classroom is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -132,10 +216,10 @@ async def get_classroom_by_id(
 async def patch_classroom(
         classroom_id: uuid.UUID,
         classroom_data: ClassroomUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    classroom = db.query(Classroom).where(Classroom.id == classroom_id).first()
+    classroom = await db.scalar(select(Classroom).where(Classroom.id == classroom_id))
     if not classroom:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -152,6 +236,6 @@ async def patch_classroom(
     elif not classroom.terminated and old_terminated:
         await send_new_classroom_email(classroom, db)
 
-    db.commit()
-    db.refresh(classroom)
+    await db.commit()
+    await db.refresh(classroom)
     return classroom
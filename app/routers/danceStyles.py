@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import AfterValidator
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Annotated
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db
+from app.pagination import paginate
 from app.models import User, Admin, DanceStyle, LessonType
 from app.schemas.danceStyle import *
 
@@ -20,8 +22,8 @@ router = APIRouter(
 @router.post('/', response_model=DanceStyleInfo, status_code=status.HTTP_201_CREATED)
 async def create_dance_style(
         dance_style_data: DanceStyleCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     dance_style = DanceStyle(
         name=dance_style_data.name,
@@ -30,8 +32,8 @@ async def create_dance_style(
     )
 
     db.add(dance_style)
-    db.commit()
-    db.refresh(dance_style)
+    await db.commit()
+    await db.refresh(dance_style)
 
     return dance_style
 
@@ -49,29 +51,26 @@ async def search_dance_styles(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    dance_styles = db.query(DanceStyle)
+    dance_styles = select(DanceStyle)
 
     if filters.terminated is not None:
         dance_styles = dance_styles.where(DanceStyle.terminated == filters.terminated)
 
-    return DanceStylePage(
-        dance_styles=dance_styles.order_by(
-            text('dance_styles.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=dance_styles.count()
-    )
+    dance_styles, page_info = await paginate(db, dance_styles, DanceStyle, order_by, desc, offset, limit, cursor)
+    return DanceStylePage(dance_styles=dance_styles, **page_info)
 
 
 @router.get('/{dance_style_id}', response_model=DanceStyleInfo)
 async def get_dance_style_by_id(
         dance_style_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    dance_style = db.query(DanceStyle).where(DanceStyle.id == dance_style_id).first()
+    dance_style = await db.scalar(select(DanceStyle).where(DanceStyle.id == dance_style_id))
     if not dance_style:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -84,10 +83,10 @@ async def get_dance_style_by_id(
 async def patch_dance_style(
         dance_style_id: uuid.UUID,
         dance_style_data: DanceStyleUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    dance_style = db.query(DanceStyle).where(DanceStyle.id == dance_style_id).first()
+    dance_style = await db.scalar(select(DanceStyle).where(DanceStyle.id == dance_style_id))
     if not dance_style:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -95,16 +94,16 @@ async def patch_dance_style(
         )
 
     if dance_style_data.terminated:
-        db.query(LessonType).where(
+        await db.execute(update(LessonType).where(
             LessonType.dance_style_id == dance_style_id
-        ).update(
+        ).values(
             {LessonType.terminated: True}
-        )
+        ))
 
     for field, value in dance_style_data.model_dump(exclude_unset=True).items():
         setattr(dance_style, field, value)
 
-    db.commit()
-    db.refresh(dance_style)
+    await db.commit()
+    await db.refresh(dance_style)
 
     return dance_style
@@ -2,11 +2,13 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import AfterValidator
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db
+from app.pagination import paginate
 from app.models import User, Admin, EventType
 from app.schemas.eventType import *
 
@@ -21,8 +23,8 @@ router = APIRouter(
 @router.post('/', response_model=EventTypeInfo, status_code=status.HTTP_201_CREATED)
 async def create_event_type(
         event_type_data: EventTypeCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     event_type = EventType(
         name=event_type_data.name,
@@ -30,8 +32,8 @@ async def create_event_type(
     )
 
     db.add(event_type)
-    db.commit()
-    db.refresh(event_type)
+    await db.commit()
+    await db.refresh(event_type)
 
     return event_type
 
@@ -49,29 +51,26 @@ async def search_event_types(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    event_types = db.query(EventType)
+    event_types = select(EventType)
 
     if filters.terminated is not None:
         event_types = event_types.where(EventType.terminated == filters.terminated)
 
-    return EventTypePage(
-        event_types=event_types.order_by(
-            text('event_types.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=event_types.count()
-    )
+    event_types, page_info = await paginate(db, event_types, EventType, order_by, desc, offset, limit, cursor)
+    return EventTypePage(event_types=event_types, **page_info)
 
 
 @router.get('/{event_type_id}', response_model=EventTypeInfo)
 async def get_event_type_by_id(
         event_type_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    event_type = db.query(EventType).where(EventType.id == event_type_id).first()
+    event_type = await db.scalar(select(EventType).where(EventType.id == event_type_id))
     if event_type is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -84,10 +83,10 @@ async def get_event_type_by_id(
 async def patch_event_type(
         event_type_id: uuid.UUID,
         event_type_data: EventTypeUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    event_type = db.query(EventType).where(EventType.id == event_type_id).first()
+    event_type = await db.scalar(select(EventType).where(EventType.id == event_type_id))
     if not event_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -97,6 +96,6 @@ async def patch_event_type(
     for field, value in event_type_data.model_dump(exclude_unset=True).items():
         setattr(event_type, field, value)
 
-    db.commit()
-    db.refresh(event_type)
+    await db.commit()
+    await db.refresh(event_type)
     return event_type
@@ -2,11 +2,14 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import AfterValidator
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db, TIMEZONE
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db, TIMEZONE
+from app.pagination import paginate
+from app.loaders import load_with_options, event_full_info_options
 from app.models import User, Admin, Event, EventType
 from app.schemas.event import *
 from app.email import send_new_event_email, send_event_rescheduled_email, send_event_cancelled_email
@@ -22,8 +25,8 @@ router = APIRouter(
 @router.post('/', response_model=EventInfo, status_code=status.HTTP_201_CREATED)
 async def create_event(
         event_data: EventCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     event_data.start_time = event_data.start_time.astimezone(TIMEZONE)
     if event_data.start_time <= datetime.now(TIMEZONE):
@@ -32,7 +35,7 @@ async def create_event(
             detail='Мероприятие должно начинаться в будущем'
         )
 
-    event_type = db.query(EventType).where(EventType.id == event_data.event_type_id).first()
+    event_type = await db.scalar(select(EventType).where(EventType.id == event_data.event_type_id))
     if not event_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -53,13 +56,12 @@ async def create_event(
     )
 
     db.add(event)
-    db.commit()
 
     await send_new_event_email(event, db)
 
-    db.refresh(event)
+    await db.commit()
 
-    return event
+    return await load_with_options(db, Event, event.id, event_full_info_options())
 
 
 def apply_filters_to_events(events, filters):
@@ -95,17 +97,14 @@ async def search_events(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    events = db.query(Event)
+    events = select(Event)
     events = apply_filters_to_events(events, filters)
-    return EventPage(
-        events=events.order_by(
-            text('events.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=events.count()
-    )
+    events, page_info = await paginate(db, events, Event, order_by, desc, offset, limit, cursor)
+    return EventPage(events=events, **page_info)
 
 
 @router.post('/search/full-info', response_model=EventFullInfoPage)
@@ -115,26 +114,25 @@ async def search_events_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    events = db.query(Event)
+    events = select(Event)
     events = apply_filters_to_events(events, filters)
-    return EventFullInfoPage(
-        events=events.order_by(
-            text('events.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=events.count()
+    events, page_info = await paginate(
+        db, events, Event, order_by, desc, offset, limit, cursor, options=event_full_info_options()
     )
+    return EventFullInfoPage(events=events, **page_info)
 
 
 @router.get('/{event_id}', response_model=EventInfo)
 async def get_event_by_id(
         event_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    event = db.query(Event).where(Event.id == event_id).first()
+    event = await db.scalar(select(Event).where(Event.id == event_id))
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -146,10 +144,10 @@ async def get_event_by_id(
 @router.get('/full-info/{event_id}', response_model=EventFullInfo)
 async def get_event_full_info_by_id(
         event_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    event = db.query(Event).where(Event.id == event_id).first()
+    event = await db.scalar(select(Event).where(Event.id == event_id).options(*event_full_info_options()))
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -162,10 +160,10 @@ async def get_event_full_info_by_id(
 async def patch_event(
         event_id: uuid.UUID,
         event_data: EventUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    event = db.query(Event).where(Event.id == event_id).first()
+    event = await db.scalar(select(Event).where(Event.id == event_id))
     if not event:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -176,7 +174,7 @@ async def patch_event(
         event_data.start_time = event_data.start_time.astimezone(TIMEZONE)
 
     if event_data.event_type_id:
-        event_type = db.query(EventType).where(EventType.id == event_data.event_type_id).first()
+        event_type = await db.scalar(select(EventType).where(EventType.id == event_data.event_type_id))
         if not event_type:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -194,8 +192,6 @@ async def patch_event(
     for field, value in event_data.model_dump(exclude_unset=True).items():
         setattr(event, field, value)
 
-    db.commit()
-
     if not old_terminated:
         if event.terminated:
             await send_event_cancelled_email(event, db)
@@ -204,6 +200,6 @@ async def patch_event(
     elif not event.terminated:
         await send_event_rescheduled_email(event, db)
 
-    db.refresh(event)
+    await db.commit()
 
-    return event
+    return await load_with_options(db, Event, event.id, event_full_info_options())
@@ -2,12 +2,16 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import AfterValidator
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db, TIMEZONE
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db, TIMEZONE
+from app.pagination import paginate
 from app.email import send_new_group_email
+from app.loaders import load_with_options, group_full_info_options
+from app.subscription_lessons import cancel_lesson_subscriptions
 from app.models import User, Admin, Group, Level, Lesson, LessonType
 from app.models.association import *
 from app.routers.students import get_fitting_subscriptions
@@ -22,8 +26,8 @@ router = APIRouter(
 @router.post('/', response_model=GroupInfo, status_code=status.HTTP_201_CREATED)
 async def create_group(
         group_data: GroupCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     if group_data.max_capacity <= 0:
         raise HTTPException(
@@ -31,7 +35,7 @@ async def create_group(
             detail='Количество мест в группе должно быть положительным'
         )
 
-    level = db.query(Level).where(Level.id == group_data.level_id).first()
+    level = await db.scalar(select(Level).where(Level.id == group_data.level_id))
     if not level:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -51,25 +55,24 @@ async def create_group(
     )
 
     db.add(group)
-    db.commit()
 
     await send_new_group_email(group, db)
 
-    db.refresh(group)
+    await db.commit()
 
-    return group
+    return await load_with_options(db, Group, group.id, group_full_info_options())
 
 
 def apply_filters_to_groups(groups: Query, filters, db):
     if filters.has_teachers is not None:
         groups = groups.where(
-            db.query(TeacherGroup).where(
+            select(TeacherGroup).where(
                 TeacherGroup.group_id == Group.id
             ).exists() == filters.has_teachers
         )
     if filters.teacher_ids:
         groups = groups.where(
-            db.query(TeacherGroup).where(
+            select(TeacherGroup).where(
                 TeacherGroup.group_id == Group.id,
                 TeacherGroup.teacher_id.in_(filters.teacher_ids)
             ).exists()
@@ -77,13 +80,13 @@ def apply_filters_to_groups(groups: Query, filters, db):
 
     if filters.has_students is not None:
         groups = groups.where(
-            db.query(StudentGroup).where(
+            select(StudentGroup).where(
                 StudentGroup.group_id == Group.id
             ).exists() == filters.has_students
         )
     if filters.student_ids:
         groups = groups.where(
-            db.query(StudentGroup).where(
+            select(StudentGroup).where(
                 StudentGroup.group_id == Group.id,
                 StudentGroup.student_id.in_(filters.student_ids)
             ).exists()
@@ -94,7 +97,7 @@ def apply_filters_to_groups(groups: Query, filters, db):
 
     if filters.dance_style_ids:
         groups = groups.where(
-            db.query(Lesson).where(
+            select(Lesson).where(
                 Lesson.group_id == Group.id
             ).join(LessonType).where(
                 LessonType.dance_style_id.in_(filters.dance_style_ids)
@@ -120,17 +123,14 @@ async def search_groups(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    groups = db.query(Group)
+    groups = select(Group)
     groups = apply_filters_to_groups(groups, filters, db)
-    return GroupPage(
-        groups=groups.order_by(
-            text('groups.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=groups.count()
-    )
+    groups, page_info = await paginate(db, groups, Group, order_by, desc, offset, limit, cursor)
+    return GroupPage(groups=groups, **page_info)
 
 
 @router.post('/search/full-info', response_model=GroupFullInfoPage)
@@ -140,26 +140,25 @@ async def search_groups_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    groups = db.query(Group)
+    groups = select(Group)
     groups = apply_filters_to_groups(groups, filters, db)
-    return GroupFullInfoPage(
-        groups=groups.order_by(
-            text('groups.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=groups.count()
+    groups, page_info = await paginate(
+        db, groups, Group, order_by, desc, offset, limit, cursor, options=group_full_info_options()
     )
+    return GroupFullInfoPage(groups=groups, **page_info)
 
 
 @router.get('/{group_id}', response_model=GroupInfo)
 async def get_group_by_id(
         group_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    group = db.query(Group).where(Group.id == group_id).first()
+    group = await db.scalar(select(Group).where(Group.id == group_id))
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -171,18 +170,18 @@ async def get_group_by_id(
 @router.get('/full-info/{group_id}', response_model=GroupWithSubscriptions)
 async def get_group_full_info_by_id(
         group_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    group = db.query(Group).where(Group.id == group_id).first()
+    group = await db.scalar(select(Group).where(Group.id == group_id).options(*group_full_info_options()))
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Группа не найдена'
         )
 
-    if current_user.student and current_user.student not in group.students:
-        group.fitting_subscriptions = get_fitting_subscriptions(current_user.student, group, db)
+    if current_user.student and current_user.student.id not in [student.id for student in group.students]:
+        group.fitting_subscriptions = await get_fitting_subscriptions(current_user.student, group, db)
 
     return group
 
@@ -191,10 +190,10 @@ async def get_group_full_info_by_id(
 async def patch_group(
         group_id: uuid.UUID,
         group_data: GroupUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    group = db.query(Group).where(Group.id == group_id).first()
+    group = await db.scalar(select(Group).where(Group.id == group_id))
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -208,7 +207,7 @@ async def patch_group(
         )
 
     if group_data.level_id:
-        level = db.query(Level).where(Level.id == group_data.level_id).first()
+        level = await db.scalar(select(Level).where(Level.id == group_data.level_id))
         if not level:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -221,38 +220,30 @@ async def patch_group(
             )
 
     if group_data.terminated:
-        db.query(TeacherGroup).where(
+        await db.execute(delete(TeacherGroup).where(
             TeacherGroup.group_id == group_id
-        ).delete()
+        ))
 
-        db.query(StudentGroup).where(
+        await db.execute(delete(StudentGroup).where(
             StudentGroup.group_id == group_id
-        ).delete()
+        ))
 
-        group_lessons = db.query(Lesson).where(
+        group_lesson_ids = (await db.scalars(update(Lesson).where(
             Lesson.group_id == group_id,
             Lesson.start_time >= datetime.now(TIMEZONE)
-        )
-        group_lessons.update(
+        ).values(
             {Lesson.terminated: True}
-        )
+        ).returning(Lesson.id))).all()
 
-        group_lesson_ids = [group_lesson.id for group_lesson in group_lessons.all()]
-
-        db.query(TeacherLesson).where(
+        await db.execute(delete(TeacherLesson).where(
             TeacherLesson.lesson_id.in_(group_lesson_ids)
-        ).delete()
+        ))
 
-        db.query(LessonSubscription).where(
-            LessonSubscription.lesson_id.in_(group_lesson_ids)
-        ).update(
-            {LessonSubscription.cancelled: True}
-        )
+        await cancel_lesson_subscriptions(db, LessonSubscription.lesson_id.in_(group_lesson_ids))
 
     for field, value in group_data.model_dump(exclude_unset=True).items():
         setattr(group, field, value)
 
-    db.commit()
-    db.refresh(group)
+    await db.commit()
 
-    return group
+    return await load_with_options(db, Group, group.id, group_full_info_options())
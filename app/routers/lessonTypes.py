@@ -2,11 +2,14 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import AfterValidator
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db
+from app.pagination import paginate
+from app.loaders import load_with_options, lesson_type_full_info_options
 from app.models import User, Admin, LessonType, DanceStyle
 from app.schemas.lessonType import *
 
@@ -18,11 +21,11 @@ router = APIRouter(
 )
 
 
-def check_lesson_type_data(lesson_type_data, db: Session, existing_lesson_type=None):
+async def check_lesson_type_data(lesson_type_data, db: AsyncSession, existing_lesson_type=None):
     if lesson_type_data.dance_style_id:
-        dance_style = db.query(DanceStyle).where(
+        dance_style = await db.scalar(select(DanceStyle).where(
             DanceStyle.id == lesson_type_data.dance_style_id
-        ).first()
+        ))
         if not dance_style:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -41,10 +44,10 @@ def check_lesson_type_data(lesson_type_data, db: Session, existing_lesson_type=N
         is_group = lesson_type_data.is_group if lesson_type_data.is_group is not None \
             else existing_lesson_type.is_group
 
-        lesson_type_check = db.query(LessonType).where(
+        lesson_type_check = await db.scalar(select(LessonType).where(
             LessonType.dance_style_id == dance_style_id,
             LessonType.is_group == is_group
-        ).first()
+        ))
 
         if lesson_type_check:
             raise HTTPException(
@@ -56,10 +59,10 @@ def check_lesson_type_data(lesson_type_data, db: Session, existing_lesson_type=N
 @router.post('/', response_model=LessonTypeInfo, status_code=status.HTTP_201_CREATED)
 async def create_lesson_type(
         lesson_type_data: LessonTypeCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    check_lesson_type_data(lesson_type_data, db)
+    await check_lesson_type_data(lesson_type_data, db)
 
     lesson_type = LessonType(
         dance_style_id=lesson_type_data.dance_style_id,
@@ -67,10 +70,9 @@ async def create_lesson_type(
     )
 
     db.add(lesson_type)
-    db.commit()
-    db.refresh(lesson_type)
+    await db.commit()
 
-    return lesson_type
+    return await load_with_options(db, LessonType, lesson_type.id, lesson_type_full_info_options())
 
 
 def apply_filters_to_lesson_types(lesson_types, filters):
@@ -98,17 +100,16 @@ async def search_lesson_types(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lesson_types = db.query(LessonType)
+    lesson_types = select(LessonType)
     lesson_types = apply_filters_to_lesson_types(lesson_types, filters)
-    return LessonTypePage(
-        lesson_types=lesson_types.order_by(
-            text('lesson_types.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=lesson_types.count()
+    lesson_types, page_info = await paginate(
+        db, lesson_types, LessonType, order_by, desc, offset, limit, cursor
     )
+    return LessonTypePage(lesson_types=lesson_types, **page_info)
 
 
 @router.post('/search/full-info', response_model=LessonTypeFullInfoPage)
@@ -118,26 +119,25 @@ async def search_lesson_types_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lesson_types = db.query(LessonType)
+    lesson_types = select(LessonType)
     lesson_types = apply_filters_to_lesson_types(lesson_types, filters)
-    return LessonTypeFullInfoPage(
-        lesson_types=lesson_types.order_by(
-            text('lesson_types.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=lesson_types.count()
+    lesson_types, page_info = await paginate(
+        db, lesson_types, LessonType, order_by, desc, offset, limit, cursor, options=lesson_type_full_info_options()
     )
+    return LessonTypeFullInfoPage(lesson_types=lesson_types, **page_info)
 
 
 @router.get('/{lesson_type_id}', response_model=LessonTypeInfo)
 async def get_lesson_type_by_id(
         lesson_type_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lesson_type = db.query(LessonType).where(LessonType.id == lesson_type_id).first()
+    lesson_type = await db.scalar(select(LessonType).where(LessonType.id == lesson_type_id))
     if not lesson_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -149,10 +149,12 @@ async def get_lesson_type_by_id(
 @router.get('/full-info/{lesson_type_id}', response_model=LessonTypeFullInfo)
 async def get_lesson_type_full_info_by_id(
         lesson_type_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lesson_type = db.query(LessonType).where(LessonType.id == lesson_type_id).first()
+    lesson_type = await db.scalar(
+        select(LessonType).where(LessonType.id == lesson_type_id).options(*lesson_type_full_info_options())
+    )
     if not lesson_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -165,22 +167,21 @@ async def get_lesson_type_full_info_by_id(
 async def patch_lesson_type(
         lesson_type_id: uuid.UUID,
         lesson_type_data: LessonTypeUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lesson_type = db.query(LessonType).where(LessonType.id == lesson_type_id).first()
+    lesson_type = await db.scalar(select(LessonType).where(LessonType.id == lesson_type_id))
     if not lesson_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Тип занятия не найден'
         )
 
-    check_lesson_type_data(lesson_type_data, db, lesson_type)
+    await check_lesson_type_data(lesson_type_data, db, lesson_type)
 
     for field, value in lesson_type_data.model_dump(exclude_unset=True).items():
         setattr(lesson_type, field, value)
 
-    db.commit()
-    db.refresh(lesson_type)
+    await db.commit()
 
-    return lesson_type
+    return await load_with_options(db, LessonType, lesson_type.id, lesson_type_full_info_options())
@@ -2,16 +2,22 @@ from datetime import timedelta
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.encoders import jsonable_encoder
 from pydantic import AfterValidator
-from sqlalchemy import or_, and_, text
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, and_, false, values, column, Integer, DateTime, select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 
 from app.auth.jwt import get_current_admin, get_current_teacher, get_current_student, get_current_user
-from app.database import get_db, TIMEZONE
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db, TIMEZONE
+from app.pagination import paginate
 from app.email import send_new_group_lesson_email, send_lesson_cancelled_email, send_lesson_rescheduled_email, \
     send_new_individual_lesson_email, send_new_lesson_request_email, send_lesson_request_accepted_email, \
-    send_lesson_request_declined_email
-from app.routers.classrooms import search_available_classrooms
+    send_lesson_request_declined_email, send_new_group_lesson_series_email
+from app.loaders import lesson_full_info_options, subscription_full_info_options, load_with_options
+from app.subscription_lessons import use_subscription_lesson, cancel_lesson_subscriptions
+from app.occupancy import is_classroom_occupied, classroom_occupied_criteria
 from app.models import User, Admin, Teacher, Student, Group, Lesson, LessonType, Classroom
 from app.models import Subscription, SubscriptionTemplate
 from app.models.association import *
@@ -25,11 +31,13 @@ router = APIRouter(
 )
 
 
-async def check_classroom(classroom_id, start_time, finish_time, are_neighbours_allowed, db: Session):
+async def check_classroom(
+        classroom_id, start_time, finish_time, are_neighbours_allowed, db: AsyncSession, lesson_id=None
+):
     start_time = start_time.astimezone(TIMEZONE)
     finish_time = finish_time.astimezone(TIMEZONE)
 
-    classroom = db.query(Classroom).where(Classroom.id == classroom_id).first()
+    classroom = await db.scalar(select(Classroom).where(Classroom.id == classroom_id))
     if not classroom:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -41,20 +49,17 @@ async def check_classroom(classroom_id, start_time, finish_time, are_neighbours_
             detail='Зал не активен'
         )
 
-    available_classrooms = await search_available_classrooms(ClassroomAvailableFilters(
-        date_from=start_time,
-        date_to=finish_time,
-        are_neighbours_allowed=are_neighbours_allowed
-    ), db=db)
-    available_classroom_ids = [available_classroom.id for available_classroom in available_classrooms.classrooms]
-    if classroom.id not in available_classroom_ids:
+    # Залы в прошлом, как и в поиске свободных залов, не бронируются
+    if start_time < datetime.now(TIMEZONE) or await is_classroom_occupied(
+            classroom.id, start_time, finish_time, are_neighbours_allowed, db, lesson_id
+    ):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Зал занят'
         )
 
 
-async def check_lesson_data(lesson_data, is_group, db: Session, existing_lesson=None):
+async def check_lesson_data(lesson_data, is_group, db: AsyncSession, existing_lesson=None):
     if lesson_data.start_time:
         lesson_data.start_time = lesson_data.start_time.astimezone(TIMEZONE)
     if lesson_data.finish_time:
@@ -74,7 +79,7 @@ async def check_lesson_data(lesson_data, is_group, db: Session, existing_lesson=
         )
 
     if lesson_data.lesson_type_id:
-        lesson_type = db.query(LessonType).where(LessonType.id == lesson_data.lesson_type_id).first()
+        lesson_type = await db.scalar(select(LessonType).where(LessonType.id == lesson_data.lesson_type_id))
         if not lesson_type:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -116,11 +121,17 @@ async def check_lesson_data(lesson_data, is_group, db: Session, existing_lesson=
         are_neighbours_allowed = lesson_data.are_neighbours_allowed if lesson_data.are_neighbours_allowed is not None \
             else existing_lesson.are_neighbours_allowed
 
-        await check_classroom(classroom_id, start_time, finish_time, are_neighbours_allowed, db)
+        await check_classroom(
+            classroom_id, start_time, finish_time, are_neighbours_allowed, db,
+            existing_lesson.id if existing_lesson else None
+        )
 
 
-def get_and_check_group(group_id, db: Session):
-    group = db.query(Group).where(Group.id == group_id).first()
+async def get_and_check_group(group_id, db: AsyncSession):
+    group = await db.scalar(select(Group).where(Group.id == group_id).options(
+        selectinload(Group.teachers),
+        selectinload(Group.students)
+    ))
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -134,9 +145,9 @@ def get_and_check_group(group_id, db: Session):
     return group
 
 
-def create_subscription(student_id, lesson_type_id, db: Session):
-    subscription_template = db.query(SubscriptionTemplate).where(
-        db.query(SubscriptionLessonType).where(
+async def create_subscription(student_id, lesson_type_id, db: AsyncSession):
+    subscription_template = await db.scalar(select(SubscriptionTemplate).where(
+        select(SubscriptionLessonType).where(
             SubscriptionLessonType.subscription_template_id == SubscriptionTemplate.id,
             SubscriptionLessonType.lesson_type_id == lesson_type_id,
             or_(
@@ -146,7 +157,7 @@ def create_subscription(student_id, lesson_type_id, db: Session):
         ).exists()
     ).order_by(
         SubscriptionTemplate.price
-    ).first()
+    ))
 
     if not subscription_template:
         raise HTTPException(
@@ -168,81 +179,60 @@ def create_subscription(student_id, lesson_type_id, db: Session):
     return subscription
 
 
-def get_teacher_parallel_lesson(teacher_id, start_time, finish_time, db: Session):
+async def get_teacher_parallel_lesson(teacher_id, start_time, finish_time, db: AsyncSession):
     start_time = start_time.astimezone(TIMEZONE)
     finish_time = finish_time.astimezone(TIMEZONE)
-    teacher_parallel_lesson = db.query(Lesson).where(
-        db.query(TeacherLesson).where(
+    teacher_parallel_lesson = await db.scalar(select(Lesson).where(
+        Lesson.terminated == False,
+        Lesson.overlaps(start_time, finish_time),
+        select(TeacherLesson).where(
             TeacherLesson.lesson_id == Lesson.id,
-            TeacherLesson.teacher_id == teacher_id,
-            Lesson.terminated == False,
-            or_(
-                and_(start_time >= Lesson.start_time,
-                     start_time < Lesson.finish_time),
-                and_(finish_time > Lesson.start_time,
-                     finish_time <= Lesson.finish_time),
-                and_(start_time <= Lesson.start_time,
-                     finish_time >= Lesson.finish_time)
-            )
+            TeacherLesson.teacher_id == teacher_id
         ).exists()
-    ).first()
+    ))
     return teacher_parallel_lesson
 
 
-def get_student_parallel_lesson(student_id, start_time, finish_time, db: Session):
+async def get_student_parallel_lesson(student_id, start_time, finish_time, db: AsyncSession):
     start_time = start_time.astimezone(TIMEZONE)
     finish_time = finish_time.astimezone(TIMEZONE)
-    student_parallel_lesson = db.query(Lesson).where(
+    student_parallel_lesson = await db.scalar(select(Lesson).where(
         Lesson.terminated == False,
-        db.query(LessonSubscription).where(
+        Lesson.overlaps(start_time, finish_time),
+        select(LessonSubscription).where(
             LessonSubscription.lesson_id == Lesson.id,
             LessonSubscription.cancelled == False
         ).join(Subscription).where(
-            Subscription.student_id == student_id,
-            or_(
-                and_(start_time >= Lesson.start_time,
-                     start_time < Lesson.finish_time),
-                and_(finish_time > Lesson.start_time,
-                     finish_time <= Lesson.finish_time),
-                and_(start_time <= Lesson.start_time,
-                     finish_time >= Lesson.finish_time)
-            )
+            Subscription.student_id == student_id
         ).exists()
-    ).first()
+    ))
     return student_parallel_lesson
 
 
-def get_group_parallel_lesson(group_id, start_time, finish_time, db: Session):
+async def get_group_parallel_lesson(group_id, start_time, finish_time, db: AsyncSession):
     start_time = start_time.astimezone(TIMEZONE)
     finish_time = finish_time.astimezone(TIMEZONE)
-    group_parallel_lesson = db.query(Lesson).where(
+    group_parallel_lesson = await db.scalar(select(Lesson).where(
         Lesson.group_id == group_id,
         Lesson.terminated == False,
-        or_(
-            and_(start_time >= Lesson.start_time,
-                 start_time < Lesson.finish_time),
-            and_(finish_time > Lesson.start_time,
-                 finish_time <= Lesson.finish_time),
-            and_(start_time <= Lesson.start_time,
-                 finish_time >= Lesson.finish_time)
-        )
-    ).first()
+        Lesson.overlaps(start_time, finish_time)
+    ))
     return group_parallel_lesson
 
 
 @router.post('/', response_model=LessonInfo, status_code=status.HTTP_201_CREATED)
 async def create_lesson(
         lesson_data: LessonCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     if lesson_data.group_id:
-        get_and_check_group(lesson_data.group_id, db)
+        await get_and_check_group(lesson_data.group_id, db)
 
     await check_lesson_data(lesson_data, lesson_data.group_id, db)
 
     if lesson_data.group_id:
-        parallel_lesson = get_group_parallel_lesson(
+        parallel_lesson = await get_group_parallel_lesson(
             lesson_data.group_id, lesson_data.start_time, lesson_data.finish_time, db
         )
         if parallel_lesson:
@@ -263,12 +253,14 @@ async def create_lesson(
         is_confirmed=lesson_data.is_confirmed
     )
     db.add(lesson)
-    db.commit()
+    await db.flush()
 
     if lesson.group_id:
+        lesson = await load_with_options(db, Lesson, lesson.id, lesson_full_info_options())
         await send_new_group_lesson_email(lesson, db)
 
-    db.refresh(lesson)
+    await db.commit()
+    await db.refresh(lesson)
 
     return lesson
 
@@ -276,10 +268,12 @@ async def create_lesson(
 @router.post('/individual', response_model=LessonFullInfo, status_code=status.HTTP_201_CREATED)
 async def create_individual_lesson(
         lesson_data: LessonCreateIndividual,
-        current_teacher: Teacher = Depends(get_current_teacher),
-        db: Session = Depends(get_db)
+        current_teacher: PrincipalRole = Depends(get_current_teacher),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    student = db.query(Student).where(Student.id == lesson_data.student_id).first()
+    student = await db.scalar(select(Student).where(Student.id == lesson_data.student_id).options(
+        joinedload(Student.user)
+    ))
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -293,9 +287,9 @@ async def create_individual_lesson(
 
     await check_lesson_data(lesson_data, False, db)
 
-    subscription = create_subscription(student.id, lesson_data.lesson_type_id, db)
+    subscription = await create_subscription(student.id, lesson_data.lesson_type_id, db)
 
-    parallel_teacher_lesson = get_teacher_parallel_lesson(
+    parallel_teacher_lesson = await get_teacher_parallel_lesson(
         current_teacher.id, lesson_data.start_time, lesson_data.finish_time, db
     )
     if parallel_teacher_lesson:
@@ -304,7 +298,7 @@ async def create_individual_lesson(
             detail='Преподаватель уже связан с пересекающимся по времени занятием'
         )
 
-    parallel_student_lesson = get_student_parallel_lesson(
+    parallel_student_lesson = await get_student_parallel_lesson(
         student.id, lesson_data.start_time, lesson_data.finish_time, db
     )
     if parallel_student_lesson:
@@ -324,25 +318,26 @@ async def create_individual_lesson(
         is_confirmed=True
     )
     db.add(lesson)
-    db.commit()
+    await db.flush()
 
     lesson_subscription = LessonSubscription(
         lesson_id=lesson.id,
         subscription_id=subscription.id
     )
     db.add(lesson_subscription)
+    await use_subscription_lesson(subscription.id, db)
 
     teacher_lesson = TeacherLesson(
         teacher_id=current_teacher.id,
         lesson_id=lesson.id
     )
     db.add(teacher_lesson)
+    await db.flush()
 
-    db.commit()
-
-    await send_new_individual_lesson_email(lesson)
+    lesson = await load_with_options(db, Lesson, lesson.id, lesson_full_info_options())
+    await send_new_individual_lesson_email(lesson, db)
 
-    db.refresh(lesson)
+    await db.commit()
 
     return lesson
 
@@ -350,11 +345,11 @@ async def create_individual_lesson(
 @router.post('/group', response_model=LessonFullInfo, status_code=status.HTTP_201_CREATED)
 async def create_group_lesson(
         lesson_data: LessonCreateGroup,
-        current_teacher: Teacher = Depends(get_current_teacher),
-        db: Session = Depends(get_db)
+        current_teacher: PrincipalRole = Depends(get_current_teacher),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    group = get_and_check_group(lesson_data.group_id, db)
-    if current_teacher not in group.teachers:
+    group = await get_and_check_group(lesson_data.group_id, db)
+    if current_teacher.id not in [teacher.id for teacher in group.teachers]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Преподаватель не связан с данной группой'
@@ -362,7 +357,7 @@ async def create_group_lesson(
 
     await check_lesson_data(lesson_data, True, db)
 
-    group_parallel_lesson = get_group_parallel_lesson(
+    group_parallel_lesson = await get_group_parallel_lesson(
         lesson_data.group_id, lesson_data.start_time, lesson_data.finish_time, db
     )
     if group_parallel_lesson:
@@ -371,7 +366,7 @@ async def create_group_lesson(
             detail='У группы уже есть пересекающееся по времени занятие'
         )
 
-    teacher_parallel_lesson = get_teacher_parallel_lesson(
+    teacher_parallel_lesson = await get_teacher_parallel_lesson(
         current_teacher.id,
         lesson_data.start_time,
         lesson_data.finish_time,
@@ -395,30 +390,243 @@ async def create_group_lesson(
         is_confirmed=True
     )
     db.add(lesson)
-    db.commit()
+    await db.flush()
 
     teacher_lesson = TeacherLesson(
         teacher_id=current_teacher.id,
         lesson_id=lesson.id
     )
     db.add(teacher_lesson)
+    await db.flush()
 
-    db.commit()
-
+    lesson = await load_with_options(db, Lesson, lesson.id, lesson_full_info_options())
     await send_new_group_lesson_email(lesson, db)
 
-    db.refresh(lesson)
+    await db.commit()
 
     return lesson
 
 
+MAX_SERIES_LESSON_COUNT = 100
+
+
+def get_series_occurrences(series_data):
+    if series_data.weekday < 0 or series_data.weekday > 6:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='День недели должен быть числом от 0 (понедельник) до 6 (воскресенье)'
+        )
+    if (series_data.count is None) == (series_data.date_to is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Необходимо указать либо количество занятий, либо дату окончания серии'
+        )
+    if series_data.count is not None and not 0 < series_data.count <= MAX_SERIES_LESSON_COUNT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Количество занятий в серии должно быть от 1 до {MAX_SERIES_LESSON_COUNT}'
+        )
+    if series_data.date_to is not None and series_data.date_to < series_data.date_from:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Дата окончания серии не может быть раньше даты её начала'
+        )
+
+    day = series_data.date_from + timedelta(days=(series_data.weekday - series_data.date_from.weekday()) % 7)
+    occurrences = []
+    while (len(occurrences) < series_data.count) if series_data.count is not None else (day <= series_data.date_to):
+        if len(occurrences) == MAX_SERIES_LESSON_COUNT:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'Серия не может содержать больше {MAX_SERIES_LESSON_COUNT} занятий'
+            )
+        start_time = datetime.combine(day, series_data.start_time)
+        finish_time = datetime.combine(day, series_data.finish_time)
+        if start_time.tzinfo is None:
+            start_time = TIMEZONE.localize(start_time)
+        if finish_time.tzinfo is None:
+            finish_time = TIMEZONE.localize(finish_time)
+        occurrences.append((start_time.astimezone(TIMEZONE), finish_time.astimezone(TIMEZONE)))
+        day += timedelta(days=7)
+
+    if not occurrences:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='В указанный период не попадает ни одного занятия'
+        )
+    if occurrences[0][0] >= occurrences[0][1]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Начало занятия должно быть раньше его конца'
+        )
+    if occurrences[0][0] < datetime.now(TIMEZONE):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Запрещено создавать занятия в прошлом'
+        )
+    return occurrences
+
+
+async def get_series_conflicts(series_data, occurrences, teacher_id, db: AsyncSession):
+    series = values(
+        column('index', Integer),
+        column('start_time', DateTime(timezone=True)),
+        column('finish_time', DateTime(timezone=True)),
+        name='series'
+    ).data([(index, start_time, finish_time) for index, (start_time, finish_time) in enumerate(occurrences)])
+
+    classroom_conflict = and_(*classroom_occupied_criteria(
+        series_data.classroom_id,
+        series.c.start_time,
+        series.c.finish_time,
+        series_data.are_neighbours_allowed
+    )) if series_data.classroom_id else false()
+    group_conflict = Lesson.group_id == series_data.group_id
+    teacher_conflict = select(TeacherLesson).where(
+        TeacherLesson.lesson_id == Lesson.id,
+        TeacherLesson.teacher_id == teacher_id
+    ).exists() if teacher_id else false()
+
+    rows = (await db.execute(select(
+        series.c.index,
+        Lesson.id,
+        classroom_conflict.label('classroom_conflict'),
+        group_conflict.label('group_conflict'),
+        teacher_conflict.label('teacher_conflict')
+    ).select_from(series).join(
+        Lesson,
+        and_(
+            Lesson.terminated == False,
+            Lesson.overlaps(series.c.start_time, series.c.finish_time),
+            or_(classroom_conflict, group_conflict, teacher_conflict)
+        )
+    ))).all()
+
+    conflicts = {}
+    for index, lesson_id, is_classroom_conflict, is_group_conflict, is_teacher_conflict in rows:
+        conflict = conflicts.setdefault(index, LessonSeriesConflict(
+            start_time=occurrences[index][0],
+            finish_time=occurrences[index][1],
+            reasons=[],
+            lesson_ids=[]
+        ))
+        conflict.lesson_ids.append(lesson_id)
+        for is_conflict, reason in (
+                (is_classroom_conflict, 'Зал занят'),
+                (is_group_conflict, 'У группы уже есть пересекающееся по времени занятие'),
+                (is_teacher_conflict, 'Преподаватель уже связан с пересекающимся по времени занятием')
+        ):
+            if is_conflict and reason not in conflict.reasons:
+                conflict.reasons.append(reason)
+    return conflicts
+
+
+@router.post('/series', response_model=LessonSeriesResult, status_code=status.HTTP_201_CREATED)
+async def create_lesson_series(
+        series_data: LessonSeriesCreate,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    if not current_user.admin and not current_user.teacher:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Недостаточно прав'
+        )
+
+    group = await get_and_check_group(series_data.group_id, db)
+    teacher = current_user.teacher if not current_user.admin else None
+    if teacher and teacher.id not in [group_teacher.id for group_teacher in group.teachers]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Преподаватель не связан с данной группой'
+        )
+
+    lesson_type = await db.scalar(select(LessonType).where(LessonType.id == series_data.lesson_type_id))
+    if not lesson_type:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Тип занятия не найден'
+        )
+    if lesson_type.terminated:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Тип занятия не активен'
+        )
+    if not lesson_type.is_group:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Выбранный тип занятия является индивидуальным'
+        )
+
+    if series_data.classroom_id:
+        classroom = await db.scalar(select(Classroom).where(Classroom.id == series_data.classroom_id))
+        if not classroom:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail='Зал не найден'
+            )
+        if classroom.terminated:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Зал не активен'
+            )
+    elif teacher:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Для занятий преподавателя необходимо указать зал'
+        )
+
+    occurrences = get_series_occurrences(series_data)
+    conflicts = await get_series_conflicts(series_data, occurrences, teacher.id if teacher else None, db)
+    if conflicts and not series_data.skip_conflicts:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                'message': 'Некоторые занятия серии пересекаются с существующими',
+                'conflicts': jsonable_encoder(list(conflicts.values()))
+            }
+        )
+
+    lessons = [
+        Lesson(
+            name=series_data.name,
+            description=series_data.description,
+            lesson_type_id=lesson_type.id,
+            start_time=start_time,
+            finish_time=finish_time,
+            classroom_id=series_data.classroom_id,
+            group_id=group.id,
+            are_neighbours_allowed=series_data.are_neighbours_allowed,
+            is_confirmed=True
+        )
+        for index, (start_time, finish_time) in enumerate(occurrences) if index not in conflicts
+    ]
+    db.add_all(lessons)
+    await db.flush()
+
+    if teacher:
+        db.add_all([TeacherLesson(teacher_id=teacher.id, lesson_id=lesson.id) for lesson in lessons])
+        await db.flush()
+
+    if lessons:
+        await send_new_group_lesson_series_email(group, lessons, db)
+
+    await db.commit()
+    for lesson in lessons:
+        await db.refresh(lesson)
+
+    return LessonSeriesResult(lessons=lessons, conflicts=list(conflicts.values()))
+
+
 @router.post('/request', response_model=LessonFullInfo, status_code=status.HTTP_201_CREATED)
 async def create_lesson_request(
         lesson_data: LessonCreateRequest,
-        current_student: Student = Depends(get_current_student),
-        db: Session = Depends(get_db)
+        current_student: PrincipalRole = Depends(get_current_student),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == lesson_data.teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == lesson_data.teacher_id).options(
+        joinedload(Teacher.user)
+    ))
     if not teacher:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -432,12 +640,12 @@ async def create_lesson_request(
 
     await check_lesson_data(lesson_data, False, db)
 
-    slots = await search_available_slots(SlotAvailableFilters(
+    slots = (await search_available_slots(SlotAvailableFilters(
         date_from=lesson_data.start_time,
         date_to=lesson_data.finish_time,
         teacher_ids=[teacher.id],
         lesson_type_ids=[lesson_data.lesson_type_id]
-    ), current_student.user, db)
+    ), db=db)).slots
     if (len(slots) != 1 or
             lesson_data.start_time < slots[0].start_time or lesson_data.finish_time > slots[0].finish_time):
         raise HTTPException(
@@ -445,9 +653,9 @@ async def create_lesson_request(
             detail='У учителя нет подходящего слота, или учитель не преподаёт данный вид занятий'
         )
 
-    subscription = create_subscription(current_student.id, lesson_data.lesson_type_id, db)
+    subscription = await create_subscription(current_student.id, lesson_data.lesson_type_id, db)
 
-    parallel_student_lesson = get_student_parallel_lesson(
+    parallel_student_lesson = await get_student_parallel_lesson(
         current_student.id, lesson_data.start_time, lesson_data.finish_time, db
     )
     if parallel_student_lesson:
@@ -466,25 +674,26 @@ async def create_lesson_request(
         is_confirmed=False
     )
     db.add(lesson)
-    db.commit()
+    await db.flush()
 
     lesson_subscription = LessonSubscription(
         lesson_id=lesson.id,
         subscription_id=subscription.id
     )
     db.add(lesson_subscription)
+    await use_subscription_lesson(subscription.id, db)
 
     teacher_lesson = TeacherLesson(
         teacher_id=lesson_data.teacher_id,
         lesson_id=lesson.id
     )
     db.add(teacher_lesson)
+    await db.flush()
 
-    db.commit()
-
-    await send_new_lesson_request_email(lesson)
+    lesson = await load_with_options(db, Lesson, lesson.id, lesson_full_info_options())
+    await send_new_lesson_request_email(lesson, db)
 
-    db.refresh(lesson)
+    await db.commit()
 
     return lesson
 
@@ -493,24 +702,24 @@ async def create_lesson_request(
 async def respond_to_lesson_request(
         lesson_id: uuid.UUID,
         response: LessonResponse,
-        current_teacher: Teacher = Depends(get_current_teacher),
-        db: Session = Depends(get_db)
+        current_teacher: PrincipalRole = Depends(get_current_teacher),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    request = db.query(Lesson).where(
+    request = await db.scalar(select(Lesson).where(
         Lesson.id == lesson_id,
         Lesson.is_confirmed == False,
         Lesson.terminated == False
-    ).first()
+    ).options(*lesson_full_info_options()))
     if not request:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Заявка не найдена'
         )
 
-    teacher_lesson = db.query(TeacherLesson).where(
+    teacher_lesson = await db.scalar(select(TeacherLesson).where(
         TeacherLesson.lesson_id == lesson_id,
         TeacherLesson.teacher_id == current_teacher.id
-    ).first()
+    ))
     if not teacher_lesson:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -524,21 +733,21 @@ async def respond_to_lesson_request(
                 detail='Зал не указан'
             )
         await check_classroom(
-            response.classroom_id, request.start_time, request.finish_time, request.are_neighbours_allowed, db
+            response.classroom_id, request.start_time, request.finish_time, request.are_neighbours_allowed, db,
+            request.id
         )
         request.classroom_id = response.classroom_id
         request.is_confirmed = True
 
-        await send_lesson_request_accepted_email(request)
+        await send_lesson_request_accepted_email(request, db)
     else:
         request.terminated = True
 
-        await send_lesson_request_declined_email(request)
+        await send_lesson_request_declined_email(request, db)
 
-    db.commit()
-    db.refresh(request)
+    await db.commit()
 
-    return request
+    return await load_with_options(db, Lesson, request.id, lesson_full_info_options())
 
 
 def apply_filters_to_lessons(lessons, filters, db):
@@ -575,7 +784,7 @@ def apply_filters_to_lessons(lessons, filters, db):
 
     if filters.subscription_template_ids:
         lessons = lessons.where(
-            db.query(SubscriptionLessonType).where(
+            select(SubscriptionLessonType).where(
                 SubscriptionLessonType.lesson_type_id == Lesson.lesson_type_id,
                 SubscriptionLessonType.subscription_template_id.in_(filters.subscription_template_ids)
             ).exists()
@@ -584,11 +793,11 @@ def apply_filters_to_lessons(lessons, filters, db):
     if filters.teacher_ids:
         lessons = lessons.where(
             or_(
-                db.query(TeacherLesson).where(
+                select(TeacherLesson).where(
                     TeacherLesson.lesson_id == Lesson.id,
                     TeacherLesson.teacher_id.in_(filters.teacher_ids)
                 ).exists(),
-                db.query(TeacherGroup).where(
+                select(TeacherGroup).where(
                     TeacherGroup.group_id == Lesson.group_id,
                     TeacherGroup.teacher_id.in_(filters.teacher_ids)
                 ).exists()
@@ -598,13 +807,13 @@ def apply_filters_to_lessons(lessons, filters, db):
     if filters.student_ids:
         lessons = lessons.where(
             or_(
-                db.query(LessonSubscription).where(
+                select(LessonSubscription).where(
                     LessonSubscription.lesson_id == Lesson.id,
                     LessonSubscription.cancelled == False
                 ).join(Subscription).where(
                     Subscription.student_id.in_(filters.student_ids)
                 ).exists(),
-                db.query(StudentGroup).where(
+                select(StudentGroup).where(
                     StudentGroup.group_id == Lesson.group_id,
                     StudentGroup.student_id.in_(filters.student_ids)
                 ).exists()
@@ -614,6 +823,35 @@ def apply_filters_to_lessons(lessons, filters, db):
     return lessons
 
 
+def get_teacher_participation(teacher_id, db: AsyncSession):
+    return select(TeacherLesson).where(
+        TeacherLesson.lesson_id == Lesson.id,
+        TeacherLesson.teacher_id == teacher_id
+    ).exists()
+
+
+def get_student_participation(student_id, db: AsyncSession):
+    return select(LessonSubscription).where(
+        LessonSubscription.lesson_id == Lesson.id,
+        LessonSubscription.cancelled == False
+    ).join(Subscription).where(
+        Subscription.student_id == student_id
+    ).exists()
+
+
+async def get_lesson_full_info_page(lessons, is_going_to_participate, order_by, desc, offset, limit, cursor, db):
+    rows, page_info = await paginate(
+        db, lessons, Lesson, order_by, desc, offset, limit, cursor,
+        options=lesson_full_info_options(),
+        columns=[is_going_to_participate.label('is_going_to_participate')]
+    )
+
+    for lesson, lesson_is_going_to_participate in rows:
+        lesson.is_going_to_participate = lesson_is_going_to_participate
+
+    return LessonFullInfoPage(lessons=[lesson for lesson, _ in rows], **page_info)
+
+
 def check_order_by(order_by: str) -> str:
     assert order_by in ['name', 'description', 'start_time', 'finish_time', 'is_confirmed', 'are_neighbours_allowed',
                         'created_at', 'terminated'], 'Данная сортировка невозможна'
@@ -627,17 +865,14 @@ async def search_lessons_admin(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lessons = db.query(Lesson)
+    lessons = select(Lesson)
     lessons = apply_filters_to_lessons(lessons, filters, db)
-    return LessonPage(
-        lessons=lessons.order_by(
-            text('lessons.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=lessons.count()
-    )
+    lessons, page_info = await paginate(db, lessons, Lesson, order_by, desc, offset, limit, cursor)
+    return LessonPage(lessons=lessons, **page_info)
 
 
 @router.post('/search/admin/full-info', response_model=LessonFullInfoPage)
@@ -647,21 +882,14 @@ async def search_lessons_admin_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lessons = db.query(Lesson)
+    lessons = select(Lesson)
     lessons = apply_filters_to_lessons(lessons, filters, db)
 
-    for lesson in lessons:
-        lesson.is_going_to_participate = False
-
-    return LessonFullInfoPage(
-        lessons=lessons.order_by(
-            text('lessons.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=lessons.count()
-    )
+    return await get_lesson_full_info_page(lessons, false(), order_by, desc, offset, limit, cursor, db)
 
 
 @router.post('/search/teacher', response_model=LessonFullInfoPage)
@@ -671,23 +899,18 @@ async def search_teacher_lessons(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_teacher: Teacher = Depends(get_current_teacher),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_teacher: PrincipalRole = Depends(get_current_teacher),
+        db: AsyncSession = Depends(get_async_db)
 ):
     filters.teacher_ids = [current_teacher.id]
 
-    lessons = db.query(Lesson)
+    lessons = select(Lesson)
     lessons = apply_filters_to_lessons(lessons, filters, db)
 
-    for lesson in lessons:
-        lesson.is_going_to_participate = current_teacher in lesson.actual_teachers
+    is_going_to_participate = get_teacher_participation(current_teacher.id, db)
 
-    return LessonFullInfoPage(
-        lessons=lessons.order_by(
-            text('lessons.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=lessons.count()
-    )
+    return await get_lesson_full_info_page(lessons, is_going_to_participate, order_by, desc, offset, limit, cursor, db)
 
 
 @router.post('/search/student', response_model=LessonFullInfoPage)
@@ -697,23 +920,18 @@ async def search_student_lessons(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_student: Student = Depends(get_current_student),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_student: PrincipalRole = Depends(get_current_student),
+        db: AsyncSession = Depends(get_async_db)
 ):
     filters.student_ids = [current_student.id]
 
-    lessons = db.query(Lesson)
+    lessons = select(Lesson)
     lessons = apply_filters_to_lessons(lessons, filters, db)
 
-    for lesson in lessons:
-        lesson.is_going_to_participate = current_student in lesson.actual_students
+    is_going_to_participate = get_student_participation(current_student.id, db)
 
-    return LessonFullInfoPage(
-        lessons=lessons.order_by(
-            text('lessons.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=lessons.count()
-    )
+    return await get_lesson_full_info_page(lessons, is_going_to_participate, order_by, desc, offset, limit, cursor, db)
 
 
 @router.post('/search/group', response_model=LessonFullInfoPage)
@@ -723,71 +941,51 @@ async def search_group_lessons(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
     filters.is_group = True
     filters.student_ids = []
 
-    lessons = db.query(Lesson)
+    lessons = select(Lesson)
     lessons = apply_filters_to_lessons(lessons, filters, db)
 
     if filters.in_group is not None:
         if current_user.teacher:
             lessons = lessons.where(
-                db.query(TeacherGroup).where(
+                select(TeacherGroup).where(
                     TeacherGroup.group_id == Lesson.group_id,
                     TeacherGroup.teacher_id == current_user.teacher.id
                 ).exists() == filters.in_group
             )
         elif current_user.student:
             lessons = lessons.where(
-                db.query(StudentGroup).where(
+                select(StudentGroup).where(
                     StudentGroup.group_id == Lesson.group_id,
                     StudentGroup.student_id == current_user.student.id
                 ).exists() == filters.in_group
             )
-    if filters.in_lesson is not None:
-        if current_user.teacher:
-            lessons = lessons.where(
-                db.query(TeacherLesson).where(
-                    TeacherLesson.lesson_id == Lesson.id,
-                    TeacherLesson.teacher_id == current_user.teacher.id
-                ).exists() == filters.in_lesson
-            )
-        elif current_user.student:
-            lessons = lessons.where(
-                db.query(LessonSubscription).where(
-                    LessonSubscription.lesson_id == Lesson.id,
-                    LessonSubscription.cancelled == False
-                ).join(Subscription).where(
-                    Subscription.student_id == current_user.student.id
-                ).exists() == filters.in_lesson
-            )
+    if current_user.teacher:
+        is_going_to_participate = get_teacher_participation(current_user.teacher.id, db)
+    elif current_user.student:
+        is_going_to_participate = get_student_participation(current_user.student.id, db)
+    else:
+        is_going_to_participate = false()
 
-    for lesson in lessons:
-        if current_user.teacher:
-            lesson.is_going_to_participate = current_user.teacher in lesson.actual_teachers
-        elif current_user.student:
-            lesson.is_going_to_participate = current_user.student in lesson.actual_students
-        else:
-            lesson.is_going_to_participate = False
+    if filters.in_lesson is not None and (current_user.teacher or current_user.student):
+        lessons = lessons.where(is_going_to_participate == filters.in_lesson)
 
-    return LessonFullInfoPage(
-        lessons=lessons.order_by(
-            text('lessons.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=lessons.count()
-    )
+    return await get_lesson_full_info_page(lessons, is_going_to_participate, order_by, desc, offset, limit, cursor, db)
 
 
 @router.get('/{lesson_id}', response_model=LessonInfo)
 async def get_lesson_by_id(
         lesson_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lesson = db.query(Lesson).where(Lesson.id == lesson_id).first()
+    lesson = await db.scalar(select(Lesson).where(Lesson.id == lesson_id))
     if not lesson:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -799,10 +997,10 @@ async def get_lesson_by_id(
 @router.get('/full-info/{lesson_id}', response_model=LessonWithSubscriptions)
 async def get_lesson_full_info_by_id(
         lesson_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lesson = db.query(Lesson).where(Lesson.id == lesson_id).first()
+    lesson = await db.scalar(select(Lesson).where(Lesson.id == lesson_id).options(*lesson_full_info_options()))
     if not lesson:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -810,19 +1008,23 @@ async def get_lesson_full_info_by_id(
         )
 
     if current_user.teacher:
-        lesson.is_going_to_participate = current_user.teacher in lesson.actual_teachers
+        lesson.is_going_to_participate = current_user.teacher.id in [teacher.id for teacher in lesson.actual_teachers]
     elif current_user.student:
-        lesson.is_going_to_participate = current_user.student in lesson.actual_students
+        lesson.is_going_to_participate = current_user.student.id in [student.id for student in lesson.actual_students]
 
-        if current_user.student not in lesson.actual_students:
-            lesson.fitting_subscriptions = [subscription for subscription in current_user.student.subscriptions
+        subscriptions = (await db.scalars(select(Subscription).where(
+            Subscription.student_id == current_user.student.id
+        ).options(*subscription_full_info_options(), selectinload(Subscription.lessons)))).all()
+
+        if not lesson.is_going_to_participate:
+            lesson.fitting_subscriptions = [subscription for subscription in subscriptions
                                             if subscription.payment and not subscription.payment.terminated
                                             and subscription.lessons_left > 0
                                             and lesson.lesson_type in subscription.subscription_template.lesson_types
                                             and (not subscription.expiration_date
                                                  or subscription.expiration_date > datetime.now(TIMEZONE))]
         else:
-            lesson.used_subscription = [subscription for subscription in current_user.student.subscriptions
+            lesson.used_subscription = [subscription for subscription in subscriptions
                                         if lesson in subscription.lessons][0]
     else:
         lesson.is_going_to_participate = False
@@ -834,10 +1036,10 @@ async def get_lesson_full_info_by_id(
 async def patch_lesson(
         lesson_id: uuid.UUID,
         lesson_data: LessonUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    lesson = db.query(Lesson).where(Lesson.id == lesson_id).first()
+    lesson = await db.scalar(select(Lesson).where(Lesson.id == lesson_id).options(*lesson_full_info_options()))
     if not lesson:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -845,7 +1047,7 @@ async def patch_lesson(
         )
 
     if lesson_data.group_id:
-        get_and_check_group(lesson_data.group_id, db)
+        await get_and_check_group(lesson_data.group_id, db)
 
     group_id = lesson_data.group_id if 'group_id' in lesson_data.model_dump(exclude_unset=True) \
         else lesson.group_id
@@ -861,21 +1063,16 @@ async def patch_lesson(
     if not old_terminated:
         if lesson.terminated:
             await send_lesson_cancelled_email(lesson, db)
-            db.query(TeacherLesson).where(
+            await db.execute(delete(TeacherLesson).where(
                 TeacherLesson.lesson_id == lesson_id
-            ).delete()
-            db.query(LessonSubscription).where(
-                LessonSubscription.lesson_id == lesson_id
-            ).update(
-                {LessonSubscription.cancelled: True}
-            )
+            ))
+            await cancel_lesson_subscriptions(db, LessonSubscription.lesson_id == lesson_id)
         elif lesson.start_time != old_start_time:
             await send_lesson_rescheduled_email(lesson, db)
 
-    db.commit()
-    db.refresh(lesson)
+    await db.commit()
 
-    return lesson
+    return await load_with_options(db, Lesson, lesson.id, lesson_full_info_options())
 
 
 from app.routers.slots import search_available_slots
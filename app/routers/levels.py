@@ -2,11 +2,13 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import AfterValidator
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db
+from app.pagination import paginate
 from app.models import User, Admin, Level
 from app.schemas.level import *
 
@@ -19,8 +21,8 @@ router = APIRouter(
 @router.post('/', response_model=LevelInfo, status_code=status.HTTP_201_CREATED)
 async def create_level(
         level_data: LevelCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     level = Level(
         name=level_data.name,
@@ -28,8 +30,8 @@ async def create_level(
     )
 
     db.add(level)
-    db.commit()
-    db.refresh(level)
+    await db.commit()
+    await db.refresh(level)
 
     return level
 
@@ -47,28 +49,25 @@ async def search_levels(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        db: AsyncSession = Depends(get_async_db)
 ):
-    levels = db.query(Level)
+    levels = select(Level)
 
     if filters.terminated is not None:
         levels = levels.where(Level.terminated == filters.terminated)
 
-    return LevelPage(
-        levels=levels.order_by(
-            text('levels.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=levels.count()
-    )
+    levels, page_info = await paginate(db, levels, Level, order_by, desc, offset, limit, cursor)
+    return LevelPage(levels=levels, **page_info)
 
 
 @router.get('/{level_id}', response_model=LevelInfo)
 async def get_level_by_id(
         level_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    level = db.query(Level).where(Level.id == level_id).first()
+    level = await db.scalar(select(Level).where(Level.id == level_id))
     if level is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -81,10 +80,10 @@ async def get_level_by_id(
 async def patch_level(
         level_id: uuid.UUID,
         level_data: LevelUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    level = db.query(Level).where(Level.id == level_id).first()
+    level = await db.scalar(select(Level).where(Level.id == level_id))
     if not level:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -94,7 +93,7 @@ async def patch_level(
     for field, value in level_data.model_dump(exclude_unset=True).items():
         setattr(level, field, value)
 
-    db.commit()
-    db.refresh(level)
+    await db.commit()
+    await db.refresh(level)
 
     return level
@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.metrics import render_metrics
+
+router = APIRouter(
+    prefix='/metrics',
+    tags=['metrics']
+)
+
+
+@router.get('/', response_class=PlainTextResponse)
+async def get_metrics():
+    return render_metrics()
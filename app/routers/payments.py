@@ -2,13 +2,18 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import AfterValidator
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db
+from app.pagination import paginate
+from app.loaders import load_with_options, payment_full_info_options
 from app.email import send_new_payment_email, send_payment_terminated_email
-from app.models import User, Admin, Payment, PaymentType, Subscription
+from app.rollups import update_daily_subscription_sales
+from app.models import User, Admin, Payment, PaymentType, Subscription, Student
 from app.schemas.payment import *
 
 import uuid
@@ -22,10 +27,10 @@ router = APIRouter(
 @router.post('/', response_model=PaymentInfo, status_code=status.HTTP_201_CREATED)
 async def create_payment(
         payment_data: PaymentCreate,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    payment_type = db.query(PaymentType).where(PaymentType.id == payment_data.payment_type_id).first()
+    payment_type = await db.scalar(select(PaymentType).where(PaymentType.id == payment_data.payment_type_id))
     if not payment_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -43,13 +48,13 @@ async def create_payment(
     )
 
     db.add(payment)
-    db.commit()
 
-    await send_new_payment_email(payment, current_user)
+    user = await db.scalar(select(User).where(User.id == current_user.id))
+    await send_new_payment_email(payment, user, db)
 
-    db.refresh(payment)
+    await db.commit()
 
-    return payment
+    return await load_with_options(db, Payment, payment.id, payment_full_info_options())
 
 
 def apply_filters_to_payments(payments, filters, db):
@@ -58,7 +63,7 @@ def apply_filters_to_payments(payments, filters, db):
 
     if filters.student_id:
         payments = payments.where(
-            db.query(Subscription).where(
+            select(Subscription).where(
                 Subscription.payment_id == Payment.id,
                 Subscription.student_id == filters.student_id
             ).exists()
@@ -83,17 +88,14 @@ async def search_payments(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    payments = db.query(Payment)
+    payments = select(Payment)
     payments = apply_filters_to_payments(payments, filters, db)
-    return PaymentPage(
-        payments=payments.order_by(
-            text('payments.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=payments.count()
-    )
+    payments, page_info = await paginate(db, payments, Payment, order_by, desc, offset, limit, cursor)
+    return PaymentPage(payments=payments, **page_info)
 
 
 @router.post('/search/full-info', response_model=PaymentFullInfoPage)
@@ -103,26 +105,25 @@ async def search_payments_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    payments = db.query(Payment)
+    payments = select(Payment)
     payments = apply_filters_to_payments(payments, filters, db)
-    return PaymentFullInfoPage(
-        payments=payments.order_by(
-            text('payments.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=payments.count()
+    payments, page_info = await paginate(
+        db, payments, Payment, order_by, desc, offset, limit, cursor, options=payment_full_info_options()
     )
+    return PaymentFullInfoPage(payments=payments, **page_info)
 
 
 @router.get('/{payment_id}', response_model=PaymentInfo)
 async def get_payment_by_id(
         payment_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    payment = db.query(Payment).where(Payment.id == payment_id).first()
+    payment = await db.scalar(select(Payment).where(Payment.id == payment_id))
     if payment is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -134,10 +135,10 @@ async def get_payment_by_id(
 @router.get('/full-info/{payment_id}', response_model=PaymentFullInfo)
 async def get_payment_full_info_by_id(
         payment_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    payment = db.query(Payment).where(Payment.id == payment_id).first()
+    payment = await db.scalar(select(Payment).where(Payment.id == payment_id).options(*payment_full_info_options()))
     if payment is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -150,10 +151,13 @@ async def get_payment_full_info_by_id(
 async def patch_payment(
         payment_id: uuid.UUID,
         payment_data: PaymentUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    payment = db.query(Payment).where(Payment.id == payment_id).first()
+    # Блокировка не даёт параллельным изменениям статуса дважды учесть платёж в сводке продаж
+    payment = await db.scalar(select(Payment).where(Payment.id == payment_id).options(
+        joinedload(Payment.subscription).joinedload(Subscription.student).joinedload(Student.user)
+    ).with_for_update(of=Payment))
     if not payment:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -161,9 +165,9 @@ async def patch_payment(
         )
 
     if payment_data.payment_type_id:
-        payment_type = db.query(PaymentType).where(
+        payment_type = await db.scalar(select(PaymentType).where(
             PaymentType.id == payment_data.payment_type_id
-        ).first()
+        ))
         if not payment_type:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -180,14 +184,17 @@ async def patch_payment(
     for field, value in payment_data.model_dump(exclude_unset=True).items():
         setattr(payment, field, value)
 
-    db.commit()
+    if payment.terminated != old_terminated:
+        await update_daily_subscription_sales(
+            db, -1 if payment.terminated else 1, Subscription.payment_id == payment.id
+        )
 
     if payment.subscription:
         if payment.terminated and not old_terminated:
-            await send_payment_terminated_email(payment, payment.subscription.student.user)
+            await send_payment_terminated_email(payment, payment.subscription.student.user, db)
         elif not payment.terminated and old_terminated:
-            await send_new_payment_email(payment, payment.subscription.student.user)
+            await send_new_payment_email(payment, payment.subscription.student.user, db)
 
-    db.refresh(payment)
+    await db.commit()
 
-    return payment
+    return await load_with_options(db, Payment, payment.id, payment_full_info_options())
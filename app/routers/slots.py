@@ -1,15 +1,19 @@
-from datetime import timedelta, tzinfo
+from datetime import timedelta, tzinfo, timezone
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Query
 from pydantic import AfterValidator
-from sqlalchemy import or_, and_, text
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, and_, select, func, extract
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from app.auth.jwt import get_current_user
-from app.database import get_db, TIMEZONE
-from app.routers.lessons import get_teacher_parallel_lesson
-from app.models import User, Teacher, Slot, TeacherLessonType
+from app.schemas.token import Principal
+from app.database import get_async_db, TIMEZONE, TIMEZONE_NAME
+from app.pagination import paginate
+from app.loaders import load_with_options, slot_full_info_options, slot_occurrence_full_info_options
+from app.slot_occurrences import refresh_slot_occurrences
+from app.models import User, Teacher, Slot, SlotOccurrence, Lesson, TeacherLesson, TeacherLessonType
 from app.schemas.slot import *
 
 router = APIRouter(
@@ -19,14 +23,16 @@ router = APIRouter(
 
 
 def astimezone(t: time, tz: tzinfo) -> time:
-    return datetime.combine(
+    value = datetime.combine(
         datetime.today(),
         t,
         t.tzinfo
-    ).astimezone(tz).timetz()
+    ).astimezone(tz)
+    # у времени без даты смещение pytz не определено, поэтому фиксируем его явно
+    return value.timetz().replace(tzinfo=timezone(value.utcoffset()))
 
 
-def check_slot_data(slot_data, teacher_id, db: Session, existing_slot=None):
+async def check_slot_data(slot_data, teacher_id, db: AsyncSession, existing_slot=None):
     if slot_data.start_time:
         slot_data.start_time = astimezone(slot_data.start_time, TIMEZONE)
     start_time = slot_data.start_time if slot_data.start_time else existing_slot.start_time
@@ -47,7 +53,7 @@ def check_slot_data(slot_data, teacher_id, db: Session, existing_slot=None):
             detail='День недели должен принимать значения от 0 до 6'
         )
 
-    existing_slot = db.query(Slot).where(
+    existing_slot = await db.scalar(select(Slot).where(
         Slot.id != existing_slot.id if existing_slot else True,
         Slot.teacher_id == teacher_id,
         Slot.day_of_week ==
@@ -57,7 +63,7 @@ def check_slot_data(slot_data, teacher_id, db: Session, existing_slot=None):
             and_(end_time > Slot.start_time, end_time <= Slot.end_time),
             and_(start_time <= Slot.start_time, end_time >= Slot.end_time)
         )
-    ).first()
+    ))
     if existing_slot:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -68,10 +74,10 @@ def check_slot_data(slot_data, teacher_id, db: Session, existing_slot=None):
 @router.post('/', response_model=SlotInfo, status_code=status.HTTP_201_CREATED)
 async def create_slot(
         slot_data: SlotCreate,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == slot_data.teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == slot_data.teacher_id))
     if not teacher:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -83,7 +89,7 @@ async def create_slot(
             detail='Недостаточно прав'
         )
 
-    check_slot_data(slot_data, teacher.id, db)
+    await check_slot_data(slot_data, teacher.id, db)
 
     slot = Slot(
         teacher_id=teacher.id,
@@ -93,8 +99,9 @@ async def create_slot(
     )
 
     db.add(slot)
-    db.commit()
-    db.refresh(slot)
+    await refresh_slot_occurrences(db, slot)
+    await db.commit()
+    await db.refresh(slot)
 
     return slot
 
@@ -115,7 +122,7 @@ def apply_filters_to_slots(slots, filters, db):
 
     if filters.lesson_type_ids:
         slots = slots.where(
-            db.query(TeacherLessonType).where(
+            select(TeacherLessonType).where(
                 TeacherLessonType.teacher_id == Slot.teacher_id,
                 TeacherLessonType.lesson_type_id.in_(filters.lesson_type_ids)
             ).exists()
@@ -137,17 +144,14 @@ async def search_slots(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    slots = db.query(Slot)
+    slots = select(Slot)
     slots = apply_filters_to_slots(slots, filters, db)
-    return SlotPage(
-        slots=slots.order_by(
-            text('slots.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=slots.count()
-    )
+    slots, page_info = await paginate(db, slots, Slot, order_by, desc, offset, limit, cursor)
+    return SlotPage(slots=slots, **page_info)
 
 
 @router.post('/search/full-info', response_model=SlotFullInfoPage)
@@ -157,60 +161,51 @@ async def search_slots_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    slots = db.query(Slot)
+    slots = select(Slot)
     slots = apply_filters_to_slots(slots, filters, db)
-    return SlotFullInfoPage(
-        slots=slots.order_by(
-            text('slots.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=slots.count()
+    slots, page_info = await paginate(
+        db, slots, Slot, order_by, desc, offset, limit, cursor, options=slot_full_info_options()
     )
+    return SlotFullInfoPage(slots=slots, **page_info)
+
+
+def free_slot_occurrence_criteria(date_from, date_to):
+    # Повторения слотов хранятся на SLOT_OCCURRENCES_WEEKS_AHEAD недель вперёд, свободные из них -
+    # те, с которыми не пересекается ни одно активное занятие преподавателя
+    return [
+        SlotOccurrence.start_time >= datetime.now(TIMEZONE),
+        SlotOccurrence.start_time <= date_to,
+        SlotOccurrence.finish_time > date_from,
+        ~select(TeacherLesson).join(
+            Lesson, Lesson.id == TeacherLesson.lesson_id
+        ).where(
+            TeacherLesson.teacher_id == SlotOccurrence.teacher_id,
+            Lesson.terminated == False,
+            Lesson.overlaps(SlotOccurrence.start_time, SlotOccurrence.finish_time)
+        ).exists()
+    ]
+
+
+def check_available_order_by(order_by: str) -> str:
+    assert order_by in ['start_time', 'finish_time'], \
+        'Данная сортировка невозможна'
+    return order_by
 
 
-def get_available_slots(slots, date_from, date_to, db):
-    now = datetime.now(TIMEZONE)
-    date_from = date_from.astimezone(TIMEZONE)
-    if date_from < now:
-        date_from = now
-    date_to = date_to.astimezone(TIMEZONE)
-
-    available_slots = []
-    for slot in slots:
-        current_datetime = date_from
-        current_datetime = current_datetime.replace(hour=slot.start_time.hour, minute=slot.start_time.minute)
-
-        while current_datetime < now or current_datetime.weekday() != slot.day_of_week:
-            current_datetime = current_datetime + timedelta(days=1)
-
-        while current_datetime <= date_to:
-            finish_datetime = current_datetime.replace(hour=slot.end_time.hour, minute=slot.end_time.minute)
-            parallel_lesson = get_teacher_parallel_lesson(
-                slot.teacher_id,
-                current_datetime,
-                finish_datetime,
-                db
-            )
-            if not parallel_lesson:
-                available_slots.append(
-                    SlotAvailable(
-                        teacher=slot.teacher,
-                        start_time=current_datetime,
-                        finish_time=finish_datetime
-                    )
-                )
-            current_datetime = current_datetime + timedelta(days=7)
-
-    return available_slots
-
-
-@router.post('/search/available', response_model=List[SlotAvailable])
+@router.post('/search/available', response_model=SlotAvailablePage)
 async def search_available_slots(
         filters: SlotAvailableFilters,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        order_by: Annotated[str, AfterValidator(check_available_order_by)] = 'start_time',
+        desc: bool = False,
+        offset: Annotated[int, Query(ge=0)] = 0,
+        limit: Annotated[int, Query(gt=0, le=100)] = 20,
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
     filters.date_from = filters.date_from.astimezone(TIMEZONE)
     filters.date_to = filters.date_to.astimezone(TIMEZONE)
@@ -220,31 +215,121 @@ async def search_available_slots(
             detail='Время начала поиска не может быть больше времени конца поиска'
         )
     if filters.date_to < datetime.now(TIMEZONE):
-        return []
+        return SlotAvailablePage(slots=[], total=0)
 
-    slots = db.query(Slot)
+    occurrences = select(SlotOccurrence).where(*free_slot_occurrence_criteria(filters.date_from, filters.date_to))
 
     if filters.teacher_ids:
-        slots = slots.where(Slot.teacher_id.in_(filters.teacher_ids))
+        occurrences = occurrences.where(SlotOccurrence.teacher_id.in_(filters.teacher_ids))
 
     if filters.lesson_type_ids:
-        slots = slots.where(
-            db.query(TeacherLessonType).where(
-                TeacherLessonType.teacher_id == Slot.teacher_id,
+        occurrences = occurrences.where(
+            select(TeacherLessonType).where(
+                TeacherLessonType.teacher_id == SlotOccurrence.teacher_id,
                 TeacherLessonType.lesson_type_id.in_(filters.lesson_type_ids)
             ).exists()
         )
 
-    return get_available_slots(slots.all(), filters.date_from, filters.date_to, db)
+    occurrences, page_info = await paginate(
+        db, occurrences, SlotOccurrence, order_by, desc, offset, limit, cursor,
+        options=slot_occurrence_full_info_options()
+    )
+    return SlotAvailablePage(slots=occurrences, **page_info)
+
+
+def get_day_offset(t: time) -> timedelta:
+    return timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
+
+
+@router.post('/search/any-teacher', response_model=List[SlotAvailable])
+async def search_any_teacher_slots(
+        filters: SlotAnyTeacherFilters,
+        limit: Annotated[int, Query(gt=0, le=100)] = 10,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    filters.date_from = filters.date_from.astimezone(TIMEZONE)
+    filters.date_to = filters.date_to.astimezone(TIMEZONE)
+    if filters.date_from > filters.date_to:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Время начала поиска не может быть больше времени конца поиска'
+        )
+    if filters.duration_minutes <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Длительность занятия должна быть положительной'
+        )
+    # Желаемое время переводится в местное время школы и задаётся смещением от начала дня
+    preferred_start_time = get_day_offset(astimezone(filters.preferred_start_time, TIMEZONE)) \
+        if filters.preferred_start_time else timedelta()
+    preferred_finish_time = get_day_offset(astimezone(filters.preferred_finish_time, TIMEZONE)) \
+        if filters.preferred_finish_time else None
+    if preferred_finish_time and preferred_start_time >= preferred_finish_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Желаемое время начала должно быть раньше желаемого времени конца'
+        )
+    if filters.days_of_week and any(day_of_week < 0 or day_of_week > 6 for day_of_week in filters.days_of_week):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='День недели должен принимать значения от 0 до 6'
+        )
+
+    # Повторение обрезается до желаемого времени в тот же день по местному времени школы
+    local_day = func.date_trunc('day', func.timezone(TIMEZONE_NAME, SlotOccurrence.start_time))
+    candidate_start_time = func.greatest(
+        SlotOccurrence.start_time,
+        func.timezone(TIMEZONE_NAME, local_day + preferred_start_time)
+    )
+    candidate_finish_time = func.least(
+        SlotOccurrence.finish_time,
+        func.timezone(TIMEZONE_NAME, local_day + preferred_finish_time)
+    ) if preferred_finish_time else SlotOccurrence.finish_time
+
+    # Обрезанное начало не убывает вместе с началом повторения, поэтому сортировка по индексу на start_time
+    # сливает свободное время всех подходящих преподавателей, и запрос останавливается на первых limit строках
+    candidates = select(
+        SlotOccurrence,
+        candidate_start_time.label('candidate_start_time'),
+        candidate_finish_time.label('candidate_finish_time')
+    ).join(
+        Teacher, Teacher.id == SlotOccurrence.teacher_id
+    ).join(
+        User, User.id == Teacher.user_id
+    ).where(
+        *free_slot_occurrence_criteria(filters.date_from, filters.date_to),
+        User.terminated == False,
+        select(TeacherLessonType).where(
+            TeacherLessonType.teacher_id == SlotOccurrence.teacher_id,
+            TeacherLessonType.lesson_type_id == filters.lesson_type_id
+        ).exists(),
+        candidate_finish_time - candidate_start_time >= timedelta(minutes=filters.duration_minutes)
+    )
+
+    if filters.days_of_week:
+        candidates = candidates.where(
+            (extract('isodow', func.timezone(TIMEZONE_NAME, SlotOccurrence.start_time)) - 1).in_(filters.days_of_week)
+        )
+
+    rows = (await db.execute(candidates.order_by(
+        SlotOccurrence.start_time,
+        SlotOccurrence.id
+    ).options(*slot_occurrence_full_info_options()).limit(limit))).all()
+
+    return [
+        SlotAvailable(teacher=occurrence.teacher, start_time=start_time, finish_time=finish_time)
+        for occurrence, start_time, finish_time in rows
+    ]
 
 
 @router.get('/{slot_id}', response_model=SlotInfo)
 async def get_slot_by_id(
         slot_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    slot = db.query(Slot).where(Slot.id == slot_id).first()
+    slot = await db.scalar(select(Slot).where(Slot.id == slot_id))
     if not slot:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -256,10 +341,10 @@ async def get_slot_by_id(
 @router.get('/full-info/{slot_id}', response_model=SlotFullInfo)
 async def get_slot_full_info_by_id(
         slot_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    slot = db.query(Slot).where(Slot.id == slot_id).first()
+    slot = await db.scalar(select(Slot).where(Slot.id == slot_id).options(*slot_full_info_options()))
     if not slot:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -272,10 +357,10 @@ async def get_slot_full_info_by_id(
 async def delete_slot_by_id(
         slot_id: uuid.UUID,
         response: Response,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    slot = db.query(Slot).where(Slot.id == slot_id).first()
+    slot = await db.scalar(select(Slot).where(Slot.id == slot_id).options(joinedload(Slot.teacher)))
     if not slot:
         response.status_code = status.HTTP_204_NO_CONTENT
         return 'Слот уже удалён'
@@ -286,8 +371,8 @@ async def delete_slot_by_id(
             detail='Недостаточно прав'
         )
 
-    db.delete(slot)
-    db.commit()
+    await db.delete(slot)
+    await db.commit()
 
     return 'Слот успешно удалён'
 
@@ -296,10 +381,10 @@ async def delete_slot_by_id(
 async def patch_slot(
         slot_id: uuid.UUID,
         slot_data: SlotUpdate,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    slot = db.query(Slot).where(Slot.id == slot_id).first()
+    slot = await db.scalar(select(Slot).where(Slot.id == slot_id).options(joinedload(Slot.teacher)))
     if not slot:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -307,7 +392,7 @@ async def patch_slot(
         )
     teacher = slot.teacher
     if slot_data.teacher_id:
-        teacher = db.query(Teacher).where(Teacher.id == slot_data.teacher_id).first()
+        teacher = await db.scalar(select(Teacher).where(Teacher.id == slot_data.teacher_id))
         if not teacher:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -319,12 +404,12 @@ async def patch_slot(
             detail='Недостаточно прав'
         )
 
-    check_slot_data(slot_data, teacher.id, db, slot)
+    await check_slot_data(slot_data, teacher.id, db, slot)
 
     for field, value in slot_data.model_dump(exclude_unset=True).items():
         setattr(slot, field, value)
 
-    db.commit()
-    db.refresh(slot)
+    await refresh_slot_occurrences(db, slot)
+    await db.commit()
 
-    return slot
+    return await load_with_options(db, Slot, slot.id, slot_full_info_options())
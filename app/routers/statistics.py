@@ -1,18 +1,35 @@
+import csv
+import io
 from datetime import timedelta
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, cast, and_, true, Date
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.jwt import get_current_admin
-from app.database import get_db
+from app.schemas.token import PrincipalRole
+from app.config import settings
+from app.cache import TTLCache
+from app.database import get_async_db, AsyncSessionLocal, TIMEZONE_NAME
 from app.models import *
+from app.rollups import get_sale_day
 from app.schemas.statistics import *
 
+STATISTICS_USE_ROLLUPS = settings.STATISTICS_USE_ROLLUPS
+STATISTICS_CACHE_TTL_SECONDS = settings.STATISTICS_CACHE_TTL_SECONDS
+STATISTICS_CACHE_MAX_SIZE = settings.STATISTICS_CACHE_MAX_SIZE
+CSV_STREAM_BATCH_SIZE = 1000
+
 router = APIRouter(
     prefix='/statistics',
     tags=['statistics']
 )
 
+# Посещаемость и загрузка залов считаются по всем занятиям за период, поэтому повторные запросы
+# дашборда с теми же фильтрами в течение STATISTICS_CACHE_TTL_SECONDS отдаются из кеша
+statistics_cache = TTLCache(STATISTICS_CACHE_TTL_SECONDS, STATISTICS_CACHE_MAX_SIZE)
+
 
 def check_filters_intervals(filters):
     if filters.date_from > filters.date_to:
@@ -27,10 +44,33 @@ def check_filters_intervals(filters):
         )
 
 
+def get_interval_index(day, filters):
+    return (day - filters.date_from) // filters.interval_in_days
+
+
+def select_interval_indexes(filters):
+    # generate_series даёт строки и для интервалов без данных
+    intervals_count = (filters.date_to - filters.date_from).days // filters.interval_in_days + 1
+    return select(
+        func.generate_series(0, intervals_count - 1).label('interval_index')
+    ).subquery()
+
+
+def get_interval_dates(interval_index, filters):
+    interval_date_from = filters.date_from + timedelta(days=interval_index * filters.interval_in_days)
+    interval_date_to = interval_date_from + timedelta(days=filters.interval_in_days - 1)
+    return interval_date_from, min(interval_date_to, filters.date_to)
+
+
+def get_lesson_day():
+    # День занятия по местному времени школы, независимо от часового пояса сессии
+    return cast(func.timezone(TIMEZONE_NAME, Lesson.start_time), Date)
+
+
 def apply_filters_to_subscription_purchases(interval_statistics, filters, db):
     if filters.is_group is not None or filters.dance_style_ids:
         interval_statistics = interval_statistics.where(
-            db.query(SubscriptionLessonType).where(
+            select(SubscriptionLessonType).where(
                 SubscriptionLessonType.subscription_template_id == SubscriptionTemplate.id
             ).join(LessonType).where(
                 (LessonType.is_group == filters.is_group) if filters.is_group is not None else True,
@@ -46,49 +86,389 @@ def apply_filters_to_subscription_purchases(interval_statistics, filters, db):
     return interval_statistics
 
 
+def select_subscription_purchases(filters, db):
+    # Покупки по платежам, интервал покупки определяется её днём по местному времени
+    interval_index = get_interval_index(get_sale_day(), filters)
+
+    purchases = select(
+        interval_index.label('interval_index'),
+        func.count(Payment.id).label('count'),
+        func.sum(SubscriptionTemplate.price).label('sum')
+    ).join(
+        Subscription,
+        Subscription.payment_id == Payment.id
+    ).join(
+        SubscriptionTemplate,
+        SubscriptionTemplate.id == Subscription.subscription_template_id
+    ).where(
+        Payment.terminated == False,
+        get_sale_day() >= filters.date_from,
+        get_sale_day() <= filters.date_to
+    ).group_by(
+        interval_index
+    )
+
+    return apply_filters_to_subscription_purchases(purchases, filters, db)
+
+
+def select_subscription_purchases_from_rollup(filters, db):
+    # Те же покупки из сводной таблицы по дням и шаблонам, фильтры по шаблону применяются так же
+    interval_index = get_interval_index(DailySubscriptionSales.day, filters)
+
+    purchases = select(
+        interval_index.label('interval_index'),
+        func.sum(DailySubscriptionSales.count).label('count'),
+        func.sum(DailySubscriptionSales.sum).label('sum')
+    ).join(
+        SubscriptionTemplate,
+        SubscriptionTemplate.id == DailySubscriptionSales.subscription_template_id
+    ).where(
+        DailySubscriptionSales.day >= filters.date_from,
+        DailySubscriptionSales.day <= filters.date_to
+    ).group_by(
+        interval_index
+    )
+
+    return apply_filters_to_subscription_purchases(purchases, filters, db)
+
+
 @router.post('/subscriptions', response_model=List[SubscriptionPurchasesInterval])
 async def get_subscription_purchases_statistics(
         filters: SubscriptionPurchasesFilters,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     check_filters_intervals(filters)
 
+    if STATISTICS_USE_ROLLUPS:
+        purchases = select_subscription_purchases_from_rollup(filters, db).subquery()
+    else:
+        purchases = select_subscription_purchases(filters, db).subquery()
+
+    interval_indexes = select_interval_indexes(filters)
+
+    intervals_statistics = await db.execute(
+        select(
+            interval_indexes.c.interval_index,
+            purchases.c.count,
+            purchases.c.sum
+        ).select_from(interval_indexes).outerjoin(
+            purchases,
+            purchases.c.interval_index == interval_indexes.c.interval_index
+        ).order_by(
+            interval_indexes.c.interval_index
+        )
+    )
+
     statistics: List[SubscriptionPurchasesInterval] = []
 
-    interval_date_from = filters.date_from
-    while interval_date_from <= filters.date_to:
-        interval_date_to = interval_date_from + timedelta(days=filters.interval_in_days)
-
-        interval_statistics = db.query(
-            func.count(Payment.id).label('count'),
-            func.sum(SubscriptionTemplate.price).label('sum')
-        ).join(
-            Subscription,
-            Subscription.payment_id == Payment.id
-        ).join(
-            SubscriptionTemplate,
-            SubscriptionTemplate.id == Subscription.subscription_template_id
-        ).where(
-            Payment.created_at >= interval_date_from,
-            Payment.created_at < interval_date_to,
-            Payment.created_at < filters.date_to + timedelta(days=1)
+    for interval_statistics in intervals_statistics:
+        interval_date_from, interval_date_to = get_interval_dates(interval_statistics.interval_index, filters)
+
+        statistics.append(SubscriptionPurchasesInterval(
+            date_from=interval_date_from,
+            date_to=interval_date_to,
+            count=interval_statistics.count if interval_statistics.count else 0,
+            sum=interval_statistics.sum if interval_statistics.sum else 0
+        ))
+
+    return statistics
+
+
+def apply_filters_to_attendance(attendance, filters):
+    if filters.group_ids:
+        attendance = attendance.where(Lesson.group_id.in_(filters.group_ids))
+
+    if filters.lesson_type_ids:
+        attendance = attendance.where(Lesson.lesson_type_id.in_(filters.lesson_type_ids))
+
+    return attendance
+
+
+@router.post('/attendance', response_model=List[AttendanceInterval])
+async def get_attendance_statistics(
+        filters: AttendanceFilters,
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
+):
+    check_filters_intervals(filters)
+
+    cache_key = ('attendance', filters.model_dump_json())
+    statistics = statistics_cache.get(cache_key)
+    if statistics is not None:
+        return statistics
+
+    # Записи на групповые занятия считаются по каждому занятию, затем суммируются по интервалам
+    lesson_day = get_lesson_day()
+    lessons = select(
+        get_interval_index(lesson_day, filters).label('interval_index'),
+        Group.max_capacity,
+        func.count(LessonSubscription.id).label('booked_seats')
+    ).join(
+        Group,
+        Group.id == Lesson.group_id
+    ).outerjoin(
+        LessonSubscription,
+        and_(
+            LessonSubscription.lesson_id == Lesson.id,
+            LessonSubscription.cancelled == False
         )
+    ).where(
+        Lesson.terminated == False,
+        lesson_day >= filters.date_from,
+        lesson_day <= filters.date_to
+    ).group_by(
+        Lesson.id,
+        Group.id
+    )
+    lessons = apply_filters_to_attendance(lessons, filters).subquery()
+
+    attendance = select(
+        lessons.c.interval_index,
+        func.count().label('lesson_count'),
+        func.sum(lessons.c.booked_seats).label('booked_seats'),
+        func.sum(lessons.c.max_capacity).label('max_capacity')
+    ).group_by(
+        lessons.c.interval_index
+    ).subquery()
 
-        interval_statistics = apply_filters_to_subscription_purchases(interval_statistics, filters, db).first()
+    interval_indexes = select_interval_indexes(filters)
+
+    intervals_statistics = await db.execute(
+        select(
+            interval_indexes.c.interval_index,
+            attendance.c.lesson_count,
+            attendance.c.booked_seats,
+            attendance.c.max_capacity
+        ).select_from(interval_indexes).outerjoin(
+            attendance,
+            attendance.c.interval_index == interval_indexes.c.interval_index
+        ).order_by(
+            interval_indexes.c.interval_index
+        )
+    )
 
-        interval_statistics = SubscriptionPurchasesInterval(
+    statistics: List[AttendanceInterval] = []
+
+    for interval_statistics in intervals_statistics:
+        interval_date_from, interval_date_to = get_interval_dates(interval_statistics.interval_index, filters)
+
+        statistics.append(AttendanceInterval(
             date_from=interval_date_from,
-            date_to=(
-                interval_date_to - timedelta(days=1) if interval_date_to - timedelta(days=1) <= filters.date_to
-                else filters.date_to
-            ),
-            count=interval_statistics.count if interval_statistics and interval_statistics.count else 0,
-            sum=interval_statistics.sum if interval_statistics and interval_statistics.sum else 0
+            date_to=interval_date_to,
+            lesson_count=interval_statistics.lesson_count if interval_statistics.lesson_count else 0,
+            booked_seats=interval_statistics.booked_seats if interval_statistics.booked_seats else 0,
+            max_capacity=interval_statistics.max_capacity if interval_statistics.max_capacity else 0
+        ))
+
+    statistics_cache.set(cache_key, statistics)
+
+    return statistics
+
+
+@router.post('/classrooms', response_model=List[ClassroomUtilizationInterval])
+async def get_classroom_utilization_statistics(
+        filters: ClassroomUtilizationFilters,
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
+):
+    check_filters_intervals(filters)
+
+    cache_key = ('classrooms', filters.model_dump_json())
+    statistics = statistics_cache.get(cache_key)
+    if statistics is not None:
+        return statistics
+
+    lesson_day = get_lesson_day()
+    interval_index = get_interval_index(lesson_day, filters)
+    occupation = select(
+        Lesson.classroom_id,
+        interval_index.label('interval_index'),
+        func.count(Lesson.id).label('lesson_count'),
+        func.sum(func.extract('epoch', Lesson.finish_time - Lesson.start_time) / 3600).label('occupied_hours')
+    ).where(
+        Lesson.terminated == False,
+        Lesson.classroom_id != None,
+        lesson_day >= filters.date_from,
+        lesson_day <= filters.date_to
+    ).group_by(
+        Lesson.classroom_id,
+        interval_index
+    ).subquery()
+
+    classrooms = select(Classroom.id, Classroom.name)
+    if filters.classroom_ids:
+        classrooms = classrooms.where(Classroom.id.in_(filters.classroom_ids))
+    else:
+        classrooms = classrooms.where(Classroom.terminated == False)
+    classrooms = classrooms.subquery()
+
+    interval_indexes = select_interval_indexes(filters)
+
+    # Каждый зал в каждом интервале, в том числе без занятий
+    intervals_statistics = await db.execute(
+        select(
+            interval_indexes.c.interval_index,
+            classrooms.c.id.label('classroom_id'),
+            classrooms.c.name.label('classroom_name'),
+            occupation.c.lesson_count,
+            occupation.c.occupied_hours
+        ).select_from(interval_indexes).join(
+            classrooms,
+            true()
+        ).outerjoin(
+            occupation,
+            and_(
+                occupation.c.interval_index == interval_indexes.c.interval_index,
+                occupation.c.classroom_id == classrooms.c.id
+            )
+        ).order_by(
+            interval_indexes.c.interval_index,
+            classrooms.c.name
         )
+    )
 
-        statistics.append(interval_statistics)
+    statistics: List[ClassroomUtilizationInterval] = []
 
-        interval_date_from = interval_date_to
+    for interval_statistics in intervals_statistics:
+        interval_date_from, interval_date_to = get_interval_dates(interval_statistics.interval_index, filters)
+
+        statistics.append(ClassroomUtilizationInterval(
+            date_from=interval_date_from,
+            date_to=interval_date_to,
+            classroom_id=interval_statistics.classroom_id,
+            classroom_name=interval_statistics.classroom_name,
+            lesson_count=interval_statistics.lesson_count if interval_statistics.lesson_count else 0,
+            occupied_hours=round(interval_statistics.occupied_hours, 2) if interval_statistics.occupied_hours else 0
+        ))
+
+    statistics_cache.set(cache_key, statistics)
 
     return statistics
+
+
+def apply_filters_to_teacher_workload(workload, filters):
+    if filters.teacher_ids:
+        workload = workload.where(TeacherLesson.teacher_id.in_(filters.teacher_ids))
+
+    if filters.is_group is not None:
+        workload = workload.where(LessonType.is_group == filters.is_group)
+
+    if filters.dance_style_ids:
+        workload = workload.where(LessonType.dance_style_id.in_(filters.dance_style_ids))
+
+    return workload
+
+
+async def write_csv_rows(rows):
+    # Строки CSV отдаются по мере поступления, без сборки всего файла в памяти
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    async for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+
+def get_teacher_workload_interval(interval_statistics, filters):
+    interval_date_from, interval_date_to = get_interval_dates(interval_statistics.interval_index, filters)
+
+    return TeacherWorkloadInterval(
+        date_from=interval_date_from,
+        date_to=interval_date_to,
+        teacher_id=interval_statistics.teacher_id,
+        first_name=interval_statistics.first_name,
+        middle_name=interval_statistics.middle_name,
+        last_name=interval_statistics.last_name,
+        lesson_type_id=interval_statistics.lesson_type_id,
+        dance_style_name=interval_statistics.dance_style_name,
+        is_group=interval_statistics.is_group,
+        lesson_count=interval_statistics.lesson_count,
+        hours=round(interval_statistics.hours, 2)
+    )
+
+
+async def stream_teacher_workload_rows(workload, filters):
+    # Ответ отдаётся уже после завершения обработчика, поэтому строки читаются в собственной сессии
+    # порциями по CSV_STREAM_BATCH_SIZE и сразу передаются в CSV
+    fields = list(TeacherWorkloadInterval.model_fields)
+    yield fields
+
+    async with AsyncSessionLocal() as db:
+        rows = await db.stream(workload.execution_options(yield_per=CSV_STREAM_BATCH_SIZE))
+        async for interval_statistics in rows:
+            teacher_workload_interval = get_teacher_workload_interval(interval_statistics, filters)
+            yield [getattr(teacher_workload_interval, field) for field in fields]
+
+
+@router.post('/teachers', response_model=List[TeacherWorkloadInterval])
+async def get_teacher_workload_statistics(
+        filters: TeacherWorkloadFilters,
+        as_csv: bool = False,
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
+):
+    check_filters_intervals(filters)
+
+    # Проведённые занятия (подтверждённые и не отменённые) по преподавателю, интервалу и виду занятий,
+    # в ответ попадают только сочетания, по которым были занятия
+    lesson_day = get_lesson_day()
+    interval_index = get_interval_index(lesson_day, filters)
+    workload = select(
+        interval_index.label('interval_index'),
+        TeacherLesson.teacher_id,
+        User.first_name,
+        User.middle_name,
+        User.last_name,
+        LessonType.id.label('lesson_type_id'),
+        DanceStyle.name.label('dance_style_name'),
+        LessonType.is_group,
+        func.count(Lesson.id).label('lesson_count'),
+        func.sum(func.extract('epoch', Lesson.finish_time - Lesson.start_time) / 3600).label('hours')
+    ).select_from(TeacherLesson).join(
+        Lesson,
+        Lesson.id == TeacherLesson.lesson_id
+    ).join(
+        Teacher,
+        Teacher.id == TeacherLesson.teacher_id
+    ).join(
+        User,
+        User.id == Teacher.user_id
+    ).join(
+        LessonType,
+        LessonType.id == Lesson.lesson_type_id
+    ).join(
+        DanceStyle,
+        DanceStyle.id == LessonType.dance_style_id
+    ).where(
+        Lesson.terminated == False,
+        Lesson.is_confirmed == True,
+        lesson_day >= filters.date_from,
+        lesson_day <= filters.date_to
+    ).group_by(
+        interval_index,
+        TeacherLesson.teacher_id,
+        User.id,
+        LessonType.id,
+        DanceStyle.id
+    ).order_by(
+        interval_index,
+        User.last_name,
+        User.first_name,
+        DanceStyle.name,
+        LessonType.is_group
+    )
+    workload = apply_filters_to_teacher_workload(workload, filters)
+
+    if as_csv:
+        return StreamingResponse(
+            write_csv_rows(stream_teacher_workload_rows(workload, filters)),
+            media_type='text/csv',
+            headers={'Content-Disposition': 'attachment; filename="teachers.csv"'}
+        )
+
+    return [
+        get_teacher_workload_interval(interval_statistics, filters)
+        for interval_statistics in await db.execute(workload)
+    ]
@@ -2,11 +2,16 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Query
 from pydantic import AfterValidator
-from sqlalchemy import or_, text
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from app.auth.jwt import get_current_user
-from app.database import get_db, TIMEZONE
+from app.schemas.token import Principal
+from app.database import get_async_db, TIMEZONE
+from app.pagination import paginate
+from app.loaders import load_with_options, student_full_info_options, subscription_full_info_options
+from app.subscription_lessons import cancel_lesson_subscriptions
 from app.routers.auth import patch_user
 from app.models import User, Student, Level, Group, Lesson, Subscription, Payment, SubscriptionTemplate
 from app.models.association import *
@@ -24,7 +29,7 @@ def apply_filters_to_students(students, filters, db):
 
     if filters.group_ids:
         students = students.where(
-            db.query(StudentGroup).where(
+            select(StudentGroup).where(
                 StudentGroup.student_id == Student.id,
                 StudentGroup.group_id.in_(filters.group_ids)
             ).exists()
@@ -49,17 +54,14 @@ async def search_students(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    students = db.query(Student)
+    students = select(Student)
     students = apply_filters_to_students(students, filters, db)
-    return StudentPage(
-        students=students.order_by(
-            text('students.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=students.count()
-    )
+    students, page_info = await paginate(db, students, Student, order_by, desc, offset, limit, cursor)
+    return StudentPage(students=students, **page_info)
 
 
 @router.post('/search/full-info', response_model=StudentFullInfoPage)
@@ -69,26 +71,25 @@ async def search_students_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    students = db.query(Student)
+    students = select(Student)
     students = apply_filters_to_students(students, filters, db)
-    return StudentFullInfoPage(
-        students=students.order_by(
-            text('students.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=students.count()
+    students, page_info = await paginate(
+        db, students, Student, order_by, desc, offset, limit, cursor, options=student_full_info_options()
     )
+    return StudentFullInfoPage(students=students, **page_info)
 
 
 @router.get('/{student_id}', response_model=StudentInfo)
 async def get_student_by_id(
         student_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    student = db.query(Student).where(Student.id == student_id).first()
+    student = await db.scalar(select(Student).where(Student.id == student_id))
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -100,10 +101,10 @@ async def get_student_by_id(
 @router.get('/full-info/{student_id}', response_model=StudentFullInfo)
 async def get_student_full_info_by_id(
         student_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    student = db.query(Student).where(Student.id == student_id).first()
+    student = await db.scalar(select(Student).where(Student.id == student_id).options(*student_full_info_options()))
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -116,10 +117,10 @@ async def get_student_full_info_by_id(
 async def patch_student(
         student_id: uuid.UUID,
         student_data: StudentUpdate,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    student = db.query(Student).where(Student.id == student_id).first()
+    student = await db.scalar(select(Student).where(Student.id == student_id))
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -132,7 +133,7 @@ async def patch_student(
         )
 
     if student_data.level_id:
-        level = db.query(Level).where(Level.id == student_data.level_id).first()
+        level = await db.scalar(select(Level).where(Level.id == student_data.level_id))
         if not level:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -147,41 +148,40 @@ async def patch_student(
         student_data.level_id = None
 
     if student_data.terminated:
-        db.query(StudentGroup).where(StudentGroup.student_id == student_id).delete()
-
-        db.query(LessonSubscription).where(
-            LessonSubscription.cancelled == False,
-            db.query(Subscription).where(
-                Subscription.id == LessonSubscription.subscription_id,
-                Subscription.student_id == student_id
-            ).join(Lesson, Lesson.id == LessonSubscription.lesson_id).where(
-                Lesson.start_time >= datetime.now(TIMEZONE)
-            ).exists()
-        ).update(
-            {LessonSubscription.cancelled: True}
-        )
+        await db.execute(delete(StudentGroup).where(StudentGroup.student_id == student_id))
+
+        await cancel_lesson_subscriptions(db, select(Subscription).where(
+            Subscription.id == LessonSubscription.subscription_id,
+            Subscription.student_id == student_id
+        ).join(Lesson, Lesson.id == LessonSubscription.lesson_id).where(
+            Lesson.start_time >= datetime.now(TIMEZONE)
+        ).exists())
 
     await patch_user(student.user_id, student_data, db)
 
-    db.refresh(student)
+    await db.commit()
+
+    return await load_with_options(db, Student, student.id, student_full_info_options())
 
-    return student
 
+async def get_fitting_subscriptions(student, group, db):
+    subscriptions = (await db.scalars(select(Subscription).where(
+        Subscription.student_id == student.id
+    ).options(*subscription_full_info_options()))).all()
 
-def get_fitting_subscriptions(student, group, db):
-    fitting_subscriptions = [subscription for subscription in student.subscriptions
+    fitting_subscriptions = [subscription for subscription in subscriptions
                              if subscription.payment and not subscription.payment.terminated
                              and subscription.lessons_left > 0
                              and (not subscription.expiration_date
                                   or subscription.expiration_date > datetime.now(TIMEZONE))
-                             and not db.query(Lesson).where(
+                             and not await db.scalar(select(Lesson).where(
             Lesson.group_id == group.id,
             Lesson.start_time > datetime.now(TIMEZONE),
             Lesson.terminated == False,
             Lesson.is_confirmed == True,
             ~Lesson.lesson_type_id.in_([lesson_type.id for lesson_type
                                         in subscription.subscription_template.lesson_types])
-        ).first()]
+        ))]
 
     return fitting_subscriptions
 
@@ -191,10 +191,10 @@ def get_fitting_subscriptions(student, group, db):
 async def create_student_group(
         student_id: uuid.UUID,
         group_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    student = db.query(Student).where(Student.id == student_id).first()
+    student = await db.scalar(select(Student).where(Student.id == student_id))
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -206,7 +206,7 @@ async def create_student_group(
             detail='Недостаточно прав'
         )
 
-    group = db.query(Group).where(Group.id == group_id).first()
+    group = await db.scalar(select(Group).where(Group.id == group_id).options(selectinload(Group.student_groups)))
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -223,17 +223,17 @@ async def create_student_group(
             detail='В группе нет свободных мест'
         )
 
-    existing_group = db.query(StudentGroup).where(
+    existing_group = await db.scalar(select(StudentGroup).where(
         StudentGroup.student_id == student_id,
         StudentGroup.group_id == group_id
-    ).first()
+    ))
     if existing_group:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Ученик уже связан с этой группой'
         )
 
-    fitting_subscriptions = get_fitting_subscriptions(student, group, db)
+    fitting_subscriptions = await get_fitting_subscriptions(student, group, db)
 
     if len(fitting_subscriptions) == 0:
         raise HTTPException(
@@ -247,10 +247,9 @@ async def create_student_group(
     )
 
     db.add(student_group)
-    db.commit()
-    db.refresh(student)
+    await db.commit()
 
-    return student
+    return await load_with_options(db, Student, student.id, student_full_info_options())
 
 
 @router.delete('/groups/{student_id}/{group_id}')
@@ -258,17 +257,17 @@ async def delete_student_group(
         student_id: uuid.UUID,
         group_id: uuid.UUID,
         response: Response,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    student = db.query(Student).where(Student.id == student_id).first()
+    student = await db.scalar(select(Student).where(Student.id == student_id))
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Ученик не найден'
         )
 
-    group = db.query(Group).where(Group.id == group_id).first()
+    group = await db.scalar(select(Group).where(Group.id == group_id).options(selectinload(Group.teachers)))
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -282,7 +281,7 @@ async def delete_student_group(
 
     if not current_user.admin and current_user.id != student.user_id:
         if current_user.teacher:
-            if current_user.teacher not in group.teachers:
+            if current_user.teacher.id not in [teacher.id for teacher in group.teachers]:
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail='Преподаватель не связан с этой группой'
@@ -293,28 +292,23 @@ async def delete_student_group(
                 detail='Недостаточно прав'
             )
 
-    existing_group = db.query(StudentGroup).where(
+    existing_group = await db.scalar(select(StudentGroup).where(
         StudentGroup.student_id == student_id,
         StudentGroup.group_id == group_id
-    ).first()
+    ))
     if not existing_group:
         response.status_code = status.HTTP_204_NO_CONTENT
         return 'Ученик не связан с этой группой'
 
-    db.query(LessonSubscription).where(
-        LessonSubscription.cancelled == False,
-        db.query(Subscription).where(
-            Subscription.id == LessonSubscription.subscription_id,
-            Subscription.student_id == student_id
-        ).join(Lesson, Lesson.id == LessonSubscription.lesson_id).where(
-            Lesson.group_id == group_id,
-            Lesson.start_time >= datetime.now(TIMEZONE)
-        ).exists()
-    ).update(
-        {LessonSubscription.cancelled: True}
-    )
+    await cancel_lesson_subscriptions(db, select(Subscription).where(
+        Subscription.id == LessonSubscription.subscription_id,
+        Subscription.student_id == student_id
+    ).join(Lesson, Lesson.id == LessonSubscription.lesson_id).where(
+        Lesson.group_id == group_id,
+        Lesson.start_time >= datetime.now(TIMEZONE)
+    ).exists())
 
-    db.delete(existing_group)
-    db.commit()
+    await db.delete(existing_group)
+    await db.commit()
 
     return 'Ученик успешно удалён из группы'
@@ -1,13 +1,18 @@
+from decimal import Decimal
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Query
 from pydantic import AfterValidator
-from sqlalchemy import or_, text
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db, TIMEZONE
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db, TIMEZONE
+from app.pagination import paginate
+from app.loaders import load_with_options, subscription_template_full_info_options
 from app.email import send_new_subscription_template_email
+from app.rollups import update_daily_subscription_sales_price
 from app.models import User, Admin, SubscriptionTemplate, SubscriptionLessonType, LessonType
 from app.schemas.subscriptionTemplate import *
 
@@ -44,8 +49,8 @@ def check_subscription_template(subscription_template_data):
 @router.post('/', response_model=SubscriptionTemplateInfo, status_code=status.HTTP_201_CREATED)
 async def create_subscription_template(
         subscription_template_data: SubscriptionTemplateCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     check_subscription_template(subscription_template_data)
 
@@ -59,19 +64,19 @@ async def create_subscription_template(
     )
 
     db.add(subscription_template)
-    db.commit()
 
     await send_new_subscription_template_email(subscription_template, db)
 
-    db.refresh(subscription_template)
+    await db.commit()
+    await db.refresh(subscription_template)
 
     return subscription_template
 
 
-def apply_filters_to_subscription_templates(subscription_templates, filters, db: Session):
+def apply_filters_to_subscription_templates(subscription_templates, filters, db: AsyncSession):
     if filters.lesson_type_ids:
         subscription_templates = subscription_templates.where(
-            db.query(SubscriptionLessonType).where(
+            select(SubscriptionLessonType).where(
                 SubscriptionLessonType.subscription_template_id == SubscriptionTemplate.id,
                 SubscriptionLessonType.lesson_type_id.in_(filters.lesson_type_ids)
             ).exists()
@@ -79,7 +84,7 @@ def apply_filters_to_subscription_templates(subscription_templates, filters, db:
 
     if filters.dance_style_ids:
         subscription_templates = subscription_templates.where(
-            db.query(SubscriptionLessonType).where(
+            select(SubscriptionLessonType).where(
                 SubscriptionLessonType.subscription_template_id == SubscriptionTemplate.id
             ).join(LessonType).where(
                 LessonType.dance_style_id.in_(filters.dance_style_ids)
@@ -110,17 +115,16 @@ async def search_subscription_templates(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription_templates = db.query(SubscriptionTemplate)
+    subscription_templates = select(SubscriptionTemplate)
     subscription_templates = apply_filters_to_subscription_templates(subscription_templates, filters, db)
-    return SubscriptionTemplatePage(
-        subscription_templates=subscription_templates.order_by(
-            text('subscription_templates.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=subscription_templates.count()
+    subscription_templates, page_info = await paginate(
+        db, subscription_templates, SubscriptionTemplate, order_by, desc, offset, limit, cursor
     )
+    return SubscriptionTemplatePage(subscription_templates=subscription_templates, **page_info)
 
 
 @router.post('/search/full-info', response_model=SubscriptionTemplateFullInfoPage)
@@ -130,28 +134,28 @@ async def search_subscription_templates_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription_templates = db.query(SubscriptionTemplate)
+    subscription_templates = select(SubscriptionTemplate)
     subscription_templates = apply_filters_to_subscription_templates(subscription_templates, filters, db)
-    return SubscriptionTemplateFullInfoPage(
-        subscription_templates=subscription_templates.order_by(
-            text('subscription_templates.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=subscription_templates.count()
+    subscription_templates, page_info = await paginate(
+        db, subscription_templates, SubscriptionTemplate, order_by, desc, offset, limit, cursor,
+        options=subscription_template_full_info_options()
     )
+    return SubscriptionTemplateFullInfoPage(subscription_templates=subscription_templates, **page_info)
 
 
 @router.get('/{subscription_template_id}', response_model=SubscriptionTemplateInfo)
 async def get_subscription_template_by_id(
         subscription_template_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription_template = db.query(SubscriptionTemplate).where(
+    subscription_template = await db.scalar(select(SubscriptionTemplate).where(
         SubscriptionTemplate.id == subscription_template_id
-    ).first()
+    ))
     if subscription_template is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -163,12 +167,12 @@ async def get_subscription_template_by_id(
 @router.get('/full-info/{subscription_template_id}', response_model=SubscriptionTemplateFullInfo)
 async def get_subscription_template_full_info_by_id(
         subscription_template_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription_template = db.query(SubscriptionTemplate).where(
+    subscription_template = await db.scalar(select(SubscriptionTemplate).where(
         SubscriptionTemplate.id == subscription_template_id
-    ).first()
+    ).options(*subscription_template_full_info_options()))
     if subscription_template is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -182,12 +186,13 @@ async def get_subscription_template_full_info_by_id(
 async def patch_subscription_template(
         subscription_template_id: uuid.UUID,
         subscription_template_data: SubscriptionTemplateUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription_template = db.query(SubscriptionTemplate).where(
+    # Блокировка не даёт параллельным изменениям цены дважды сдвинуть сводку продаж
+    subscription_template = await db.scalar(select(SubscriptionTemplate).where(
         SubscriptionTemplate.id == subscription_template_id
-    ).first()
+    ).with_for_update())
     if not subscription_template:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -195,13 +200,21 @@ async def patch_subscription_template(
         )
     check_subscription_template(subscription_template_data)
 
+    old_price = subscription_template.price
+
     for field, value in subscription_template_data.model_dump(exclude_unset=True).items():
         setattr(subscription_template, field, value)
 
-    db.commit()
-    db.refresh(subscription_template)
+    if subscription_template.price != old_price:
+        await update_daily_subscription_sales_price(
+            db, subscription_template.id, Decimal(str(subscription_template.price)) - old_price
+        )
 
-    return subscription_template
+    await db.commit()
+
+    return await load_with_options(
+        db, SubscriptionTemplate, subscription_template.id, subscription_template_full_info_options()
+    )
 
 
 @router.post('/lesson-types/{subscription_template_id}/{lesson_type_id}',
@@ -210,19 +223,19 @@ async def patch_subscription_template(
 async def create_subscription_lesson_type(
         subscription_template_id: uuid.UUID,
         lesson_type_id: uuid.UUID,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription_template = db.query(SubscriptionTemplate).where(
+    subscription_template = await db.scalar(select(SubscriptionTemplate).where(
         SubscriptionTemplate.id == subscription_template_id
-    ).first()
+    ))
     if not subscription_template:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Шаблон абонемента не найден'
         )
 
-    lesson_type = db.query(LessonType).where(LessonType.id == lesson_type_id).first()
+    lesson_type = await db.scalar(select(LessonType).where(LessonType.id == lesson_type_id))
     if not lesson_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -234,10 +247,10 @@ async def create_subscription_lesson_type(
             detail='Тип занятия не активен'
         )
 
-    existing_lesson_type = db.query(SubscriptionLessonType).where(
+    existing_lesson_type = await db.scalar(select(SubscriptionLessonType).where(
         SubscriptionLessonType.subscription_template_id == subscription_template_id,
         SubscriptionLessonType.lesson_type_id == lesson_type_id
-    ).first()
+    ))
     if existing_lesson_type:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -250,10 +263,11 @@ async def create_subscription_lesson_type(
     )
 
     db.add(subscription_lesson_type)
-    db.commit()
-    db.refresh(subscription_template)
+    await db.commit()
 
-    return subscription_template
+    return await load_with_options(
+        db, SubscriptionTemplate, subscription_template.id, subscription_template_full_info_options()
+    )
 
 
 @router.delete('/lesson-types/{subscription_template_id}/{lesson_type_id}')
@@ -261,34 +275,34 @@ async def delete_subscription_lesson_type(
         subscription_template_id: uuid.UUID,
         lesson_type_id: uuid.UUID,
         response: Response,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription_template = db.query(SubscriptionTemplate).where(
+    subscription_template = await db.scalar(select(SubscriptionTemplate).where(
         SubscriptionTemplate.id == subscription_template_id
-    ).first()
+    ))
     if not subscription_template:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Шаблон абонемента не найден'
         )
 
-    lesson_type = db.query(LessonType).where(LessonType.id == lesson_type_id).first()
+    lesson_type = await db.scalar(select(LessonType).where(LessonType.id == lesson_type_id))
     if not lesson_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Тип занятия не найден'
         )
 
-    existing_lesson_type = db.query(SubscriptionLessonType).where(
+    existing_lesson_type = await db.scalar(select(SubscriptionLessonType).where(
         SubscriptionLessonType.subscription_template_id == subscription_template.id,
         SubscriptionLessonType.lesson_type_id == lesson_type.id
-    ).first()
+    ))
     if not existing_lesson_type:
         response.status_code = status.HTTP_204_NO_CONTENT
         return 'Шаблон абонемента не связан с этим типом занятия'
 
-    db.delete(existing_lesson_type)
-    db.commit()
+    await db.delete(existing_lesson_type)
+    await db.commit()
 
     return 'Тип занятия успешно удалён из шаблона абонемента'
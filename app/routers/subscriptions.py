@@ -2,14 +2,21 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import AfterValidator
-from sqlalchemy import or_, text
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 from datetime import timedelta
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db, TIMEZONE
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db, TIMEZONE
+from app.pagination import paginate
+from app.loaders import load_with_options, subscription_more_info_options, subscription_full_info_options, \
+    lesson_full_info_options
 from app.routers.lessons import get_student_parallel_lesson
-from app.models import User, Admin, Student, Subscription, SubscriptionTemplate, Payment, Lesson
+from app.rollups import update_daily_subscription_sales
+from app.subscription_lessons import use_subscription_lesson, cancel_lesson_subscriptions
+from app.models import User, Admin, Student, Subscription, SubscriptionTemplate, Payment, Lesson, Group
 from app.models.association import *
 from app.schemas.subscription import *
 from app.schemas import LessonFullInfo
@@ -70,10 +77,10 @@ def check_subscription(subscription, current_user):
 @router.post('/', response_model=SubscriptionInfo, status_code=status.HTTP_201_CREATED)
 async def create_subscription(
         subscription_data: SubscriptionCreate,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    student = db.query(Student).where(Student.id == subscription_data.student_id).first()
+    student = await db.scalar(select(Student).where(Student.id == subscription_data.student_id))
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -85,12 +92,12 @@ async def create_subscription(
             detail='Недостаточно прав'
         )
 
-    subscription_template = db.query(SubscriptionTemplate).where(
+    subscription_template = await db.scalar(select(SubscriptionTemplate).where(
         SubscriptionTemplate.id == subscription_data.subscription_template_id
-    ).first()
+    ))
     check_subscription_template(subscription_template)
 
-    payment = db.query(Payment).where(Payment.id == subscription_data.payment_id).first()
+    payment = await db.scalar(select(Payment).where(Payment.id == subscription_data.payment_id))
     check_payment(payment)
 
     subscription = Subscription(
@@ -104,8 +111,10 @@ async def create_subscription(
                                         timedelta(days=subscription_template.expiration_day_count))
 
     db.add(subscription)
-    db.commit()
-    db.refresh(subscription)
+    await db.flush()
+    await update_daily_subscription_sales(db, 1, Subscription.id == subscription.id)
+    await db.commit()
+    await db.refresh(subscription)
 
     return subscription
 
@@ -146,17 +155,16 @@ async def search_subscriptions(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscriptions = db.query(Subscription)
+    subscriptions = select(Subscription)
     subscriptions = apply_filters_to_subscriptions(subscriptions, filters)
-    return SubscriptionPage(
-        subscriptions=subscriptions.order_by(
-            text('subscriptions.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=subscriptions.count()
+    subscriptions, page_info = await paginate(
+        db, subscriptions, Subscription, order_by, desc, offset, limit, cursor
     )
+    return SubscriptionPage(subscriptions=subscriptions, **page_info)
 
 
 @router.post('/search/full-info', response_model=SubscriptionFullInfoPage)
@@ -166,26 +174,26 @@ async def search_subscriptions_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscriptions = db.query(Subscription)
+    subscriptions = select(Subscription)
     subscriptions = apply_filters_to_subscriptions(subscriptions, filters)
-    return SubscriptionFullInfoPage(
-        subscriptions=subscriptions.order_by(
-            text('subscriptions.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=subscriptions.count()
+    subscriptions, page_info = await paginate(
+        db, subscriptions, Subscription, order_by, desc, offset, limit, cursor,
+        options=subscription_full_info_options()
     )
+    return SubscriptionFullInfoPage(subscriptions=subscriptions, **page_info)
 
 
 @router.get('/{subscription_id}', response_model=SubscriptionInfo)
 async def get_subscription_by_id(
         subscription_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription = db.query(Subscription).where(Subscription.id == subscription_id).first()
+    subscription = await db.scalar(select(Subscription).where(Subscription.id == subscription_id))
     if subscription is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -197,10 +205,12 @@ async def get_subscription_by_id(
 @router.get('/full-info/{subscription_id}', response_model=SubscriptionFullInfo)
 async def get_subscription_full_info_by_id(
         subscription_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription = db.query(Subscription).where(Subscription.id == subscription_id).first()
+    subscription = await db.scalar(
+        select(Subscription).where(Subscription.id == subscription_id).options(*subscription_full_info_options())
+    )
     if subscription is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -213,10 +223,10 @@ async def get_subscription_full_info_by_id(
 async def patch_subscription(
         subscription_id: uuid.UUID,
         subscription_data: SubscriptionUpdate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription = db.query(Subscription).where(Subscription.id == subscription_id).first()
+    subscription = await db.scalar(select(Subscription).where(Subscription.id == subscription_id))
     if not subscription:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -224,22 +234,30 @@ async def patch_subscription(
         )
 
     if subscription_data.subscription_template_id:
-        subscription_template = db.query(SubscriptionTemplate).where(
+        subscription_template = await db.scalar(select(SubscriptionTemplate).where(
             SubscriptionTemplate.id == subscription_data.subscription_template_id
-        ).first()
+        ))
         check_subscription_template(subscription_template)
 
     if subscription_data.payment_id:
-        payment = db.query(Payment).where(Payment.id == subscription_data.payment_id).first()
+        payment = await db.scalar(select(Payment).where(Payment.id == subscription_data.payment_id))
         check_payment(payment)
 
+    # Продажа переносится в сводке, если у абонемента меняется платёж или шаблон
+    sale_changed = bool({'payment_id', 'subscription_template_id'} & subscription_data.model_fields_set)
+    if sale_changed:
+        await update_daily_subscription_sales(db, -1, Subscription.id == subscription.id, Payment.terminated == False)
+
     for field, value in subscription_data.model_dump(exclude_unset=True).items():
         setattr(subscription, field, value)
 
-    db.commit()
-    db.refresh(subscription)
+    if sale_changed:
+        await db.flush()
+        await update_daily_subscription_sales(db, 1, Subscription.id == subscription.id, Payment.terminated == False)
 
-    return subscription
+    await db.commit()
+
+    return await load_with_options(db, Subscription, subscription.id, subscription_full_info_options())
 
 
 @router.post('/lessons/{subscription_id}/{lesson_id}', response_model=LessonFullInfo,
@@ -247,10 +265,13 @@ async def patch_subscription(
 async def create_lesson_subscription(
         subscription_id: uuid.UUID,
         lesson_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription = db.query(Subscription).where(Subscription.id == subscription_id).first()
+    subscription = await db.scalar(select(Subscription).where(Subscription.id == subscription_id).options(
+        *subscription_more_info_options(),
+        joinedload(Subscription.student)
+    ))
     check_subscription(subscription, current_user)
     if subscription.lessons_left <= 0:
         raise HTTPException(
@@ -258,7 +279,10 @@ async def create_lesson_subscription(
             detail='В абонементе не осталось занятий'
         )
 
-    lesson = db.query(Lesson).where(Lesson.id == lesson_id).first()
+    lesson = await db.scalar(select(Lesson).where(Lesson.id == lesson_id).options(
+        joinedload(Lesson.lesson_type),
+        joinedload(Lesson.group).selectinload(Group.students)
+    ))
     if not lesson:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -282,18 +306,18 @@ async def create_lesson_subscription(
             detail='Ученик не является членом группы'
         )
 
-    existing_lesson_subscription = db.query(LessonSubscription).join(Subscription).where(
+    existing_lesson_subscription = await db.scalar(select(LessonSubscription).join(Subscription).where(
         Subscription.student_id == subscription.student_id,
         LessonSubscription.lesson_id == lesson.id,
         LessonSubscription.cancelled == False
-    ).first()
+    ))
     if existing_lesson_subscription:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Ученик уже записан на это занятие'
         )
 
-    parallel_student_lesson = get_student_parallel_lesson(
+    parallel_student_lesson = await get_student_parallel_lesson(
         subscription.student_id, lesson.start_time, lesson.finish_time, db
     )
     if parallel_student_lesson:
@@ -307,11 +331,11 @@ async def create_lesson_subscription(
         lesson_id=lesson_id
     )
     db.add(lesson_subscription)
+    await use_subscription_lesson(subscription.id, db)
 
-    db.commit()
-    db.refresh(lesson)
+    await db.commit()
 
-    return lesson
+    return await load_with_options(db, Lesson, lesson.id, lesson_full_info_options())
 
 
 @router.patch('/lessons/cancel/{subscription_id}/{lesson_id}',
@@ -320,13 +344,15 @@ async def create_lesson_subscription(
 async def cancel_lesson_subscription(
         subscription_id: uuid.UUID,
         lesson_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    subscription = db.query(Subscription).where(Subscription.id == subscription_id).first()
+    subscription = await db.scalar(
+        select(Subscription).where(Subscription.id == subscription_id).options(joinedload(Subscription.student))
+    )
     check_subscription(subscription, current_user)
 
-    lesson = db.query(Lesson).where(Lesson.id == lesson_id).first()
+    lesson = await db.scalar(select(Lesson).where(Lesson.id == lesson_id))
     if not lesson:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -338,11 +364,11 @@ async def cancel_lesson_subscription(
             detail='Занятие уже началось'
         )
 
-    lesson_subscription = db.query(LessonSubscription).where(
+    lesson_subscription = await db.scalar(select(LessonSubscription).where(
         LessonSubscription.subscription_id == subscription.id,
         LessonSubscription.lesson_id == lesson.id,
         LessonSubscription.cancelled == False
-    ).first()
+    ))
     if not lesson_subscription:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -350,15 +376,14 @@ async def cancel_lesson_subscription(
         )
 
     if not lesson.group_id:
-        db.query(TeacherLesson).where(
+        await db.execute(delete(TeacherLesson).where(
             TeacherLesson.lesson_id == lesson_id
-        ).delete()
+        ))
 
         lesson.terminated = True
 
-    lesson_subscription.cancelled = True
+    await cancel_lesson_subscriptions(db, LessonSubscription.id == lesson_subscription.id)
 
-    db.commit()
-    db.refresh(subscription)
+    await db.commit()
 
-    return subscription
+    return await load_with_options(db, Subscription, subscription.id, subscription_full_info_options())
@@ -2,11 +2,16 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Query
 from pydantic import AfterValidator
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from app.auth.jwt import get_current_admin, get_current_user
-from app.database import get_db, TIMEZONE
+from app.schemas.token import Principal, PrincipalRole
+from app.database import get_async_db, TIMEZONE
+from app.pagination import paginate
+from app.loaders import load_with_options, teacher_full_info_options, lesson_full_info_options
+from app.subscription_lessons import cancel_lesson_subscriptions
 from app.email import send_new_teacher_email, send_teacher_terminated_email
 from app.routers.lessons import get_teacher_parallel_lesson
 from app.routers.auth import create_user, patch_user
@@ -37,21 +42,22 @@ def check_teacher(teacher, current_user):
 @router.post('/', response_model=TeacherInfo, status_code=status.HTTP_201_CREATED)
 async def create_teacher(
         teacher_data: TeacherCreate,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     user = await create_user(teacher_data, db)
 
     teacher = Teacher(
-        user_id=user.id
+        user=user
     )
 
     db.add(teacher)
-    db.commit()
+    await db.flush()
 
     await send_new_teacher_email(teacher, db)
 
-    db.refresh(teacher)
+    await db.commit()
+    await db.refresh(teacher)
 
     return teacher
 
@@ -59,7 +65,7 @@ async def create_teacher(
 def apply_filters_to_teachers(teachers, filters, db):
     if filters.group_ids:
         teachers = teachers.where(
-            db.query(TeacherGroup).where(
+            select(TeacherGroup).where(
                 TeacherGroup.teacher_id == Teacher.id,
                 TeacherGroup.group_id.in_(filters.group_ids)
             ).exists()
@@ -67,7 +73,7 @@ def apply_filters_to_teachers(teachers, filters, db):
 
     if filters.lesson_type_ids:
         teachers = teachers.where(
-            db.query(TeacherLessonType).where(
+            select(TeacherLessonType).where(
                 TeacherLessonType.teacher_id == Teacher.id,
                 TeacherLessonType.lesson_type_id.in_(filters.lesson_type_ids)
             ).exists()
@@ -92,17 +98,14 @@ async def search_teachers(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teachers = db.query(Teacher)
+    teachers = select(Teacher)
     teachers = apply_filters_to_teachers(teachers, filters, db)
-    return TeacherPage(
-        teachers=teachers.order_by(
-            text('teachers.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=teachers.count()
-    )
+    teachers, page_info = await paginate(db, teachers, Teacher, order_by, desc, offset, limit, cursor)
+    return TeacherPage(teachers=teachers, **page_info)
 
 
 @router.post('/search/full-info', response_model=TeacherFullInfoPage)
@@ -112,26 +115,25 @@ async def search_teachers_full_info(
         desc: bool = True,
         offset: Annotated[int, Query(ge=0)] = 0,
         limit: Annotated[int, Query(gt=0, le=100)] = 20,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teachers = db.query(Teacher)
+    teachers = select(Teacher)
     teachers = apply_filters_to_teachers(teachers, filters, db)
-    return TeacherFullInfoPage(
-        teachers=teachers.order_by(
-            text('teachers.' + order_by + (' DESC' if desc else ''))
-        ).offset(offset).limit(limit).all(),
-        total=teachers.count()
+    teachers, page_info = await paginate(
+        db, teachers, Teacher, order_by, desc, offset, limit, cursor, options=teacher_full_info_options()
     )
+    return TeacherFullInfoPage(teachers=teachers, **page_info)
 
 
 @router.get('/{teacher_id}', response_model=TeacherInfo)
 async def get_teacher_by_id(
         teacher_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == teacher_id))
     if not teacher:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -143,10 +145,10 @@ async def get_teacher_by_id(
 @router.get('/full-info/{teacher_id}', response_model=TeacherFullInfo)
 async def get_teacher_full_info_by_id(
         teacher_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == teacher_id).options(*teacher_full_info_options()))
     if not teacher:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -159,10 +161,10 @@ async def get_teacher_full_info_by_id(
 async def patch_teacher(
         teacher_id: uuid.UUID,
         teacher_data: TeacherUpdate,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == teacher_id).options(joinedload(Teacher.user)))
     if not teacher:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -175,15 +177,15 @@ async def patch_teacher(
         )
 
     if teacher_data.terminated:
-        db.query(TeacherGroup).where(TeacherGroup.teacher_id == teacher_id).delete()
+        await db.execute(delete(TeacherGroup).where(TeacherGroup.teacher_id == teacher_id))
 
-        db.query(TeacherLesson).where(
+        await db.execute(delete(TeacherLesson).where(
             TeacherLesson.teacher_id == teacher_id,
-            db.query(Lesson).where(
+            select(Lesson).where(
                 Lesson.id == TeacherLesson.lesson_id,
                 Lesson.start_time >= datetime.now(TIMEZONE)
             ).exists()
-        ).delete()
+        ))
 
     old_terminated = teacher.user.terminated
 
@@ -194,9 +196,9 @@ async def patch_teacher(
     elif not teacher.user.terminated and old_terminated:
         await send_new_teacher_email(teacher, db)
 
-    db.refresh(teacher)
+    await db.commit()
 
-    return teacher
+    return await load_with_options(db, Teacher, teacher.id, teacher_full_info_options())
 
 
 @router.post('/lesson-types/{teacher_id}/{lesson_type_id}', response_model=TeacherFullInfo,
@@ -204,13 +206,13 @@ async def patch_teacher(
 async def create_teacher_lesson_type(
         teacher_id: uuid.UUID,
         lesson_type_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == teacher_id))
     check_teacher(teacher, current_user)
 
-    lesson_type = db.query(LessonType).where(LessonType.id == lesson_type_id).first()
+    lesson_type = await db.scalar(select(LessonType).where(LessonType.id == lesson_type_id))
     if not lesson_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -222,10 +224,10 @@ async def create_teacher_lesson_type(
             detail='Тип занятия не активен'
         )
 
-    existing_lesson_type = db.query(TeacherLessonType).where(
+    existing_lesson_type = await db.scalar(select(TeacherLessonType).where(
         TeacherLessonType.teacher_id == teacher_id,
         TeacherLessonType.lesson_type_id == lesson_type_id
-    ).first()
+    ))
     if existing_lesson_type:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -238,10 +240,9 @@ async def create_teacher_lesson_type(
     )
     db.add(teacher_lesson_type)
 
-    db.commit()
-    db.refresh(teacher)
+    await db.commit()
 
-    return teacher
+    return await load_with_options(db, Teacher, teacher.id, teacher_full_info_options())
 
 
 @router.delete('/lesson-types/{teacher_id}/{lesson_type_id}')
@@ -249,29 +250,29 @@ async def delete_teacher_lesson_type(
         teacher_id: uuid.UUID,
         lesson_type_id: uuid.UUID,
         response: Response,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == teacher_id))
     check_teacher(teacher, current_user)
 
-    lesson_type = db.query(LessonType).where(LessonType.id == lesson_type_id).first()
+    lesson_type = await db.scalar(select(LessonType).where(LessonType.id == lesson_type_id))
     if not lesson_type:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Тип занятия не найден'
         )
 
-    existing_lesson_type = db.query(TeacherLessonType).where(
+    existing_lesson_type = await db.scalar(select(TeacherLessonType).where(
         TeacherLessonType.teacher_id == teacher_id,
         TeacherLessonType.lesson_type_id == lesson_type_id
-    ).first()
+    ))
     if not existing_lesson_type:
         response.status_code = status.HTTP_204_NO_CONTENT
         return 'Преподаватель не связан с этим типом занятия'
 
-    db.delete(existing_lesson_type)
-    db.commit()
+    await db.delete(existing_lesson_type)
+    await db.commit()
 
     return 'Тип занятия преподавателя удалён успешно'
 
@@ -281,10 +282,10 @@ async def delete_teacher_lesson_type(
 async def create_teacher_group(
         teacher_id: uuid.UUID,
         group_id: uuid.UUID,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == teacher_id).options(joinedload(Teacher.user)))
     if not teacher:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -296,7 +297,7 @@ async def create_teacher_group(
             detail='Аккаунт преподавателя деактивирован'
         )
 
-    group = db.query(Group).where(Group.id == group_id).first()
+    group = await db.scalar(select(Group).where(Group.id == group_id))
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -308,10 +309,10 @@ async def create_teacher_group(
             detail='Группа не активна'
         )
 
-    existing_group = db.query(TeacherGroup).where(
+    existing_group = await db.scalar(select(TeacherGroup).where(
         TeacherGroup.teacher_id == teacher_id,
         TeacherGroup.group_id == group_id
-    ).first()
+    ))
     if existing_group:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -324,10 +325,9 @@ async def create_teacher_group(
     )
     db.add(teacher_group)
 
-    db.commit()
-    db.refresh(teacher)
+    await db.commit()
 
-    return teacher
+    return await load_with_options(db, Teacher, teacher.id, teacher_full_info_options())
 
 
 @router.delete('/groups/{teacher_id}/{group_id}')
@@ -335,42 +335,42 @@ async def delete_teacher_group(
         teacher_id: uuid.UUID,
         group_id: uuid.UUID,
         response: Response,
-        current_admin: Admin = Depends(get_current_admin),
-        db: Session = Depends(get_db)
+        current_admin: PrincipalRole = Depends(get_current_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == teacher_id))
     if not teacher:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Преподаватель не найден'
         )
 
-    group = db.query(Group).where(Group.id == group_id).first()
+    group = await db.scalar(select(Group).where(Group.id == group_id))
     if not group:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Группа не найдена'
         )
 
-    existing_group = db.query(TeacherGroup).where(
+    existing_group = await db.scalar(select(TeacherGroup).where(
         TeacherGroup.teacher_id == teacher_id,
         TeacherGroup.group_id == group_id
-    ).first()
+    ))
     if not existing_group:
         response.status_code = status.HTTP_204_NO_CONTENT
         return 'Преподаватель не связан с этой группой'
 
-    db.query(TeacherLesson).where(
+    await db.execute(delete(TeacherLesson).where(
         TeacherLesson.teacher_id == teacher_id,
-        db.query(Lesson).where(
+        select(Lesson).where(
             Lesson.id == TeacherLesson.lesson_id,
             Lesson.group_id == group_id,
             Lesson.start_time >= datetime.now(TIMEZONE)
         ).exists()
-    ).delete()
+    ))
 
-    db.delete(existing_group)
-    db.commit()
+    await db.delete(existing_group)
+    await db.commit()
 
     return 'Преподаватель успешно удалён из группы'
 
@@ -380,13 +380,13 @@ async def delete_teacher_group(
 async def create_teacher_lesson(
         teacher_id: uuid.UUID,
         lesson_id: uuid.UUID,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == teacher_id))
     check_teacher(teacher, current_user)
 
-    lesson = db.query(Lesson).where(Lesson.id == lesson_id).first()
+    lesson = await db.scalar(select(Lesson).where(Lesson.id == lesson_id))
     if not lesson:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -398,17 +398,17 @@ async def create_teacher_lesson(
             detail='Занятие отменено'
         )
 
-    existing_teacher_lesson = db.query(TeacherLesson).where(
+    existing_teacher_lesson = await db.scalar(select(TeacherLesson).where(
         TeacherLesson.teacher_id == teacher_id,
         TeacherLesson.lesson_id == lesson_id
-    ).first()
+    ))
     if existing_teacher_lesson:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Преподаватель уже связан с этим занятием'
         )
 
-    parallel_teacher_lesson = get_teacher_parallel_lesson(teacher_id, lesson.start_time, lesson.finish_time, db)
+    parallel_teacher_lesson = await get_teacher_parallel_lesson(teacher_id, lesson.start_time, lesson.finish_time, db)
     if parallel_teacher_lesson:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -421,10 +421,9 @@ async def create_teacher_lesson(
     )
     db.add(teacher_lesson)
 
-    db.commit()
-    db.refresh(lesson)
+    await db.commit()
 
-    return lesson
+    return await load_with_options(db, Lesson, lesson.id, lesson_full_info_options())
 
 
 @router.delete('/lessons/{teacher_id}/{lesson_id}')
@@ -432,13 +431,13 @@ async def delete_teacher_lesson(
         teacher_id: uuid.UUID,
         lesson_id: uuid.UUID,
         response: Response,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        current_user: Principal = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    teacher = db.query(Teacher).where(Teacher.id == teacher_id).first()
+    teacher = await db.scalar(select(Teacher).where(Teacher.id == teacher_id))
     check_teacher(teacher, current_user)
 
-    lesson = db.query(Lesson).where(Lesson.id == lesson_id).first()
+    lesson = await db.scalar(select(Lesson).where(Lesson.id == lesson_id))
     if not lesson:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -450,24 +449,20 @@ async def delete_teacher_lesson(
             detail='Занятие уже началось'
         )
 
-    existing_lesson = db.query(TeacherLesson).where(
+    existing_lesson = await db.scalar(select(TeacherLesson).where(
         TeacherLesson.teacher_id == teacher_id,
         TeacherLesson.lesson_id == lesson_id
-    ).first()
+    ))
     if not existing_lesson:
         response.status_code = status.HTTP_204_NO_CONTENT
         return 'Преподаватель не связан с этим занятием'
 
     if not lesson.group_id:
-        db.query(LessonSubscription).where(
-            LessonSubscription.lesson_id == lesson_id
-        ).update(
-            {LessonSubscription.cancelled: True}
-        )
+        await cancel_lesson_subscriptions(db, LessonSubscription.lesson_id == lesson_id)
 
         lesson.terminated = True
 
-    db.delete(existing_lesson)
-    db.commit()
+    await db.delete(existing_lesson)
+    await db.commit()
 
     return 'Преподаватель успешно удалён из занятия'
@@ -6,6 +6,9 @@ from sqlalchemy.orm import Session
 from app.auth.password import get_password_hash
 from app.database import get_db, TIMEZONE
 from app.models import *
+from app.rollups import get_rebuild_daily_subscription_sales_statements
+from app.slot_occurrences import get_extend_slot_occurrences_statements
+from app.subscription_lessons import get_repair_lessons_used_statements
 
 router = APIRouter(
     prefix='/test',
@@ -1428,4 +1431,9 @@ async def create_test_data(db: Session = Depends(get_db)):
     db.add(slot3)
     db.commit()
 
+    for statement in (get_rebuild_daily_subscription_sales_statements() + get_extend_slot_occurrences_statements()
+                      + get_repair_lessons_used_statements()):
+        db.execute(statement)
+    db.commit()
+
     return 'Тестовые данные созданы успешно'
@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 from app.schemas.user import UserInfo, UserUpdate, UserCreate, UserFilters
@@ -32,6 +32,8 @@ class AdminFullInfoWithRole(AdminFullInfo):
 class AdminPage(BaseModel):
     admins: List[AdminInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -40,6 +42,8 @@ class AdminPage(BaseModel):
 class AdminFullInfoPage(BaseModel):
     admins: List[AdminFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -25,6 +25,8 @@ class ClassroomInfo(ClassroomCreate):
 class ClassroomPage(BaseModel):
     classrooms: List[ClassroomInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -46,6 +48,33 @@ class ClassroomAvailableFilters(BaseModel):
         from_attributes = True
 
 
+class ClassroomBusyInterval(BaseModel):
+    start_time: datetime
+    finish_time: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class ClassroomScheduleItem(BaseModel):
+    classroom: ClassroomInfo
+    busy_intervals: List[ClassroomBusyInterval]
+
+    class Config:
+        from_attributes = True
+
+
+class ClassroomSchedule(BaseModel):
+    date_from: datetime
+    date_to: datetime
+    granularity_minutes: int
+    are_neighbours_allowed: bool
+    classrooms: List[ClassroomScheduleItem]
+
+    class Config:
+        from_attributes = True
+
+
 class ClassroomUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
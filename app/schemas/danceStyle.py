@@ -26,6 +26,8 @@ class DanceStyleInfo(DanceStyleCreate):
 class DanceStylePage(BaseModel):
     dance_styles: List[DanceStyleInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -36,6 +36,8 @@ class EventFullInfo(EventInfo):
 class EventPage(BaseModel):
     events: List[EventInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -44,6 +46,8 @@ class EventPage(BaseModel):
 class EventFullInfoPage(BaseModel):
     events: List[EventFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -25,6 +25,8 @@ class EventTypeInfo(EventTypeCreate):
 class EventTypePage(BaseModel):
     event_types: List[EventTypeInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
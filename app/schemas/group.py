@@ -52,6 +52,8 @@ class GroupWithSubscriptions(GroupFullInfo):
 class GroupPage(BaseModel):
     groups: List[GroupInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -60,6 +62,8 @@ class GroupPage(BaseModel):
 class GroupFullInfoPage(BaseModel):
     groups: List[GroupFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
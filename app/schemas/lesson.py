@@ -9,7 +9,7 @@ from app.schemas.lessonType import LessonTypeFullInfo
 from app.schemas.classroom import ClassroomInfo
 import uuid
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, date, time
 
 
 class LessonCreate(BaseModel):
@@ -68,6 +68,35 @@ class LessonCreateRequest(BaseModel):
         from_attributes = True
 
 
+class LessonSeriesCreate(BaseModel):
+    name: str
+    description: Optional[str] = None
+    lesson_type_id: uuid.UUID
+    classroom_id: Optional[uuid.UUID] = None
+    group_id: uuid.UUID
+    are_neighbours_allowed: bool
+    weekday: int
+    start_time: time
+    finish_time: time
+    date_from: date
+    date_to: Optional[date] = None
+    count: Optional[int] = None
+    skip_conflicts: bool = False
+
+    class Config:
+        from_attributes = True
+
+
+class LessonSeriesConflict(BaseModel):
+    start_time: datetime
+    finish_time: datetime
+    reasons: List[str]
+    lesson_ids: List[uuid.UUID]
+
+    class Config:
+        from_attributes = True
+
+
 class LessonResponse(BaseModel):
     is_confirmed: bool
     classroom_id: Optional[uuid.UUID] = None
@@ -106,9 +135,19 @@ class LessonWithSubscriptions(LessonFullInfo):
         from_attributes = True
 
 
+class LessonSeriesResult(BaseModel):
+    lessons: List[LessonInfo]
+    conflicts: List[LessonSeriesConflict]
+
+    class Config:
+        from_attributes = True
+
+
 class LessonPage(BaseModel):
     lessons: List[LessonInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -117,6 +156,8 @@ class LessonPage(BaseModel):
 class LessonFullInfoPage(BaseModel):
     lessons: List[LessonFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
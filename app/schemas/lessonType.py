@@ -34,6 +34,8 @@ class LessonTypeFullInfo(LessonTypeInfo):
 class LessonTypePage(BaseModel):
     lesson_types: List[LessonTypeInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -42,6 +44,8 @@ class LessonTypePage(BaseModel):
 class LessonTypeFullInfoPage(BaseModel):
     lesson_types: List[LessonTypeFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
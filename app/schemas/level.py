@@ -25,6 +25,8 @@ class LevelInfo(LevelCreate):
 class LevelPage(BaseModel):
     levels: List[LevelInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
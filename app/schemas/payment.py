@@ -37,6 +37,8 @@ class PaymentFullInfo(PaymentInfo):
 class PaymentPage(BaseModel):
     payments: List[PaymentInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -45,6 +47,8 @@ class PaymentPage(BaseModel):
 class PaymentFullInfoPage(BaseModel):
     payments: List[PaymentFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -24,6 +24,8 @@ class PaymentTypeInfo(PaymentTypeCreate):
 class PaymentTypePage(BaseModel):
     payment_types: List[PaymentTypeInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
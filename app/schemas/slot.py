@@ -44,6 +44,8 @@ class SlotAvailable(BaseModel):
 class SlotPage(BaseModel):
     slots: List[SlotInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -52,6 +54,18 @@ class SlotPage(BaseModel):
 class SlotFullInfoPage(BaseModel):
     slots: List[SlotFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class SlotAvailablePage(BaseModel):
+    slots: List[SlotAvailable]
+    total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -80,6 +94,20 @@ class SlotAvailableFilters(BaseModel):
         from_attributes = True
 
 
+class SlotAnyTeacherFilters(BaseModel):
+    lesson_type_id: uuid.UUID
+    date_from: datetime
+    date_to: datetime
+    duration_minutes: int = 60
+
+    preferred_start_time: Optional[time] = None
+    preferred_finish_time: Optional[time] = None
+    days_of_week: Optional[List[int]] = None
+
+    class Config:
+        from_attributes = True
+
+
 class SlotUpdate(BaseModel):
     teacher_id: Optional[uuid.UUID] = None
     day_of_week: Optional[int] = None
@@ -25,3 +25,76 @@ class SubscriptionPurchasesInterval(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class AttendanceFilters(BaseModel):
+    date_from: date
+    date_to: date
+    interval_in_days: int
+    group_ids: Optional[List[uuid.UUID]] = None
+    lesson_type_ids: Optional[List[uuid.UUID]] = None
+
+    class Config:
+        from_attributes = True
+
+
+class AttendanceInterval(BaseModel):
+    date_from: date
+    date_to: date
+    lesson_count: int
+    booked_seats: int
+    max_capacity: int
+
+    class Config:
+        from_attributes = True
+
+
+class ClassroomUtilizationFilters(BaseModel):
+    date_from: date
+    date_to: date
+    interval_in_days: int
+    classroom_ids: Optional[List[uuid.UUID]] = None
+
+    class Config:
+        from_attributes = True
+
+
+class ClassroomUtilizationInterval(BaseModel):
+    date_from: date
+    date_to: date
+    classroom_id: uuid.UUID
+    classroom_name: str
+    lesson_count: int
+    occupied_hours: float
+
+    class Config:
+        from_attributes = True
+
+
+class TeacherWorkloadFilters(BaseModel):
+    date_from: date
+    date_to: date
+    interval_in_days: int
+    teacher_ids: Optional[List[uuid.UUID]] = None
+    is_group: Optional[bool] = None
+    dance_style_ids: Optional[List[uuid.UUID]] = None
+
+    class Config:
+        from_attributes = True
+
+
+class TeacherWorkloadInterval(BaseModel):
+    date_from: date
+    date_to: date
+    teacher_id: uuid.UUID
+    first_name: str
+    middle_name: Optional[str] = None
+    last_name: str
+    lesson_type_id: uuid.UUID
+    dance_style_name: str
+    is_group: bool
+    lesson_count: int
+    hours: float
+
+    class Config:
+        from_attributes = True
@@ -46,6 +46,8 @@ class StudentFullInfoWithRole(StudentFullInfo):
 class StudentPage(BaseModel):
     students: List[StudentInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -54,6 +56,8 @@ class StudentPage(BaseModel):
 class StudentFullInfoPage(BaseModel):
     students: List[StudentFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
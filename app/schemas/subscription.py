@@ -37,6 +37,8 @@ class SubscriptionFullInfo(SubscriptionMoreInfo):
 class SubscriptionPage(BaseModel):
     subscriptions: List[SubscriptionInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -45,6 +47,8 @@ class SubscriptionPage(BaseModel):
 class SubscriptionFullInfoPage(BaseModel):
     subscriptions: List[SubscriptionFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -36,6 +36,8 @@ class SubscriptionTemplateFullInfo(SubscriptionTemplateInfo):
 class SubscriptionTemplatePage(BaseModel):
     subscription_templates: List[SubscriptionTemplateInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -44,6 +46,8 @@ class SubscriptionTemplatePage(BaseModel):
 class SubscriptionTemplateFullInfoPage(BaseModel):
     subscription_templates: List[SubscriptionTemplateFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
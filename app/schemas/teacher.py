@@ -42,6 +42,8 @@ class TeacherFullInfoWithRole(TeacherFullInfo):
 class TeacherPage(BaseModel):
     teachers: List[TeacherInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -50,6 +52,8 @@ class TeacherPage(BaseModel):
 class TeacherFullInfoPage(BaseModel):
     teachers: List[TeacherFullInfo]
     total: int
+    total_is_capped: bool = False
+    next_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
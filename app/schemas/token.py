@@ -1,17 +1,49 @@
 from pydantic import BaseModel
 from typing import Optional
+import uuid
 
 
 class Token(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: str
 
     class Config:
         from_attributes = True
 
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+
 class TokenData(BaseModel):
     id: Optional[str] = None
+    token_type: Optional[str] = None
+    version: Optional[int] = None
+    jti: Optional[str] = None
+    admin_id: Optional[uuid.UUID] = None
+    teacher_id: Optional[uuid.UUID] = None
+    student_id: Optional[uuid.UUID] = None
+
+    class Config:
+        from_attributes = True
+
+
+class PrincipalRole(BaseModel):
+    id: uuid.UUID
+    user_id: uuid.UUID
+
+    class Config:
+        from_attributes = True
+
+
+class Principal(BaseModel):
+    id: uuid.UUID
+    terminated: bool
+    email_confirmed: bool
+    admin: Optional[PrincipalRole] = None
+    teacher: Optional[PrincipalRole] = None
+    student: Optional[PrincipalRole] = None
 
     class Config:
         from_attributes = True
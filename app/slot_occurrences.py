@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import select, delete, func, extract, literal, true, Date
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import AsyncSessionLocal, TIMEZONE
+from app.models import Slot, SlotOccurrence
+
+SLOT_OCCURRENCES_WEEKS_AHEAD = settings.SLOT_OCCURRENCES_WEEKS_AHEAD
+SLOT_OCCURRENCES_REFRESH_INTERVAL_SECONDS = settings.SLOT_OCCURRENCES_REFRESH_INTERVAL_SECONDS
+
+
+def insert_slot_occurrences(*criteria):
+    # Повторения выбранных слотов с сегодняшнего дня на SLOT_OCCURRENCES_WEEKS_AHEAD недель вперёд,
+    # уже сохранённые повторения пропускаются
+    today = datetime.now(TIMEZONE).date()
+    day_offsets = func.generate_series(0, SLOT_OCCURRENCES_WEEKS_AHEAD * 7 - 1).table_valued('offset').render_derived()
+    day = literal(today, Date) + day_offsets.c.offset
+
+    occurrences = select(
+        func.gen_random_uuid(),
+        Slot.id,
+        Slot.teacher_id,
+        # Дата со временем с часовым поясом даёт момент времени в поясе слота
+        day + Slot.start_time,
+        day + Slot.end_time,
+        func.now()
+    ).join(
+        day_offsets,
+        true()
+    ).where(
+        extract('isodow', day) - 1 == Slot.day_of_week,
+        *criteria
+    )
+
+    return insert(SlotOccurrence).from_select(
+        ['id', 'slot_id', 'teacher_id', 'start_time', 'finish_time', 'created_at'],
+        occurrences
+    ).on_conflict_do_nothing(
+        index_elements=[SlotOccurrence.slot_id, SlotOccurrence.start_time]
+    )
+
+
+async def refresh_slot_occurrences(db: AsyncSession, slot):
+    # Пересоздаёт повторения слота в той же транзакции, что и изменение слота
+    await db.flush()
+    await db.execute(delete(SlotOccurrence).where(SlotOccurrence.slot_id == slot.id))
+    await db.execute(insert_slot_occurrences(Slot.id == slot.id))
+
+
+def get_extend_slot_occurrences_statements():
+    return [
+        delete(SlotOccurrence).where(SlotOccurrence.finish_time < func.now()),
+        insert_slot_occurrences()
+    ]
+
+
+async def extend_slot_occurrences(db: AsyncSession):
+    for statement in get_extend_slot_occurrences_statements():
+        await db.execute(statement)
+
+
+async def run_slot_occurrences_worker():
+    # Сдвигает окно повторений вперёд по мере наступления новых дней
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                await extend_slot_occurrences(db)
+                await db.commit()
+        except Exception as e:
+            print(f'Ошибка при продлении повторений слотов: {e}')
+        await asyncio.sleep(SLOT_OCCURRENCES_REFRESH_INTERVAL_SECONDS)
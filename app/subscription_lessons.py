@@ -0,0 +1,72 @@
+from fastapi import HTTPException, status
+from sqlalchemy import select, update, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Subscription, SubscriptionTemplate, LessonSubscription
+
+
+# Счётчик lessons_used меняется только условными UPDATE, без чтения в Python, поэтому параллельные
+# записи и отмены не теряют изменений. Ответы перечитывают абонементы, так что объекты сессии не синхронизируются
+
+async def use_subscription_lesson(subscription_id, db: AsyncSession):
+    # Списывает занятие, только если в абонементе ещё остались занятия
+    await db.flush()
+    used_subscription_id = await db.scalar(update(Subscription).where(
+        Subscription.id == subscription_id,
+        Subscription.lessons_used < select(SubscriptionTemplate.lesson_count).where(
+            SubscriptionTemplate.id == Subscription.subscription_template_id
+        ).scalar_subquery()
+    ).values(
+        {Subscription.lessons_used: Subscription.lessons_used + 1}
+    ).returning(Subscription.id).execution_options(synchronize_session=False))
+    if not used_subscription_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='В абонементе не осталось занятий'
+        )
+
+
+async def cancel_lesson_subscriptions(db: AsyncSession, *criteria):
+    # Отменяет записи на занятия и возвращает занятия в абонементы одним запросом
+    cancelled = update(LessonSubscription).where(
+        LessonSubscription.cancelled == False,
+        *criteria
+    ).values(
+        {LessonSubscription.cancelled: True}
+    ).returning(LessonSubscription.subscription_id).cte('cancelled')
+    cancelled_counts = select(
+        cancelled.c.subscription_id,
+        func.count().label('count')
+    ).group_by(
+        cancelled.c.subscription_id
+    ).subquery()
+
+    await db.execute(update(Subscription).where(
+        Subscription.id == cancelled_counts.c.subscription_id
+    ).values(
+        {Subscription.lessons_used: Subscription.lessons_used - cancelled_counts.c.count}
+    ).execution_options(synchronize_session=False))
+
+
+def get_repair_lessons_used_statements():
+    # Блокировка не даёт записываться на занятия и отменять записи, пока счётчики пересчитываются
+    active_lesson_count = select(func.count(LessonSubscription.id)).where(
+        LessonSubscription.subscription_id == Subscription.id,
+        LessonSubscription.cancelled == False
+    ).scalar_subquery()
+
+    return [
+        text(f'LOCK TABLE {LessonSubscription.__tablename__} IN SHARE MODE'),
+        update(Subscription).where(
+            Subscription.lessons_used != active_lesson_count
+        ).values(
+            {Subscription.lessons_used: active_lesson_count}
+        ).returning(Subscription.id).execution_options(synchronize_session=False)
+    ]
+
+
+async def repair_lessons_used(db: AsyncSession):
+    # Возвращает количество абонементов с исправленным счётчиком
+    lock, repair = get_repair_lessons_used_statements()
+    await db.execute(lock)
+    return len((await db.scalars(repair)).all())
@@ -0,0 +1,240 @@
+import argparse
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+SMTP_SINK_HOST = '127.0.0.1'
+SMTP_SINK_PORT = 8025
+
+# Настройки читаются при импорте приложения: письма уходят в локальный SMTP-сервер,
+# а очередь писем разбирается самим бенчмарком, а не фоновым обработчиком
+os.environ.update(
+    SMTP_HOST=SMTP_SINK_HOST,
+    SMTP_PORT=str(SMTP_SINK_PORT),
+    SMTP_USE_SSL='false',
+    EMAIL_OUTBOX_WORKER_ENABLED='false'
+)
+
+from fastapi.testclient import TestClient
+from sqlalchemy import select, func, insert, update
+
+from app.auth.password import get_password_hash
+from app.database import SessionLocal, TIMEZONE
+from app.email import send_email_outbox
+from app.main import app
+from app.models import *
+from benchmarks.smtp_sink import SMTPSink
+
+PASSWORD = '12345678'
+
+
+def create_user(email, first_name, hashed_password, phone_number):
+    return User(
+        email=email,
+        email_confirmed=True,
+        receive_email=True,
+        hashed_password=hashed_password,
+        first_name=first_name,
+        last_name='Бенчмарк',
+        phone_number=phone_number
+    )
+
+
+def seed(users_count):
+    # Уникальный суффикс позволяет запускать бенчмарк повторно на той же базе
+    run_id = uuid.uuid4().hex[:8]
+    hashed_password = get_password_hash(PASSWORD)
+
+    with SessionLocal() as db:
+        admin = Admin(
+            user=create_user(f'admin.{run_id}@benchmark.example.com', 'Админ', hashed_password, f'a{run_id}')
+        )
+        teacher = Teacher(
+            user=create_user(f'teacher.{run_id}@benchmark.example.com', 'Преподаватель', hashed_password, f't{run_id}')
+        )
+        dance_style = DanceStyle(name=f'Стиль {run_id}')
+        lesson_type = LessonType(dance_style=dance_style, is_group=True)
+        level = Level(name=f'Уровень {run_id}')
+        group = Group(name=f'Группа {run_id}', level=level, max_capacity=users_count)
+        classroom = Classroom(name=f'Зал {run_id}')
+        event_type = EventType(name=f'Тип мероприятия {run_id}')
+        subscription_template = SubscriptionTemplate(name=f'Абонемент {run_id}', lesson_count=1000, price=0)
+        db.add_all([admin, teacher, lesson_type, group, classroom, event_type, subscription_template])
+        db.flush()
+        db.add_all([
+            TeacherGroup(teacher_id=teacher.id, group_id=group.id),
+            TeacherLessonType(teacher_id=teacher.id, lesson_type_id=lesson_type.id),
+            SubscriptionLessonType(subscription_template_id=subscription_template.id, lesson_type_id=lesson_type.id)
+        ])
+
+        user_rows = [{
+            'id': uuid.uuid4(),
+            'email': f'student{number}.{run_id}@benchmark.example.com',
+            'email_confirmed': True,
+            'receive_email': True,
+            'hashed_password': hashed_password,
+            'first_name': f'Ученик {number}',
+            'last_name': 'Бенчмарк',
+            'phone_number': f's{run_id}{number}'
+        } for number in range(users_count)]
+        student_rows = [{'id': uuid.uuid4(), 'user_id': row['id'], 'level_id': level.id} for row in user_rows]
+        db.execute(insert(User), user_rows)
+        db.execute(insert(Student), student_rows)
+        db.execute(insert(StudentGroup), [
+            {'student_id': row['id'], 'group_id': group.id} for row in student_rows
+        ])
+        db.execute(insert(Subscription), [{
+            'id': uuid.uuid4(),
+            'student_id': row['id'],
+            'subscription_template_id': subscription_template.id
+        } for row in student_rows])
+        db.commit()
+
+        return {
+            'admin_email': admin.user.email,
+            'teacher_email': teacher.user.email,
+            'lesson_type_id': str(lesson_type.id),
+            'group_id': str(group.id),
+            'classroom_id': str(classroom.id),
+            'event_type_id': str(event_type.id),
+            'subscription_template_id': subscription_template.id
+        }
+
+
+def get_pending_email_count():
+    with SessionLocal() as db:
+        return db.scalar(select(func.count(EmailOutbox.id)).where(EmailOutbox.status == EMAIL_PENDING))
+
+
+def drain_email_outbox():
+    count = 0
+    while sent_count := send_email_outbox():
+        count += sent_count
+    return count
+
+
+def book_group(lesson_id, subscription_template_id):
+    # Все ученики группы записываются на занятие, чтобы изменения рассылались по записям
+    with SessionLocal() as db:
+        subscription_ids = db.scalars(select(Subscription.id).where(
+            Subscription.subscription_template_id == subscription_template_id
+        )).all()
+        db.execute(insert(LessonSubscription), [
+            {'lesson_id': lesson_id, 'subscription_id': subscription_id} for subscription_id in subscription_ids
+        ])
+        # Счётчики занятий меняются вместе с записями, иначе отмена занятия уведёт их в минус
+        db.execute(update(Subscription).where(
+            Subscription.id.in_(subscription_ids)
+        ).values(
+            {Subscription.lessons_used: Subscription.lessons_used + 1}
+        ))
+        db.commit()
+
+
+def run_scenario(name, sink, repeat, send_request, prepare=None):
+    latencies = []
+    queued_count = 0
+    delivery_seconds = 0.0
+
+    for iteration in range(repeat):
+        context = prepare(iteration) if prepare else None
+        # Письма подготовки не учитываются
+        drain_email_outbox()
+
+        started_at = time.perf_counter()
+        response = send_request(iteration, context)
+        latencies.append(time.perf_counter() - started_at)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name}: {response.status_code} {response.text}')
+
+        pending_count = get_pending_email_count()
+        received_count = sink.received_count
+        started_at = time.perf_counter()
+        drain_email_outbox()
+        sink.wait_for(received_count + pending_count)
+        delivery_seconds += time.perf_counter() - started_at
+        queued_count += pending_count
+
+    return {
+        'name': name,
+        'median_ms': statistics.median(latencies) * 1000,
+        'max_ms': max(latencies) * 1000,
+        'emails': queued_count,
+        'emails_per_second': queued_count / delivery_seconds if delivery_seconds else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка запросов с рассылкой и скорость отправки писем')
+    parser.add_argument('--users', type=int, default=1000, help='количество учеников-получателей')
+    parser.add_argument('--repeat', type=int, default=5, help='повторов каждого сценария')
+    args = parser.parse_args()
+
+    with SMTPSink(SMTP_SINK_HOST, SMTP_SINK_PORT) as sink, TestClient(app) as client:
+        data = seed(args.users)
+
+        def login(email):
+            response = client.post('/auth/token', data={'username': email, 'password': PASSWORD})
+            return {'Authorization': 'Bearer ' + response.json()['access_token']}
+
+        admin_headers = login(data['admin_email'])
+        teacher_headers = login(data['teacher_email'])
+        base_time = datetime.now(TIMEZONE).replace(hour=12, minute=0, second=0, microsecond=0) + timedelta(days=30)
+
+        def lesson_times(iteration, shift=timedelta()):
+            start_time = base_time + timedelta(days=iteration) + shift
+            return {
+                'start_time': start_time.isoformat(),
+                'finish_time': (start_time + timedelta(hours=1)).isoformat()
+            }
+
+        def create_group_lesson(iteration, context=None):
+            return client.post('/lessons/group', headers=teacher_headers, json={
+                'name': f'Занятие {iteration}',
+                'lesson_type_id': data['lesson_type_id'],
+                'classroom_id': data['classroom_id'],
+                'group_id': data['group_id'],
+                'are_neighbours_allowed': True,
+                **lesson_times(iteration)
+            })
+
+        def create_booked_lesson(iteration):
+            # Сдвиг по дням не пересекается с занятиями других сценариев
+            lesson_id = create_group_lesson(iteration + args.repeat).json()['id']
+            book_group(lesson_id, data['subscription_template_id'])
+            return lesson_id
+
+        def create_event(iteration, context=None):
+            return client.post('/events/', headers=admin_headers, json={
+                'name': f'Мероприятие {iteration}',
+                'event_type_id': data['event_type_id'],
+                'start_time': (base_time + timedelta(days=iteration)).isoformat()
+            })
+
+        def reschedule_lesson(iteration, lesson_id):
+            return client.patch(f'/lessons/{lesson_id}', headers=admin_headers,
+                                json=lesson_times(iteration + args.repeat, timedelta(hours=2)))
+
+        def cancel_lesson(iteration, lesson_id):
+            return client.patch(f'/lessons/{lesson_id}', headers=admin_headers, json={'terminated': True})
+
+        drain_email_outbox()
+        results = [
+            run_scenario('create_event', sink, args.repeat, create_event),
+            run_scenario('create_group_lesson', sink, args.repeat, create_group_lesson),
+            run_scenario('patch_lesson (перенос)', sink, args.repeat, reschedule_lesson, create_booked_lesson),
+            run_scenario('patch_lesson (отмена)', sink, args.repeat, cancel_lesson,
+                         lambda iteration: create_booked_lesson(iteration + args.repeat))
+        ]
+
+    print(f'Получателей: {args.users}, повторов: {args.repeat}')
+    print(f'{"сценарий":<24} {"медиана, мс":>12} {"максимум, мс":>13} {"писем":>8} {"писем/с":>9}')
+    for result in results:
+        print(f'{result["name"]:<24} {result["median_ms"]:>12.1f} {result["max_ms"]:>13.1f} '
+              f'{result["emails"]:>8} {result["emails_per_second"]:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
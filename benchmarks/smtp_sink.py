@@ -0,0 +1,42 @@
+import threading
+import time
+
+from aiosmtpd.controller import Controller
+
+
+class CountingHandler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received_count = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.lock:
+            self.received_count += 1
+        return '250 OK'
+
+
+class SMTPSink:
+    # Локальный SMTP-сервер в отдельном потоке: принимает письма без отправки и считает их.
+    # Приложение подключается к нему с SMTP_USE_SSL=false
+    def __init__(self, host='127.0.0.1', port=8025):
+        self.handler = CountingHandler()
+        self.controller = Controller(self.handler, hostname=host, port=port)
+
+    @property
+    def received_count(self):
+        with self.handler.lock:
+            return self.handler.received_count
+
+    def wait_for(self, count, timeout=60):
+        deadline = time.monotonic() + timeout
+        while self.received_count < count:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Получено {self.received_count} писем из {count}')
+            time.sleep(0.01)
+
+    def __enter__(self):
+        self.controller.start()
+        return self
+
+    def __exit__(self, *args):
+        self.controller.stop()
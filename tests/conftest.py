@@ -0,0 +1,57 @@
+import os
+
+import pytest
+from sqlalchemy import make_url
+
+# Тесты работают с отдельной базой PostgreSQL: она создаётся при необходимости и заполняется тестовыми данными,
+# поэтому адрес задаётся явно, а не берётся из DATABASE_URL приложения
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+if TEST_DATABASE_URL:
+    os.environ.update(
+        DATABASE_URL=TEST_DATABASE_URL,
+        DATABASE_NAME=make_url(TEST_DATABASE_URL).database,
+        EMAIL_OUTBOX_WORKER_ENABLED='false',
+        SLOT_OCCURRENCES_WORKER_ENABLED='false'
+    )
+    for name, value in {
+        'APP_NAME': 'dance-fast-api',
+        'APP_VERSION': 'test',
+        'DEBUG': 'false',
+        'HOST': 'localhost',
+        'PORT': '8000',
+        'SECRET_KEY': 'test',
+        'SENDER_EMAIL': 'test@example.com',
+        'SENDER_PASSWORD': 'test',
+        'SMTP_HOST': 'localhost',
+        'SMTP_PORT': '25'
+    }.items():
+        os.environ.setdefault(name, value)
+
+
+@pytest.fixture(scope='session')
+def client():
+    if not TEST_DATABASE_URL:
+        pytest.skip('Не задан TEST_DATABASE_URL')
+
+    from fastapi.testclient import TestClient
+
+    from app.database import engine, init_db, Base
+    from app.main import app
+
+    init_db()
+    Base.metadata.drop_all(bind=engine)
+
+    # Таблицы создаются при запуске приложения, фоновые обработчики отключены настройками выше.
+    # Клиент держит один цикл событий на все запросы, иначе пул асинхронных подключений к нему не привязать
+    with TestClient(app) as client:
+        response = client.post('/test/')
+        assert response.status_code == 201, response.text
+        yield client
+
+
+@pytest.fixture(scope='session')
+def admin_headers(client):
+    response = client.post('/auth/token', data={'username': 'max@admin.com', 'password': '12345678'})
+    assert response.status_code == 200, response.text
+    return {'Authorization': 'Bearer ' + response.json()['access_token']}
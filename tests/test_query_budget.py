@@ -0,0 +1,99 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event, select
+
+PAGE_SIZE = 100
+
+# Количество запросов на страницу полной информации не должно зависеть от числа строк на странице,
+# в бюджет входят и запросы авторизации
+LESSONS_FULL_INFO_QUERY_BUDGET = 10
+GROUPS_FULL_INFO_QUERY_BUDGET = 6
+SUBSCRIPTIONS_FULL_INFO_QUERY_BUDGET = 4
+
+
+@contextmanager
+def count_queries():
+    from app.database import async_engine
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(async_engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.fixture(scope='module')
+def seeded(client, admin_headers):
+    from app.database import SessionLocal
+    from app.models import Group, Level, LessonType, Teacher, Student, TeacherGroup, StudentGroup, Subscription, \
+        SubscriptionTemplate, Payment, PaymentType
+
+    with SessionLocal() as db:
+        group = db.scalars(select(Group).where(Group.terminated == False)).first()
+        lesson_type = db.scalars(select(LessonType).where(LessonType.is_group == True)).first()
+        level = db.scalars(select(Level)).first()
+        teachers = db.scalars(select(Teacher)).all()
+        students = db.scalars(select(Student)).all()
+        subscription_template = db.scalars(select(SubscriptionTemplate)).first()
+        payment_type = db.scalars(select(PaymentType)).first()
+
+        groups = [
+            Group(name=f'Группа для проверки запросов {number}', level_id=level.id, max_capacity=len(students))
+            for number in range(PAGE_SIZE)
+        ]
+        db.add_all(groups)
+        db.flush()
+        db.add_all([
+            TeacherGroup(teacher_id=teacher.id, group_id=group.id) for group in groups for teacher in teachers
+        ])
+        db.add_all([
+            StudentGroup(student_id=student.id, group_id=group.id) for group in groups for student in students
+        ])
+
+        payments = [Payment(payment_type_id=payment_type.id) for _ in range(PAGE_SIZE)]
+        db.add_all(payments)
+        db.flush()
+        db.add_all([
+            Subscription(
+                student_id=students[number % len(students)].id,
+                subscription_template_id=subscription_template.id,
+                payment_id=payment.id
+            ) for number, payment in enumerate(payments)
+        ])
+        db.commit()
+
+        group_id, lesson_type_id = str(group.id), str(lesson_type.id)
+
+    response = client.post('/lessons/series', headers=admin_headers, json={
+        'name': 'Серия для проверки запросов',
+        'lesson_type_id': lesson_type_id,
+        'group_id': group_id,
+        'are_neighbours_allowed': True,
+        'weekday': 0,
+        'start_time': '07:00',
+        'finish_time': '08:00',
+        'date_from': (date.today() + timedelta(days=1)).isoformat(),
+        'count': PAGE_SIZE
+    })
+    assert response.status_code == 201, response.text
+
+
+@pytest.mark.parametrize('url, key, budget', [
+    ('/lessons/search/admin/full-info', 'lessons', LESSONS_FULL_INFO_QUERY_BUDGET),
+    ('/groups/search/full-info', 'groups', GROUPS_FULL_INFO_QUERY_BUDGET),
+    ('/subscriptions/search/full-info', 'subscriptions', SUBSCRIPTIONS_FULL_INFO_QUERY_BUDGET)
+])
+def test_full_info_page_query_budget(client, admin_headers, seeded, url, key, budget):
+    with count_queries() as statements:
+        response = client.post(url, headers=admin_headers, params={'limit': PAGE_SIZE}, json={})
+
+    assert response.status_code == 200, response.text
+    assert len(response.json()[key]) == PAGE_SIZE
+    assert len(statements) <= budget, '\n\n'.join(statements)